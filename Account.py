@@ -1,13 +1,46 @@
 from datetime import datetime, timedelta
-from typing import List
-import scrapetube
+from typing import List, Set
 import os
 import pickle
 import random
+import re
+import tempfile
 
 from constants import *
+from History import History
+from Inventory import Inventory
+from tracer import trace
 from util import create_directory
 
+# Recent scrapes of each channel, shared by every account
+channel_cache = {}
+
+
+# Days in each unit of the relative dates of YouTube (ex: "3 weeks ago")
+AGE_UNITS = {
+    "second": 1 / 86400,
+    "minute": 1 / 1440,
+    "hour": 1 / 24,
+    "day": 1,
+    "week": 7,
+    "month": 30,
+    "year": 365,
+}
+
+
+def age_to_days(published: str) -> float | None:
+    """
+    Args:
+        published (str): relative date of a video (ex: "2 weeks ago", "Streamed 1 day ago").
+
+    Returns:
+        float | None: age of the video in days, None if the date couldn't be read.
+    """
+    match = re.search(r"(\d+)\s+(second|minute|hour|day|week|month|year)", published)
+    if not match:
+        return None
+    return int(match.group(1)) * AGE_UNITS[match.group(2)]
+
 
 class Account:
     def __init__(self, email: str) -> None:
@@ -24,14 +57,28 @@ class Account:
         Args:
             start_date (datetime): it is *optional* to specify a start date to see what dates are available from then on.
         """
+        next_datetime = self.get_next_slot(start_date)
 
+        # Check if the date is more than 10 days after today
+        if next_datetime > datetime.now() + timedelta(days=MAX_DAYS):
+            return None
+        else:
+            return next_datetime
+
+    def get_next_slot(self, start_date: datetime | None = None) -> datetime:
+        """
+        Returns the next time in the account's schedule, even if it is too far ahead to be scheduled.
+
+        Args:
+            start_date (datetime): it is *optional* to specify a start date, the latest video by default.
+        """
         if start_date:
             last_video_date = start_date
-        elif len(self.videos) == 0:
+        elif self.history.latest is None:
             last_video_date = datetime.now()
         else:
             # Get latest video
-            last_video_date = max(self.videos, key=lambda x: x["date"])["date"]
+            last_video_date = self.history.latest.date
 
         # Extract time part from the schedule
         schedule_times = [
@@ -48,25 +95,39 @@ class Account:
                 next_datetime = datetime.combine(next_date, time)
                 # If the next_datetime is after the last_video_date, return it
                 if next_datetime > last_video_date:
-                    # Check if the date is more than 10 days after today
-                    if next_datetime > datetime.now() + timedelta(days=MAX_DAYS):
-                        return None
-                    else:
-                        return next_datetime
+                    return next_datetime
             # If no available time slots on the current date, try the next day
             next_date += timedelta(days=1)
 
+    def get_valid_dates(self, lookahead: timedelta = timedelta(0)) -> List[datetime]:
+        """
+        TikTok allows users to schedule videos up to 10 days in advance
+
+        Args:
+            lookahead (timedelta): also include the dates that can be scheduled within this time.
+
+        Returns:
+            List[datetime]: list of available dates to post a video, in order
+        """
+        max_date = datetime.now() + timedelta(days=MAX_DAYS) + lookahead
+
+        valid_dates = []
+        date = self.get_next_slot()
+        while date <= max_date:
+            valid_dates.append(date)
+            date = self.get_next_slot(date)
+        return valid_dates
+
     def last_scheduled_video(self) -> dict | None:
         """
         Returns:
             dict: info about the latest scheduled video
         """
-        # Return none if list is empty
-        if not self.videos:
+        # Return none if there is no history
+        if self.history.latest is None:
             return None
 
-        latest_item = max(self.videos, key=lambda x: x["date"])
-        return latest_item
+        return self.history.latest.to_dict()
 
     def get_processed_videos(self) -> List[str]:
         """
@@ -75,64 +136,74 @@ class Account:
         Returns:
             List[str]: list of absolute file paths to video files.
         """
-        # Create the output dir if necessary
-        create_directory(OUTPUT_PATH)
-
-        # Get videos from the dir
-        videos = os.listdir(OUTPUT_PATH)
-
-        account_videos = []
-        for video in videos:
-            # Check if the file is owned by the user (ex: "email@example.com,0,XQIu5tZ0vbQ.mp4")
-            if video.split(",")[0] == self.email:
-                full_path = os.path.join(os.getcwd(), OUTPUT_PATH, video)
-                account_videos.append(full_path)
+        clips = Inventory().get_account_clips(self.email)
+        return [os.path.abspath(clip["path"]) for clip in clips]
 
-        return account_videos
-
-    def get_videos(self, n_videos: int) -> List[dict]:
+    def get_videos(self, n_videos: int, n_slots: int | None = None) -> List[str]:
         """
         Finds YouTube videos that haven't been used before.
 
         Args:
             n_videos (int): number of videos to return
+            n_slots (int): schedule slots each video should fill, the videos whose length
+                fits them best are returned first (see score_video). In channel order by default.
 
         Returns:
-            List[dict]: list of YouTube videos
+            List[str]: list of YouTube video IDs
+        """
+        return [candidate["id"] for candidate in self.get_candidates(n_videos, n_slots)]
+
+    def get_candidates(self, n_videos: int, n_slots: int | None = None) -> List[dict]:
+        """
+        Same as get_videos, with the length and age of each video (see get_channel_candidates).
         """
         # Get videos from the account channels
-        channel_videos = []
+        candidates = []
         for channel in self.channels:
-            videos = self.get_channel_videos(channel)
-            channel_videos.extend(videos)
+            candidates.extend(self.get_channel_candidates(channel))
+
+        # Filter out the already processed videos, and the ones in several channels
+        used_ids = self.get_used_videos()
+        unused = []
+        for candidate in candidates:
+            if candidate["id"] not in used_ids:
+                used_ids.add(candidate["id"])
+                unused.append(candidate)
 
-        # Filter out the already processed videos
-        used_videos = self.get_used_videos()
-        for used_video in used_videos:
-            if used_videos in channel_videos:
-                channel_videos.remove(used_video)
+        if n_slots:
+            unused.sort(key=lambda candidate: self.score_video(candidate, n_slots))
 
-        return channel_videos[:n_videos]
+        return unused[:n_videos]
 
-    def get_used_videos(self) -> List[str]:
+    def score_video(self, candidate: dict, n_slots: int) -> float:
         """
+        Estimates how wasteful it would be to use a video to fill some schedule slots: the
+        seconds rendered beyond them, the slots it leaves empty and how old it is.
+
+        Args:
+            candidate (dict): see get_channel_candidates.
+            n_slots (int): schedule slots to fill.
+
         Returns:
-            List[str]: list of unique video IDs (unused videos)
+            float: the lower the better, 0 for a fresh video exactly as long as the slots.
         """
-        # Find the unique videos in the list of posted videos
-        unique_ids = []
-        for video in self.videos:
-            if video["id"] not in unique_ids:
-                unique_ids.append(video["id"])
+        # Each slot takes a clip of the account's length
+        needed = n_slots * self.clip_length
+        excess = max(candidate["duration"] - needed, 0) / needed
+        shortfall = max(needed - candidate["duration"], 0) / needed
+
+        # Videos whose date is unknown count as a year old
+        age = candidate["age"] if candidate["age"] is not None else 365
+        freshness = min(age / 365, 1)
 
-        # Add used videos to the list
-        clips = os.listdir(OUTPUT_PATH)
-        for clip in clips:
-            id = clip.split(",")[2]
-            if id not in unique_ids:
-                unique_ids.append(id)
+        return excess + SELECTION_SHORTFALL_WEIGHT * shortfall + SELECTION_AGE_WEIGHT * freshness
 
-        return unique_ids
+    def get_used_videos(self) -> Set[str]:
+        """
+        Returns:
+            Set[str]: IDs of the videos posted, archived posts included, or with pending clips
+        """
+        return self.history.get_ids() | Inventory().get_source_ids()
 
     def get_channel_videos(self, channel_username: str) -> List[str]:
         """
@@ -142,17 +213,50 @@ class Account:
         Returns:
             List[str]: list of videos from a channel
         """
-        videos = scrapetube.get_channel(channel_username=channel_username, limit=60)
+        return [candidate["id"] for candidate in self.get_channel_candidates(channel_username)]
+
+    def get_channel_candidates(self, channel_username: str) -> List[dict]:
+        """
+        Args:
+            channel_username (str): username of a channel (ex: CodeBullet)
+
+        Returns:
+            List[dict]: videos from a channel that aren't longer than video_length, most
+            recent first (ex: [{"id": "dQw4w9WgXcQ", "duration": 212, "age": 14}, ...]),
+            the age is in days and None if it is unknown.
+        """
+        # Long running processes (ex: the daemon) reuse recent scrapes
+        cached = channel_cache.get(channel_username)
+        if cached and cached["time"] > datetime.now() - timedelta(
+            seconds=CHANNEL_CACHE_TTL
+        ):
+            videos = cached["videos"]
+        else:
+            # scrapetube pulls in requests, so it is only loaded when needed
+            import scrapetube
+
+            with trace("scrape", channel=channel_username):
+                # scrapetube is lazy, the channel is only fetched while iterating
+                videos = list(
+                    scrapetube.get_channel(channel_username=channel_username, limit=60)
+                )
+            channel_cache[channel_username] = {"time": datetime.now(), "videos": videos}
 
         # Filter out videos that are longer than the video_length specified for the account
-        output_videos = []
+        candidates = []
         for video in videos:
+            # Live streams and premieres have no length yet
+            if "lengthText" not in video:
+                continue
+
             duration = self.duration_to_seconds(video["lengthText"]["simpleText"])
             if duration <= self.video_length:
-                output_videos.append(video["videoId"])
+                published = video.get("publishedTimeText", {}).get("simpleText", "")
+                candidates.append(
+                    {"id": video["videoId"], "duration": duration, "age": age_to_days(published)}
+                )
 
-        # Shuffle to not get the very most recent videos
-        return output_videos
+        return candidates
 
     def duration_to_seconds(self, duration: str):
         """
@@ -183,8 +287,8 @@ class Account:
         if not date_posted:
             date_posted = datetime.now()
 
-        # Add the video to the list along with the date it was posted
-        self.videos.append({"id": id, "date": date_posted})
+        # Add the video to the history along with the date it was posted
+        self.history.add(id, date_posted)
 
         # Save if necessary
         if save:
@@ -204,7 +308,9 @@ class Account:
         # Account data
         self.email = data["email"]
         self.cookies = data["cookies"]
-        self.videos = data["videos"]
+        self.history = History(
+            data["videos"], os.path.join(HISTORY_ARCHIVE_PATH, self.email + ".jsonl")
+        )
         self.channels = data["channels"]
         self.schedule = data["schedule"]
 
@@ -216,14 +322,18 @@ class Account:
 
     def save(self):
         """
-        Applies any changes to the account file.
+        Applies any changes to the account file. The file is replaced at once, so a process
+        loading the account never reads it half written.
         """
         data = {}  # init
 
+        # Old posts are moved to the archive, so the file stays small
+        self.history.archive()
+
         # Account data
         data["email"] = self.email
         data["cookies"] = self.cookies
-        data["videos"] = self.videos
+        data["videos"] = self.history.to_list()
         data["channels"] = self.channels
         data["schedule"] = self.schedule
 
@@ -233,8 +343,17 @@ class Account:
         data["clip_length"] = self.clip_length
         data["video_length"] = self.video_length
 
-        with open(self.account_path, "wb") as file:
-            pickle.dump(data, file)
+        # Each save writes its own temporary file, so concurrent saves don't mix
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.account_path), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as file:
+                pickle.dump(data, file)
+            os.replace(temp_path, self.account_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
 
     @classmethod
     def create(
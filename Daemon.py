@@ -0,0 +1,353 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+import threading
+import logging
+import signal
+import json
+import time
+import os
+
+from Account import Account
+from Inventory import reset_pruning
+from Journal import reset_compaction
+from SessionManager import EXPIRED, SessionExpiredError, SessionManager
+from constants import *
+import tracer
+
+logger = logging.getLogger(__name__)
+
+# States of an account in the daemon
+WAITING = "waiting"  # sleeping until its next schedule slot
+QUEUED = "queued"  # due, waiting for a free worker
+RUNNING = "running"  # being rendered or scheduled
+LOGIN_REQUIRED = "login_required"  # skipped until someone logs in again
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """
+    Serves the status of the daemon as JSON (ex: curl http://127.0.0.1:8765).
+    """
+
+    server: "StatusServer"
+
+    def do_GET(self):
+        content = json.dumps(self.server.daemon.get_status(), indent=2).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # Polling the status would flood the log
+        pass
+
+
+class StatusServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, daemon: "Daemon", port: int) -> None:
+        # Only reachable from this machine
+        super().__init__(("127.0.0.1", port), StatusHandler)
+        self.daemon = daemon
+
+
+class Daemon:
+    """
+    Keeps the schedules of the accounts full without exiting between runs.
+
+    Each account sleeps until its next schedule slot opens up in the MAX_DAYS window, and its
+    clip is rendered a lookahead earlier so it is ready to be scheduled in time. The browser of
+    each account, the session checks, the scraped channels and the worker pool stay warm
+    between runs. The queue depth and how busy each stage is are served on a local port.
+    """
+
+    def __init__(
+        self,
+        emails: List[str] | None,
+        get_emails: Callable[[], List[str]],
+        process_account: Callable,
+        stream: bool = False,
+        lookahead: timedelta = timedelta(minutes=RENDER_LOOKAHEAD),
+        workers: int = DAEMON_WORKERS,
+        status_port: int = DAEMON_STATUS_PORT,
+    ) -> None:
+        """
+        Args:
+            emails (List[str] | None): accounts to keep full, all of them (reloaded every cycle) if None.
+            get_emails (Callable): returns the emails of all the accounts.
+            process_account (Callable): renders and schedules the clips of an account (see main.process_account_videos).
+            stream (bool): render new clips while their source is still downloading.
+            lookahead (timedelta): how long before a slot opens up its clip is rendered.
+            workers (int): accounts processed at the same time.
+            status_port (int): local port of the status endpoint.
+        """
+        self.emails = emails
+        self.get_emails = get_emails
+        self.process_account = process_account
+        self.stream = stream
+        self.lookahead = lookahead
+        self.workers = workers
+        self.started = datetime.now()
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.sessions = SessionManager([])
+        self.status_server = StatusServer(self, status_port)
+
+        # Browser of each account, reused between runs
+        self.schedulers = {}
+
+        # Clips share the temporary folder, so they are rendered one account at a time
+        # while the other workers upload
+        self.render_lock = threading.Lock()
+
+        # State, next wake up and last error of each account
+        self.lock = threading.Lock()
+        self.states: Dict[str, str] = {}
+        self.wake_times: Dict[str, datetime] = {}
+        self.errors: Dict[str, str] = {}
+
+        # Spans of the last DAEMON_UTILIZATION_WINDOW seconds
+        self.recent_spans: List[dict] = []
+
+        # Set to check the schedules before the sleep is over (ex: a worker finished)
+        self.wakeup = threading.Event()
+        self.stopping = False
+
+    def run(self):
+        """
+        Processes the accounts as they become due until interrupted.
+        """
+        threading.Thread(target=self.status_server.serve_forever, daemon=True).start()
+        logger.info(
+            f"Daemon started, status on http://127.0.0.1:{self.status_server.server_address[1]}"
+        )
+
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        try:
+            while not self.stopping:
+                self.dispatch()
+
+                timeout = self.get_sleep_time()
+                logger.info(f"Sleeping for {timeout:.0f}s")
+                self.wakeup.wait(timeout)
+                self.wakeup.clear()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+
+    def dispatch(self):
+        """
+        Queues the accounts whose next slot is due, earliest deadline first.
+        """
+        emails = self.emails or self.get_emails()
+        now = datetime.now()
+        due = []
+        for email in emails:
+            with self.lock:
+                if self.states.get(email) in (QUEUED, RUNNING):
+                    continue
+
+                if email not in self.wake_times:
+                    self.wake_times[email] = self.get_wake_time(email)
+
+                if self.wake_times[email] > now:
+                    continue
+
+                self.states[email] = QUEUED
+                due.append(email)
+
+        # The accounts whose schedule runs dry first get the workers and the render lock first
+        due.sort(key=lambda email: self.wake_times[email])
+        for email in due:
+            self.executor.submit(self.process, email)
+
+    def process(self, email: str):
+        """
+        Renders and schedules the clips of a due account, and plans when to wake it up next.
+        """
+        self.set_state(email, RUNNING)
+        try:
+            if self.sessions.refresh(email) == EXPIRED:
+                raise SessionExpiredError(f"{email} needs to log in again")
+            self.sessions.save_renewed_cookies(email)
+
+            # Only this thread works on the account, its journal can be compacted safely
+            reset_compaction(email)
+
+            # Clips deleted by hand since the last run are dropped from the inventory
+            reset_pruning()
+
+            with tracer.trace("account", email=email):
+                self.process_account(
+                    email,
+                    self.stream,
+                    get_scheduler=lambda: self.get_scheduler(email),
+                    lookahead=self.lookahead,
+                    render_lock=self.render_lock,
+                )
+
+            # Don't loop on an account whose slot could not be filled (ex: no new videos)
+            wake_time = max(
+                self.get_wake_time(email),
+                datetime.now() + timedelta(seconds=DAEMON_RETRY_DELAY),
+            )
+            state = WAITING
+            error = None
+        except SessionExpiredError as e:
+            logger.warning(f"{e}, run main.py {email} to log in")
+            wake_time = datetime.now() + timedelta(seconds=DAEMON_RETRY_DELAY)
+            state = LOGIN_REQUIRED
+            error = str(e)
+            self.close_scheduler(email)
+        except Exception as e:
+            logger.exception(f"Failed to process {email}, retrying later")
+            wake_time = datetime.now() + timedelta(seconds=DAEMON_RETRY_DELAY)
+            state = WAITING
+            error = repr(e)
+
+            # The browser may have crashed, a new one is launched next time
+            self.close_scheduler(email)
+        finally:
+            self.save_spans()
+
+        with self.lock:
+            self.wake_times[email] = wake_time
+            self.states[email] = state
+            self.errors[email] = error
+        logger.info(f"{email} will be processed again at {wake_time}")
+        self.wakeup.set()
+
+    def get_wake_time(self, email: str) -> datetime:
+        """
+        Returns:
+            datetime: when the account has to be processed for its next slot to be filled in time.
+        """
+        account = Account(email)
+
+        # TikTok only accepts the slot once it is within the MAX_DAYS window
+        opens = account.get_next_slot() - timedelta(days=MAX_DAYS)
+
+        # The clip of the next slot may already be rendered
+        if account.get_processed_videos():
+            return opens
+        return opens - self.lookahead
+
+    def get_sleep_time(self) -> float:
+        """
+        Returns:
+            float: seconds until the next account is due, at most DAEMON_MAX_SLEEP.
+        """
+        with self.lock:
+            wake_times = [
+                wake_time
+                for email, wake_time in self.wake_times.items()
+                if self.states.get(email) not in (QUEUED, RUNNING)
+            ]
+
+        timeout = DAEMON_MAX_SLEEP
+        if wake_times:
+            until_next = (min(wake_times) - datetime.now()).total_seconds()
+            timeout = min(timeout, max(until_next, 0))
+        return timeout
+
+    def get_scheduler(self, email: str):
+        """
+        Returns:
+            Scheduler: the browser of the account, launched the first time.
+        """
+        if email not in self.schedulers:
+            from Scheduler import Scheduler
+
+            self.schedulers[email] = Scheduler(Account(email), interactive=False)
+        return self.schedulers[email]
+
+    def close_scheduler(self, email: str):
+        scheduler = self.schedulers.pop(email, None)
+        if scheduler:
+            try:
+                scheduler.quit()
+            except Exception:
+                pass
+
+    def set_state(self, email: str, state: str):
+        with self.lock:
+            self.states[email] = state
+
+    def save_spans(self):
+        """
+        Appends the finished spans to today's trace file and keeps the recent ones for the status.
+        """
+        finished = tracer.pop_spans()
+        if not finished:
+            return
+
+        run_name = datetime.now().strftime("daemon_%Y-%m-%d")
+        tracer.export(os.path.join(TRACES_PATH, f"{run_name}.jsonl"), finished=finished)
+
+        with self.lock:
+            window_start = time.time() - DAEMON_UTILIZATION_WINDOW
+            self.recent_spans = [
+                span
+                for span in self.recent_spans + finished
+                if span["start"] + span["wall_time"] > window_start
+            ]
+
+    def get_utilization(self) -> Dict[str, float]:
+        """
+        Returns:
+            Dict[str, float]: average number of workers busy in each stage over the last
+            DAEMON_UTILIZATION_WINDOW seconds (ex: {"ffmpeg.crop": 0.25, "scheduler.post": 0.1}).
+        """
+        now = time.time()
+        window_start = max(now - DAEMON_UTILIZATION_WINDOW, self.started.timestamp())
+        window = max(now - window_start, 1)
+
+        busy = defaultdict(float)
+        for span in self.recent_spans:
+            start = max(span["start"], window_start)
+            end = span["start"] + span["wall_time"]
+            busy[span["name"]] += max(end - start, 0)
+
+        return {name: round(seconds / window, 3) for name, seconds in busy.items()}
+
+    def get_status(self) -> dict:
+        with self.lock:
+            accounts = {
+                email: {
+                    "state": self.states.get(email, WAITING),
+                    "next_wake": wake_time.isoformat(),
+                    "error": self.errors.get(email),
+                }
+                for email, wake_time in self.wake_times.items()
+            }
+            utilization = self.get_utilization()
+
+        states = [account["state"] for account in accounts.values()]
+        return {
+            "started": self.started.isoformat(),
+            "queue_depth": states.count(QUEUED),
+            "running": states.count(RUNNING),
+            "workers": self.workers,
+            "lookahead_minutes": self.lookahead.total_seconds() / 60,
+            "accounts": accounts,
+            "stage_utilization": utilization,
+        }
+
+    def shutdown(self):
+        logger.info("Stopping the daemon...")
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.status_server.shutdown()
+        self.status_server.server_close()
+        self.sessions.shutdown()
+        for email in list(self.schedulers):
+            self.close_scheduler(email)
+        self.save_spans()
@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Set
+import json
+import sys
+import os
+
+from constants import *
+from util import create_directory
+
+
+class Post:
+    """
+    A video posted, or scheduled, by an account.
+    """
+
+    __slots__ = ("id", "date")
+
+    def __init__(self, id: str, date: datetime) -> None:
+        # The same IDs appear once per part, they share a single string
+        self.id = sys.intern(id)
+        self.date = date
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "date": self.date}
+
+
+class History:
+    """
+    Posting history of an account. Only the posts of the last HISTORY_RETENTION_DAYS are kept
+    in the account file, with the latest post and the IDs cached, so loading an account costs
+    the same after years of posting. Older posts are appended to an archive file, which is
+    only read when every used ID is needed (see get_ids).
+    """
+
+    __slots__ = ("archive_path", "posts", "index", "latest", "archived_ids")
+
+    def __init__(self, posts: List[dict], archive_path: str) -> None:
+        """
+        Args:
+            posts (List[dict]): recent posts (ex: [{"id": "dQw4w9WgXcQ", "date": datetime(...)}, ...]).
+            archive_path (str): JSON lines file the older posts are moved to.
+        """
+        self.archive_path = archive_path
+        self.posts: List[Post] = []
+        self.index: Dict[str, List[Post]] = {}
+        self.latest: Post | None = None
+
+        # Read from the archive the first time they are needed
+        self.archived_ids: Set[str] | None = None
+
+        for post in posts:
+            self.add(post["id"], post["date"])
+
+    def __len__(self) -> int:
+        return len(self.posts)
+
+    def __iter__(self) -> Iterator[Post]:
+        return iter(self.posts)
+
+    def add(self, id: str, date: datetime):
+        post = Post(id, date)
+        self.posts.append(post)
+        self.index.setdefault(post.id, []).append(post)
+        if self.latest is None or date > self.latest.date:
+            self.latest = post
+
+    def has_post(self, id: str, date: datetime) -> bool:
+        return any(post.date == date for post in self.index.get(id, []))
+
+    def get_ids(self, archived: bool = True) -> Set[str]:
+        """
+        Args:
+            archived (bool): also include the IDs of the archived posts.
+
+        Returns:
+            Set[str]: IDs of the videos posted.
+        """
+        ids = set(self.index)
+        if archived:
+            if self.archived_ids is None:
+                self.archived_ids = self.read_archived_ids()
+            ids |= self.archived_ids
+        return ids
+
+    def read_archived_ids(self) -> Set[str]:
+        if not os.path.exists(self.archive_path):
+            return set()
+
+        ids = set()
+        with open(self.archive_path, "r", encoding="utf-8") as file:
+            for line in file:
+                # The last line may be incomplete if the process was killed while writing it
+                try:
+                    ids.add(sys.intern(json.loads(line)["id"]))
+                except json.JSONDecodeError:
+                    continue
+        return ids
+
+    def archive(self, retention: timedelta = timedelta(days=HISTORY_RETENTION_DAYS)) -> int:
+        """
+        Appends the posts older than the retention to the archive and forgets them. The latest
+        post is always kept, as the schedule continues from it.
+
+        Returns:
+            int: number of posts archived.
+        """
+        oldest = datetime.now() - retention
+        expired, kept = [], []
+        for post in self.posts:
+            if post.date < oldest and post is not self.latest:
+                expired.append(post)
+            else:
+                kept.append(post)
+
+        if not expired:
+            return 0
+
+        # Written before being forgotten, so a crash can at worst archive a post twice
+        create_directory(os.path.dirname(self.archive_path) or ".")
+        with open(self.archive_path, "a", encoding="utf-8") as file:
+            for post in expired:
+                file.write(json.dumps({"id": post.id, "date": post.date.isoformat()}) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+        if self.archived_ids is not None:
+            self.archived_ids.update(post.id for post in expired)
+
+        self.posts = kept
+        self.index = {}
+        for post in kept:
+            self.index.setdefault(post.id, []).append(post)
+
+        return len(expired)
+
+    def to_list(self) -> List[dict]:
+        """
+        Returns:
+            List[dict]: the recent posts, as they are saved in the account file.
+        """
+        return [post.to_dict() for post in self.posts]
@@ -0,0 +1,233 @@
+from collections import defaultdict
+from typing import List, Set
+import threading
+import tempfile
+import json
+import os
+
+from constants import *
+from util import create_directory
+
+# Serializes the changes of the manifest between threads (ex: daemon workers)
+lock = threading.Lock()
+# Set once the clips deleted by hand were dropped, checking every file on each load is slow
+pruned = threading.Event()
+
+
+def reset_pruning():
+    """
+    Lets the next inventory drop the clips deleted by hand again (ex: by the daemon before
+    each run of an account, as it never restarts).
+    """
+    pruned.clear()
+
+
+class Inventory:
+    """
+    Manifest of the clips waiting in the output folder, so the pending clips of an account
+    can be found without listing and parsing the whole directory.
+    """
+
+    def __init__(self, path: str = INVENTORY_PATH) -> None:
+        self.path = path
+        self.load()
+
+        if not pruned.is_set():
+            self.prune()
+
+    def get_account_clips(self, email: str) -> List[dict]:
+        """
+        Args:
+            email (str): email of the account that owns the clips.
+
+        Returns:
+            List[dict]: clips of the account ordered by source and part (ex: [{"email": ..., "id": ..., "part": 0, "path": ..., "size": ..., "settings": {...}}, ...])
+        """
+        clips = self.account_index.get(email, [])
+        return sorted(clips, key=lambda x: (x["id"], x["part"]))
+
+    def get_clip(self, path: str) -> dict | None:
+        return self.clips.get(os.path.relpath(path))
+
+    def get_render_budget(self, email: str) -> int:
+        """
+        Clips of an account that can be rendered without going over the pending clip and byte
+        limits (MAX_PENDING_CLIPS, MAX_PENDING_BYTES and MAX_TOTAL_PENDING_BYTES).
+        Recipes don't count, as they are only rendered right before uploading.
+
+        Returns:
+            int: number of clips that can be rendered now.
+        """
+        rendered = [clip for clip in self.clips.values() if not clip.get("recipe")]
+        account_clips = [clip for clip in rendered if clip["email"] == email]
+
+        total_bytes = sum(clip["size"] for clip in rendered)
+        account_bytes = sum(clip["size"] for clip in account_clips)
+        clip_size = (total_bytes / len(rendered) if rendered else 0) or CLIP_SIZE_ESTIMATE
+
+        budget = min(
+            MAX_PENDING_CLIPS - len(account_clips),
+            (MAX_PENDING_BYTES - account_bytes) // clip_size,
+            (MAX_TOTAL_PENDING_BYTES - total_bytes) // clip_size,
+        )
+        return max(int(budget), 0)
+
+    def get_source_ids(self) -> Set[str]:
+        """
+        Returns:
+            Set[str]: IDs of every YouTube video that has pending clips.
+        """
+        return {clip["id"] for clip in self.clips.values()}
+
+    def add(
+        self,
+        email: str,
+        id: str,
+        part: int,
+        path: str,
+        settings: dict | None = None,
+        recipe: dict | None = None,
+        save: bool = True,
+    ):
+        """
+        Registers a rendered clip, or the recipe of a clip that is not rendered yet.
+
+        Args:
+            email (str): email of the account the clip belongs to.
+            id (str): ID of the source YouTube video.
+            part (int): index of the part inside the source (starting at 0).
+            path (str): path to the clip, where it will be rendered if it is a recipe.
+            settings (dict): options it was rendered with (ex: {"secondary_content": True, "subtitles": False})
+            recipe (dict): how to render the clip later (ex: {"url": ..., "segment": "cache/sources/.../003.mp4"})
+        """
+        clip = {
+            "email": email,
+            "id": id,
+            "part": part,
+            "path": os.path.relpath(path),
+            "size": os.path.getsize(path) if os.path.exists(path) and not recipe else 0,
+            "settings": settings or {},
+            "recipe": recipe,
+        }
+
+        if not save:
+            self.insert(clip)
+            return
+
+        with lock:
+            # Other threads may have changed the manifest since it was loaded
+            self.load()
+            self.insert(clip)
+            self.save()
+
+    def remove(self, path: str, save: bool = True):
+        """
+        Unregisters a clip (ex: once it has been posted).
+        """
+        if not save:
+            self.discard(path)
+            return
+
+        with lock:
+            # Other threads may have changed the manifest since it was loaded
+            self.load()
+            self.discard(path)
+            self.save()
+
+    def insert(self, clip: dict):
+        # Replace the previous entry if the clip was rendered again
+        self.discard(clip["path"])
+        self.clips[clip["path"]] = clip
+        self.account_index[clip["email"]].append(clip)
+
+    def discard(self, path: str):
+        clip = self.clips.pop(os.path.relpath(path), None)
+        if clip:
+            self.account_index[clip["email"]].remove(clip)
+
+    def load(self):
+        """
+        Loads the manifest, it is built from the output folder the first time.
+        """
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as file:
+                self.clips = json.load(file)
+        else:
+            self.clips = {}
+            self.rebuild()
+
+        self.index()
+
+    def index(self):
+        """
+        Groups the clips by account for fast lookups.
+        """
+        self.account_index = defaultdict(list)
+        for clip in self.clips.values():
+            self.account_index[clip["email"]].append(clip)
+
+    def prune(self):
+        """
+        Drops the clips whose file was deleted by hand, once per run (see reset_pruning).
+        Recipes have no file yet, so they are kept.
+        """
+        with lock:
+            # Another thread may have pruned it while this one waited
+            if pruned.is_set():
+                return
+
+            self.load()
+            missing = [
+                path
+                for path, clip in self.clips.items()
+                if not clip.get("recipe") and not os.path.exists(path)
+            ]
+            for path in missing:
+                self.discard(path)
+            if missing:
+                self.save()
+
+            pruned.set()
+
+    def rebuild(self):
+        """
+        Scans the output folder and replaces the manifest with the clips found.
+        Useful if clips were added or deleted by hand.
+        """
+        create_directory(OUTPUT_PATH)
+
+        # Recipes have no file in the output folder
+        self.clips = {
+            path: clip for path, clip in self.clips.items() if clip.get("recipe")
+        }
+        for file in os.listdir(OUTPUT_PATH):
+            # Clips are named after the owner, part and source (ex: "email@example.com,0,XQIu5tZ0vbQ.mp4")
+            if not file.endswith(".mp4") or file.count(",") != 2:
+                continue
+
+            email, part, id = file.removesuffix(".mp4").split(",")
+            path = os.path.join(OUTPUT_PATH, file)
+            self.clips[path] = {
+                "email": email,
+                "id": id,
+                "part": int(part),
+                "path": path,
+                "size": os.path.getsize(path),
+                "settings": {},
+                "recipe": None,
+            }
+
+        self.index()
+        self.save()
+
+    def save(self):
+        """
+        Writes the manifest atomically, so an interrupted run never leaves it half written.
+        """
+        create_directory(os.path.dirname(self.path) or ".")
+
+        # Each save writes its own temporary file, so processes sharing the manifest don't collide
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(self.clips, file, indent=2)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,189 @@
+from datetime import datetime
+from typing import List, Set
+import threading
+import tempfile
+import json
+import os
+
+from constants import *
+from util import create_directory
+
+# Steps a source video goes through, in order
+SOURCE_STATES = [
+    "discovered",
+    "downloaded",
+    "transcript_ready",
+    "segmented",
+    # Some parts were rendered, the rest are made by a later run (see clipper.make_clips)
+    "partial",
+    "rendered",
+    "posted",
+]
+# Steps a clip goes through, in order
+CLIP_STATES = ["rendered", "posted"]
+
+# Journals compacted by this process, each one is only compacted the first time it is loaded
+compacted: Set[str] = set()
+# Appends wait for a compaction to finish, so they are not lost when the journal is replaced
+journal_lock = threading.Lock()
+
+
+def reset_compaction(email: str):
+    """
+    Lets the journal of an account be compacted again the next time it is loaded (ex: by the
+    daemon before each run of the account, as it never restarts).
+    """
+    with journal_lock:
+        compacted.discard(os.path.abspath(os.path.join(JOURNAL_PATH, email + ".jsonl")))
+
+
+class Journal:
+    """
+    Write-ahead log of the progress of each source video and clip of an account.
+
+    Every step is appended to the journal as soon as it is completed, so after a crash
+    the next run can resume from the last completed step and reuse the files that survived.
+    """
+
+    def __init__(self, email: str) -> None:
+        self.path = os.path.join(JOURNAL_PATH, email + ".jsonl")
+        self.load()
+
+    def record(self, kind: str, key: str, state: str, **data):
+        """
+        Appends a completed step to the journal.
+
+        Args:
+            kind (str): "source" or "clip".
+            key (str): ID of the source video, or the path to the clip.
+            state (str): step that was completed (see SOURCE_STATES and CLIP_STATES).
+            data: artifacts of the step (ex: video_path="temp/abc/abc.mp4")
+        """
+        entry = {
+            "kind": kind,
+            "key": key,
+            "state": state,
+            "time": datetime.now().isoformat(),
+            **data,
+        }
+        self.apply(entry)
+
+        # Flush to disk before continuing, so the step is never lost
+        create_directory(JOURNAL_PATH)
+        with journal_lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(entry) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def record_source(self, id: str, state: str, **data):
+        self.record("source", id, state, **data)
+
+    def record_clip(self, path: str, state: str, **data):
+        self.record("clip", os.path.relpath(path), state, **data)
+
+    def get_source(self, id: str) -> dict:
+        """
+        Returns:
+            dict: latest state of a source with all the artifacts recorded so far.
+        """
+        return self.sources.get(id, {})
+
+    def get_clip(self, path: str) -> dict:
+        return self.clips.get(os.path.relpath(path), {})
+
+    def get_artifact(self, id: str, name: str) -> str | List[str] | None:
+        """
+        Finds a file produced by a previous step of a source, if it still exists.
+
+        Args:
+            id (str): ID of the source video.
+            name (str): name of the artifact (ex: "video_path", "transcript_path", "clips")
+
+        Returns:
+            str | List[str] | None: the path (or paths) to the artifact, None if it was lost.
+        """
+        artifact = self.get_source(id).get(name)
+        if not artifact:
+            return None
+
+        paths = artifact if isinstance(artifact, list) else [artifact]
+        if all(os.path.exists(path) for path in paths):
+            return artifact
+        return None
+
+    def get_unfinished_sources(self) -> List[str]:
+        """
+        Returns:
+            List[str]: IDs of the source videos whose clips were not rendered completely.
+        """
+        rendered = SOURCE_STATES.index("rendered")
+        return [
+            id
+            for id, source in self.sources.items()
+            if SOURCE_STATES.index(source["state"]) < rendered
+        ]
+
+    def get_posted_clips(self) -> List[dict]:
+        """
+        Returns:
+            List[dict]: clips that were posted but whose files are still in the output folder,
+            meaning the run stopped before updating the history and removing them.
+        """
+        return [
+            clip
+            for clip in self.clips.values()
+            if clip["state"] == "posted" and os.path.exists(clip["key"])
+        ]
+
+    def apply(self, entry: dict):
+        """
+        Merges an entry in to the current state of its source or clip.
+        """
+        states = self.sources if entry["kind"] == "source" else self.clips
+        states.setdefault(entry["key"], {}).update(entry)
+
+    def load(self):
+        """
+        Replays the journal, and compacts it the first time this process loads it.
+        """
+        self.sources = {}
+        self.clips = {}
+
+        # Read while holding the lock, so no step is appended between the read and the compaction
+        with journal_lock:
+            if not os.path.exists(self.path):
+                return
+
+            with open(self.path, "r", encoding="utf-8") as file:
+                for line in file:
+                    # The last line may be incomplete if the process was killed while writing it
+                    try:
+                        self.apply(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+
+            path = os.path.abspath(self.path)
+            if path not in compacted:
+                compacted.add(path)
+                self.compact()
+
+    def compact(self):
+        """
+        Drops everything that is finished and rewrites the journal with one line per source and clip.
+        """
+        self.sources = {
+            id: source
+            for id, source in self.sources.items()
+            if source["state"] != "posted"
+        }
+        # Clips whose file is gone were either fully handled or lost
+        self.clips = {
+            path: clip for path, clip in self.clips.items() if os.path.exists(path)
+        }
+
+        # Each compaction writes its own temporary file, so they never collide
+        fd, temp_path = tempfile.mkstemp(dir=JOURNAL_PATH, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            for entry in [*self.sources.values(), *self.clips.values()]:
+                file.write(json.dumps(entry) + "\n")
+        os.replace(temp_path, self.path)
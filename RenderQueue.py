@@ -0,0 +1,287 @@
+from typing import List
+import threading
+import logging
+import sqlite3
+import shutil
+import json
+import time
+import os
+
+from constants import *
+from Inventory import Inventory
+from Journal import Journal
+from util import create_directory, get_url_id
+
+logger = logging.getLogger(__name__)
+
+# States of a render job
+PENDING = "pending"  # waiting for a worker
+LEASED = "leased"  # claimed by a worker until its lease expires
+DONE = "done"  # rendered, the artifacts are in the shared directory
+FAILED = "failed"  # failed RENDER_MAX_ATTEMPTS times
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL,
+    url TEXT NOT NULL,
+    options TEXT NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+
+class RenderQueue:
+    """
+    Queue of render jobs shared by a coordinator and any number of render workers, on this
+    host or others, through a SQLite database in a shared directory (FARM_PATH).
+
+    The coordinator publishes a job per source video, a worker claims it with a lease it
+    keeps renewing while it renders, and the clips are returned through the artifacts folder
+    of the shared directory. Jobs whose lease expires (ex: the worker died) or that fail are
+    handed to another worker, up to RENDER_MAX_ATTEMPTS times.
+    """
+
+    def __init__(self, path: str = FARM_PATH) -> None:
+        """
+        Args:
+            path (str): shared directory with the database and the artifacts.
+        """
+        # Workers move to their own working directory, so the path must be absolute
+        self.path = os.path.abspath(path)
+        self.artifacts_path = os.path.join(self.path, "artifacts")
+        create_directory(self.artifacts_path)
+
+        # Transactions are started by hand, so claims are atomic between processes
+        self.connection = sqlite3.connect(
+            os.path.join(self.path, "queue.db"),
+            timeout=RENDER_DB_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(SCHEMA)
+
+        # The connection is shared with the lease renewing thread of the worker
+        self.lock = threading.Lock()
+
+    def publish(self, email: str, url: str, options: dict) -> int:
+        """
+        Adds a render job.
+
+        Args:
+            email (str): account the clips are for.
+            url (str): URL of the YouTube video.
+            options (dict): arguments of make_clips (ex: {"secondary_content": True,
+                "captions": False, "limit": 3, "parts": [2, 5]})
+
+        Returns:
+            int: ID of the job.
+        """
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO jobs (email, url, options, state, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (email, url, json.dumps(options), PENDING, now, now),
+            )
+        return cursor.lastrowid
+
+    def claim(self, worker: str, lease: float = RENDER_LEASE) -> dict | None:
+        """
+        Takes the oldest job that is pending or whose lease expired.
+
+        Args:
+            worker (str): name of the worker claiming the job.
+            lease (float): seconds the job belongs to the worker unless it renews the lease.
+
+        Returns:
+            dict | None: the job, None if there is nothing to render.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs that expired too many times are given up
+                self.connection.execute(
+                    "UPDATE jobs SET state = ?, error = ?, updated = ? "
+                    "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                    (FAILED, "lease expired", now, LEASED, now, RENDER_MAX_ATTEMPTS),
+                )
+
+                row = self.connection.execute(
+                    "SELECT * FROM jobs WHERE state = ? OR (state = ? AND lease_expires < ?) "
+                    "ORDER BY id LIMIT 1",
+                    (PENDING, LEASED, now),
+                ).fetchone()
+                if row:
+                    self.connection.execute(
+                        "UPDATE jobs SET state = ?, worker = ?, lease_expires = ?, "
+                        "attempts = attempts + 1, updated = ? WHERE id = ?",
+                        (LEASED, worker, now + lease, now, row["id"]),
+                    )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+        return self.get_job(row["id"]) if row else None
+
+    def renew(self, id: int, worker: str, lease: float = RENDER_LEASE) -> bool:
+        """
+        Extends the lease of a job.
+
+        Returns:
+            bool: if the job still belongs to the worker.
+        """
+        return self.update(
+            id,
+            worker,
+            "lease_expires = ?",
+            (time.time() + lease,),
+        )
+
+    def complete(self, id: int, worker: str, result: dict) -> bool:
+        """
+        Marks a job as rendered.
+
+        Args:
+            result (dict): clips left in the artifacts folder (see RenderWorker.export_clips).
+
+        Returns:
+            bool: if the job still belonged to the worker, otherwise the result is discarded.
+        """
+        return self.update(
+            id, worker, "state = ?, result = ?", (DONE, json.dumps(result))
+        )
+
+    def fail(self, id: int, worker: str, error: str) -> bool:
+        """
+        Gives a job back to the queue, or marks it as failed after RENDER_MAX_ATTEMPTS.
+        """
+        job = self.get_job(id)
+        state = FAILED if job["attempts"] >= RENDER_MAX_ATTEMPTS else PENDING
+        return self.update(id, worker, "state = ?, error = ?", (state, error))
+
+    def update(self, id: int, worker: str, assignments: str, values: tuple) -> bool:
+        """
+        Updates a job only if it is still leased by the worker.
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                f"UPDATE jobs SET {assignments}, updated = ? "
+                "WHERE id = ? AND worker = ? AND state = ?",
+                (*values, time.time(), id, worker, LEASED),
+            )
+        return cursor.rowcount == 1
+
+    def get_job(self, id: int) -> dict:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM jobs WHERE id = ?", (id,)
+            ).fetchone()
+
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def wait(self, ids: List[int], timeout: float | None = None) -> List[dict]:
+        """
+        Waits until some jobs are done or failed.
+
+        Args:
+            ids (List[int]): IDs of the jobs.
+            timeout (float): seconds to wait at most, forever by default.
+
+        Returns:
+            List[dict]: the jobs in the same order, some may be unfinished if it timed out.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            jobs = [self.get_job(id) for id in ids]
+            if all(job["state"] in (DONE, FAILED) for job in jobs):
+                return jobs
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return jobs
+            time.sleep(RENDER_POLL_INTERVAL)
+
+    def get_counts(self) -> dict:
+        """
+        Returns:
+            dict: number of jobs in each state (ex: {"pending": 3, "leased": 2})
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        return {state: count for state, count in rows}
+
+    def get_artifacts_path(self, id: int) -> str:
+        return os.path.join(self.artifacts_path, str(id))
+
+    def import_artifacts(self, job: dict) -> List[str]:
+        """
+        Moves the clips of a finished job from the shared directory to the output folder and
+        the source cache, and registers them in the inventory and the journal.
+
+        Returns:
+            List[str]: paths to the clips, recipes are not rendered yet (see clipper.materialize_clip).
+        """
+        email = job["email"]
+        id = get_url_id(job["url"])
+        settings = {
+            "secondary_content": job["options"]["secondary_content"],
+            "subtitles": job["options"]["captions"],
+        }
+
+        inventory = Inventory()
+        journal = Journal(email)
+        create_directory(OUTPUT_PATH)
+
+        # Files are named relative to the artifacts folder, hosts may mount it elsewhere
+        artifacts_path = self.get_artifacts_path(job["id"])
+
+        clips = []
+        for clip in job["result"]["clips"]:
+            part = clip["part"]
+            artifact = os.path.join(artifacts_path, clip["file"])
+            target_path = os.path.join(OUTPUT_PATH, f"{email},{part},{id}.mp4")
+
+            if clip["recipe"]:
+                # Only the segment was made, it is rendered right before uploading
+                cache_path = os.path.join(SOURCE_CACHE_PATH, f"{email},{id}")
+                create_directory(cache_path)
+                segment = shutil.move(
+                    artifact, os.path.join(cache_path, f"{part:03d}.mp4")
+                )
+                recipe = {"url": job["url"], "segment": segment}
+                inventory.add(email, id, part, target_path, settings, recipe)
+            else:
+                shutil.move(artifact, target_path)
+                inventory.add(email, id, part, target_path, settings)
+                journal.record_clip(target_path, "rendered", id=id, part=part)
+
+            clips.append(target_path)
+
+        # The parts that are left are published again by a later run
+        source = job["result"].get("source", {"state": "rendered"})
+        if source["state"] == "partial":
+            journal.record_source(
+                id, "partial", next_part=source["next_part"], n_parts=source["n_parts"]
+            )
+        else:
+            journal.record_source(id, "rendered")
+        shutil.rmtree(artifacts_path, ignore_errors=True)
+
+        return clips
+
+    def close(self):
+        self.connection.close()
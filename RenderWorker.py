@@ -0,0 +1,162 @@
+from typing import List
+import threading
+import logging
+import socket
+import shutil
+import time
+import os
+
+from constants import *
+from Inventory import Inventory
+from Journal import Journal
+from RenderQueue import RenderQueue
+from tracer import trace
+from util import create_directory, get_url_id
+
+logger = logging.getLogger(__name__)
+
+
+class RenderWorker:
+    """
+    Claims render jobs from a RenderQueue, renders them with make_clips and leaves the clips
+    in the shared artifacts folder for the coordinator.
+
+    Each worker renders in its own working directory, so several of them can run on the same
+    host without sharing temporary files, journals or inventories.
+    """
+
+    def __init__(
+        self,
+        queue: RenderQueue,
+        name: str | None = None,
+        work_path: str | None = None,
+    ) -> None:
+        """
+        Args:
+            queue (RenderQueue): queue to claim jobs from.
+            name (str): name of the worker, the host and process ID by default.
+            work_path (str): working directory of the worker, inside the farm folder by default.
+        """
+        self.queue = queue
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.work_path = os.path.abspath(
+            work_path or os.path.join(queue.path, "workers", self.name)
+        )
+
+    def run(self, once: bool = False):
+        """
+        Renders jobs until interrupted.
+
+        Args:
+            once (bool): stop as soon as the queue is empty.
+        """
+        # The clipper is heavy to import, and only workers need it
+        import clipper
+
+        # Shared assets are resolved before moving to the working directory
+        clipper.SECONDARY_CONTENT_PATH = os.path.abspath(SECONDARY_CONTENT_PATH)
+        clipper.FONT_FILE = os.path.abspath(FONT_FILE)
+
+        create_directory(self.work_path)
+        os.chdir(self.work_path)
+        logger.info(f"Render worker {self.name} started in {self.work_path}")
+
+        while True:
+            job = self.queue.claim(self.name)
+            if job:
+                self.process(job)
+            elif once:
+                break
+            else:
+                time.sleep(RENDER_POLL_INTERVAL)
+
+    def process(self, job: dict):
+        """
+        Renders a job while renewing its lease, and reports the result to the queue.
+        """
+        logger.info(f"Rendering job {job['id']} ({job['url']})...")
+
+        # Keep the job while rendering, the lease expires if this process dies
+        rendering = threading.Event()
+        renewer = threading.Thread(target=self.renew_lease, args=(job, rendering))
+        renewer.start()
+        try:
+            with trace("farm.render", job=job["id"], worker=self.name):
+                clips = self.render(job)
+                result = self.export_clips(job, clips)
+
+            if not self.queue.complete(job["id"], self.name, result):
+                logger.warning(f"The lease of job {job['id']} was lost, discarding it")
+        except Exception as e:
+            logger.exception(f"Job {job['id']} failed")
+            self.queue.fail(job["id"], self.name, repr(e))
+        finally:
+            rendering.set()
+            renewer.join()
+
+    def renew_lease(self, job: dict, rendering: threading.Event):
+        """
+        Renews the lease of a job every third of its duration until the rendering is over.
+        """
+        while not rendering.wait(RENDER_LEASE / 3):
+            if not self.queue.renew(job["id"], self.name):
+                logger.warning(f"Could not renew the lease of job {job['id']}")
+                return
+
+    def render(self, job: dict) -> List[str]:
+        from clipper import make_clips
+
+        options = job["options"]
+        return make_clips(
+            job["url"],
+            job["email"],
+            options["secondary_content"],
+            options["captions"],
+            limit=options.get("limit"),
+            parts=tuple(options["parts"]) if options.get("parts") else None,
+        )
+
+    def export_clips(self, job: dict, clips: List[str]) -> dict:
+        """
+        Moves the clips and the segments of the recipes to the artifacts folder of the job.
+
+        Returns:
+            dict: clips moved, relative to the artifacts folder, and the state of the source
+            (ex: {"clips": [{"part": 0, "file": "...", "recipe": False}, ...], "source":
+            {"state": "partial", "next_part": 3, "n_parts": 8}})
+        """
+        artifacts_path = self.queue.get_artifacts_path(job["id"])
+
+        # Leftovers of a previous attempt
+        shutil.rmtree(artifacts_path, ignore_errors=True)
+        create_directory(artifacts_path)
+
+        inventory = Inventory()
+        exported = []
+        for clip_path in clips:
+            clip = inventory.get_clip(clip_path)
+            if clip["recipe"]:
+                file = f"{clip['part']:03d}.segment.mp4"
+                shutil.move(clip["recipe"]["segment"], os.path.join(artifacts_path, file))
+            else:
+                file = os.path.basename(clip_path)
+                shutil.move(clip_path, os.path.join(artifacts_path, file))
+
+            # The clip now belongs to the coordinator
+            inventory.remove(clip_path)
+            exported.append(
+                {"part": clip["part"], "file": file, "recipe": bool(clip["recipe"])}
+            )
+
+        # The coordinator continues a partial source from where this job stopped
+        source = Journal(job["email"]).get_source(get_url_id(job["url"]))
+        if source.get("state") == "partial":
+            state = {
+                "state": "partial",
+                "next_part": source["next_part"],
+                "n_parts": source.get("n_parts"),
+            }
+        else:
+            state = {"state": "rendered"}
+
+        return {"clips": exported, "source": state}
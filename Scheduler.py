@@ -1,9 +1,8 @@
 from selenium import webdriver
 from selenium_stealth import stealth
-from selenium.webdriver.common.by import By
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from datetime import datetime
@@ -13,11 +12,35 @@ import time
 
 from Account import Account
 from constants import *
+from locators import LocatorError, Locators
+from SessionManager import SessionExpiredError
+from tracer import trace
 from util import *
 
 
 class Scheduler(webdriver.Chrome):
-    def __init__(self, account: Account) -> None:
+    def __init__(
+        self,
+        account: Account,
+        base_url: str = TIKTOK_URL,
+        login: bool = False,
+        interactive: bool = True,
+    ) -> None:
+        """
+        Args:
+            account (Account): the account to post with.
+            base_url (str): URL of TikTok, or of a local stand-in (see mock_tiktok.py).
+            login (bool): log in even if the account has cookies, as they expired.
+            interactive (bool): if the password can be asked in the console.
+        """
+        if (login or not account.cookies) and not interactive:
+            raise SessionExpiredError(f"{account.email} needs to log in again")
+
+        # The base URL can point to a local stand-in of TikTok (see mock_tiktok.py)
+        self.base_url = base_url
+        self.upload_url = base_url + TIKTOK_UPLOAD_PATH
+        self.login_url = base_url + TIKTOK_LOGIN_PATH
+
         # Init webdriver options
         options = webdriver.ChromeOptions()
         options.add_experimental_option("excludeSwitches", ["enable-automation"])
@@ -25,8 +48,15 @@ class Scheduler(webdriver.Chrome):
         options.add_argument("--log-level-1")
         service = Service(ChromeDriverManager().install())
 
-        super().__init__(options=options, service=service)
-        self.implicitly_wait(10)  # Configure wait time
+        with trace("scheduler.launch"):
+            super().__init__(options=options, service=service)
+
+        # Elements are found through the locators, which poll and fail fast on their own
+        self.implicitly_wait(0)
+        self.locators = Locators(self)
+
+        # TikTok only asks to allow scheduling the first time
+        self.schedule_allowed = False
 
         # Init stealth
         stealth(
@@ -40,12 +70,13 @@ class Scheduler(webdriver.Chrome):
         )
 
         # Go to tiktok url to be able to add the cookies
-        self.get(TIKTOK_URL)
+        self.get(self.base_url)
 
         # Init session
-        if not account.cookies:
+        if login or not account.cookies:
             password = input(f"Password for {account.email}: ")
-            cookies = self.login(account.email, password)
+            with trace("scheduler.login", email=account.email):
+                cookies = self.login(account.email, password)
             account.cookies = cookies
             account.save()
         else:
@@ -62,43 +93,45 @@ class Scheduler(webdriver.Chrome):
             caption (srt): the caption to the video being uploaded.
             date (str): if the date is None it should be uploaded now.
         """
+        with trace("scheduler.post", path=video_path):
+            self.upload(video_path, caption, date)
+
+    def upload(self, video_path: str, caption: None | str, date: None | datetime):
         # Navigate to the website
-        if self.current_url == TIKTOK_UPLOAD_URL:
+        if self.current_url == self.upload_url:
             # Navigating to the same page does not refresh it
             # so the previous video being uploaded is still on the same page
             self.refresh()
         else:
-            self.get(TIKTOK_UPLOAD_URL)
+            self.get(self.upload_url)
 
         # A common error is that tiktok seemingly at random makes a popup with no text
         # which makes the program crash, so it shall be accepted if it appears
-        self.wait_for_alert()
+        with trace("scheduler.alert_wait"):
+            self.wait_for_alert()
 
         # Write the video_path to the file input
-        file_input = self.find_element(By.CSS_SELECTOR, 'input[type="file"]')
-        file_input.send_keys(video_path)
+        with trace("scheduler.file_input"):
+            file_input = self.locators.find("file_input")
+            file_input.send_keys(video_path)
 
         # Write caption
-        caption_field = self.find_element(By.CSS_SELECTOR, 'div[spellcheck="false"]')
+        caption_field = self.locators.find("caption")
         caption_field.send_keys(caption)
 
         if date:
             # Input the date
-            self.input_date(date)
+            with trace("scheduler.date_picker"):
+                self.input_date(date)
 
         # Wait till video is uploaded and submit
-        element = WebDriverWait(self, 20).until(
-            EC.element_to_be_clickable(
-                (
-                    By.CSS_SELECTOR,
-                    "#root > div > div > div > div.jsx-475921512.container-v2.form-panel > div.jsx-475921512.contents-v2.reverse > div.jsx-3457533826.form-v2.reverse > div.jsx-3457533826.button-row > div.jsx-3457533826.btn-post > button",
-                )
-            )
-        )
+        with trace("scheduler.upload_wait"):
+            element = self.locators.find("post_button", timeout=20, clickable=True)
         element.click()
 
         # Wait till posted
-        time.sleep(5)
+        with trace("scheduler.posted_wait"):
+            time.sleep(5)
 
     def wait_for_alert(self, wait: int = 5):
         """
@@ -113,78 +146,79 @@ class Scheduler(webdriver.Chrome):
 
     def input_date(self, date: datetime):
         # Toggle the schedule switch
-        schedule_switch = self.find_element(By.CSS_SELECTOR, "#tux-3")
+        schedule_switch = self.locators.find("schedule_switch")
         schedule_switch.click()
 
         # The first time a user schedules a video it will ask to allow the option
         # It should attempt to find the button, which comes up quite fast after toggling the schedule switch
-        try:
-            # The button comes up quite fast, so the max wait time should be set to a low value
-            self.implicitly_wait(3)
-            allow_button = self.find_element(
-                By.CSS_SELECTOR,
-                "body > div:nth-child(9) > div > div > div.tiktok-modal__modal-footer.is-horizontal > div.tiktok-modal__modal-button.is-highlight",
-            )
-            allow_button.click()
-        except:
-            pass
-        finally:
-            # Reset the implicit wait duration
-            self.implicitly_wait(10)
+        if not self.schedule_allowed:
+            try:
+                allow_button = self.locators.find("allow_button", timeout=3)
+                allow_button.click()
+            except LocatorError:
+                pass
 
-        # Input date and time
-        self.select_target_day(date.day)
-        self.select_target_time(date.hour, date.minute)
+            # It won't be asked again for the rest of the session
+            self.schedule_allowed = True
+
+        # Input date and time directly in the pickers, which takes a single call
+        if self.inject_date(date):
+            return
+
+        # If the page didn't take the values, click through the pickers
+        with trace("scheduler.date_click_walk"):
+            self.select_target_day(date.day)
+            self.select_target_time(date.hour, date.minute)
+
+    def inject_date(self, date: datetime) -> bool:
+        """
+        Sets the schedule date and time through the inputs of the pickers and checks the page shows them.
+
+        Returns:
+            bool: if the page shows the date and time that were set.
+        """
+        # TikTok only allows minutes in steps of 5
+        minute = date.minute - date.minute % SCHEDULE_MINUTE_STEP
+        values = {
+            "date_picker": date.strftime("%Y-%m-%d"),
+            "time_picker": f"{date.hour:02}:{minute:02}",
+        }
+
+        try:
+            return self.locators.set_values(values) == values
+        except WebDriverException:
+            return False
 
     def select_target_day(self, day: int):
         # Open calendar
-        calendar_btn = self.find_element(
-            By.CSS_SELECTOR,
-            "#root > div > div > div > div.jsx-475921512.container-v2.form-panel > div.jsx-475921512.contents-v2.reverse > div.jsx-3457533826.form-v2.reverse > div.jsx-3471246984 > div > div.jsx-3471246984.scheduled-picker > div.jsx-3471246984.date-picker-input.picker-input",
-        )
+        calendar_btn = self.locators.find("date_picker")
         calendar_btn.click()
 
-        month_click_count = 0
-        while True:
-            # Find the selectable days of the month
-            valid_days = self.find_elements(
-                By.CSS_SELECTOR, "span.jsx-4172176419.day.valid"
-            )
-
-            # Iterate over them till the target_day is found
-            # When the day is clicked the calendar closes automatically
-            for valid_day in valid_days:
-                if valid_day.text == str(day):
-                    valid_day.click()
-                    return  # Exit the function if the target day is found
-
-            # If the target day is not found and we haven't clicked next month button yet, click on it
-            if month_click_count < 1:
-                next_month_btn = self.find_element(
-                    By.CSS_SELECTOR,
-                    "#root > div > div > div > div.jsx-475921512.container-v2.form-panel > div.jsx-475921512.contents-v2.reverse > div.jsx-3457533826.form-v2.reverse > div.jsx-3471246984 > div > div.jsx-3471246984.scheduled-picker > div.jsx-3471246984.date-picker-input.picker-input > div > div.jsx-4172176419.month-header-wrapper > span:nth-child(3)",
-                )
-                next_month_btn.click()
-                month_click_count += 1
-            else:
-                # If we've already clicked next month button once, break the loop
-                break
+        # The cell is found in a single script call instead of reading the text of every day
+        valid_day = self.locators.find_day(day)
+
+        # If the target day is not found it must be in the next month
+        if not valid_day:
+            next_month_btn = self.locators.find("next_month")
+            next_month_btn.click()
+            valid_day = self.locators.find_day(day)
+
+        if not valid_day:
+            raise LocatorError(f"Day {day} is not selectable in the calendar")
+
+        # When the day is clicked the calendar closes automatically
+        valid_day.click()
 
     def select_target_time(self, hour: int, minute: int):
         # Open hour dialog
-        time_btn = self.find_element(
-            By.CSS_SELECTOR,
-            "#root > div > div > div > div.jsx-475921512.container-v2.form-panel > div.jsx-475921512.contents-v2.reverse > div.jsx-3457533826.form-v2.reverse > div.jsx-3471246984 > div > div.jsx-3471246984.scheduled-picker > div.jsx-3471246984.time-picker-input.picker-input",
-        )
+        time_btn = self.locators.find("time_picker")
         time_btn.click()
 
         # Wait for animation to end
         time.sleep(1)
 
         # Find list of hours. Returns a list of 24 items (24 hours)
-        hours = self.find_elements(
-            By.CLASS_NAME, "tiktok-timepicker-option-text.tiktok-timepicker-left"
-        )
+        hours = self.locators.find_all("hours")
 
         # The nth web element corresponds to the hour
         target_hour = hours[hour]
@@ -202,9 +236,7 @@ class Scheduler(webdriver.Chrome):
                 time.sleep(1)
 
         # Find list of minutes. Return a list of 12 items (ex: 05, 10, 15, 20)
-        minutes = self.find_elements(
-            By.CLASS_NAME, "tiktok-timepicker-option-text.tiktok-timepicker-right"
-        )
+        minutes = self.locators.find_all("minutes")
 
         # Find nearest minute index
         minute_index = int(minute / (60 / len(minutes)))
@@ -228,31 +260,22 @@ class Scheduler(webdriver.Chrome):
             cookies: The session cookie to log in in the future.
         """
         # Go to the login page
-        self.get(TIKTOK_LOGIN_URL)
+        self.get(self.login_url)
 
         # Input email
-        email_input = self.find_element(
-            By.CSS_SELECTOR,
-            "#loginContainer > div.tiktok-aa97el-DivLoginContainer.exd0a430 > form > div.tiktok-q83gm2-DivInputContainer.etcs7ny0 > input",
-        )
+        email_input = self.locators.find("login_email")
         for letter in email:
             email_input.send_keys(letter)
             time.sleep(random.random() * 0.25)
 
         # Input password
-        password_input = self.find_element(
-            By.CSS_SELECTOR,
-            "#loginContainer > div.tiktok-aa97el-DivLoginContainer.exd0a430 > form > div.tiktok-15iauzg-DivContainer.e1bi0g3c0 > div > input",
-        )
+        password_input = self.locators.find("login_password")
         for letter in password:
             password_input.send_keys(letter)
             time.sleep(random.random() * 0.25)
 
         # Submit
-        submit_button = self.find_element(
-            By.CSS_SELECTOR,
-            "#loginContainer > div.tiktok-aa97el-DivLoginContainer.exd0a430 > form > button",
-        )
+        submit_button = self.locators.find("login_submit")
         submit_button.click()
 
         # Wait for page load
@@ -0,0 +1,187 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List
+import threading
+import logging
+import requests
+
+from Account import Account
+from constants import *
+from tracer import trace
+
+logger = logging.getLogger(__name__)
+
+# Results of a session check
+VALID = "valid"  # the cookies work
+EXPIRED = "expired"  # the cookies are missing, expired or rejected
+UNKNOWN = "unknown"  # TikTok couldn't be reached, the cookies are assumed to work
+
+
+class SessionExpiredError(Exception):
+    """
+    Raised when an account needs to log in again but the run is not interactive.
+    """
+
+
+class SessionManager:
+    """
+    Checks the TikTok sessions of the accounts in the background before uploading.
+
+    Cookie expiries are read first, and the sessions that look alive are validated with a
+    lightweight authenticated request. Any cookie TikTok rolls over in the response is kept
+    until the thread processing the account saves it (see save_renewed_cookies), so sessions
+    get refreshed before they run out without the checks writing the account files. Accounts
+    that need an interactive login are reported separately, so the rest of the accounts never
+    wait on a console prompt.
+    """
+
+    def __init__(self, emails: List[str], workers: int = SESSION_CHECK_WORKERS) -> None:
+        # Cookies renewed by the checks, waiting to be saved
+        self.renewed: Dict[str, List[dict]] = {}
+        self.lock = threading.Lock()
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.checks: Dict[str, Future] = {
+            email: self.executor.submit(self.check, email) for email in emails
+        }
+
+    def get_status(self, email: str) -> str:
+        """
+        Waits for the check of an account to finish.
+
+        Returns:
+            str: VALID, EXPIRED or UNKNOWN.
+        """
+        if email not in self.checks:
+            self.checks[email] = self.executor.submit(self.check, email)
+        return self.checks[email].result()
+
+    def refresh(self, email: str) -> str:
+        """
+        Checks the session of an account again (ex: before each run of the daemon).
+
+        Returns:
+            str: VALID, EXPIRED or UNKNOWN.
+        """
+        self.checks[email] = self.executor.submit(self.check, email)
+        return self.checks[email].result()
+
+    def needs_login(self, email: str) -> bool:
+        return self.get_status(email) == EXPIRED
+
+    def save_renewed_cookies(self, email: str):
+        """
+        Saves the cookies TikTok renewed while checking an account. Called by the thread that
+        processes the account, before it loads it, so the account file has a single writer.
+        """
+        with self.lock:
+            cookies = self.renewed.pop(email, None)
+        if not cookies:
+            return
+
+        account = Account(email)
+        account.cookies = cookies
+        account.save()
+
+    def check(self, email: str) -> str:
+        """
+        Checks and refreshes the session of an account.
+
+        Returns:
+            str: VALID, EXPIRED or UNKNOWN.
+        """
+        account = Account(email)
+        with trace("session_check", email=email):
+            if not account.cookies:
+                return EXPIRED
+
+            expiry = get_session_expiry(account.cookies)
+            if expiry and expiry < datetime.now():
+                logger.info(f"The session of {email} expired on {expiry}")
+                return EXPIRED
+
+            status = self.validate(account)
+
+        if status == VALID and expiry and expiry < datetime.now() + timedelta(
+            days=SESSION_EXPIRY_MARGIN
+        ):
+            logger.warning(
+                f"The session of {email} expires on {expiry} and TikTok didn't extend it"
+            )
+        return status
+
+    def validate(self, account: Account) -> str:
+        """
+        Makes an authenticated request with the cookies of an account, and keeps any cookie
+        TikTok renews in the response.
+
+        Returns:
+            str: VALID, EXPIRED or UNKNOWN.
+        """
+        session = requests.Session()
+        for cookie in account.cookies:
+            session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie.get("domain", ""),
+                path=cookie.get("path", "/"),
+            )
+
+        try:
+            response = session.get(SESSION_CHECK_URL, timeout=SESSION_CHECK_TIMEOUT)
+            data = response.json()
+        except (requests.RequestException, ValueError):
+            logger.warning(f"Could not check the session of {account.email}")
+            return UNKNOWN
+
+        if data.get("message") != "success":
+            return EXPIRED
+
+        # Keep the cookies TikTok renewed, the account is saved by the thread processing it
+        if update_cookies(account.cookies, response.cookies):
+            with self.lock:
+                self.renewed[account.email] = account.cookies
+
+        return VALID
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_session_expiry(cookies: List[dict]) -> datetime | None:
+    """
+    Returns:
+        datetime | None: when the first session cookie expires, None if they don't have an expiry.
+    """
+    expiries = [
+        cookie["expiry"]
+        for cookie in cookies
+        if cookie["name"] in SESSION_COOKIES and "expiry" in cookie
+    ]
+    if not expiries:
+        return None
+    return datetime.fromtimestamp(min(expiries))
+
+
+def update_cookies(cookies: List[dict], renewed: requests.cookies.RequestsCookieJar) -> bool:
+    """
+    Updates the value and expiry of the Selenium cookies with the ones set in a response.
+
+    Returns:
+        bool: if any cookie changed.
+    """
+    changed = False
+    for renewed_cookie in renewed:
+        for cookie in cookies:
+            if cookie["name"] != renewed_cookie.name:
+                continue
+
+            if cookie["value"] != renewed_cookie.value or (
+                renewed_cookie.expires and cookie.get("expiry") != renewed_cookie.expires
+            ):
+                cookie["value"] = renewed_cookie.value
+                if renewed_cookie.expires:
+                    cookie["expiry"] = renewed_cookie.expires
+                changed = True
+
+    return changed
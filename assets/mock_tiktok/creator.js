@@ -0,0 +1,161 @@
+// Behaviour of the local TikTok upload page stand-in.
+// Settings come from /config.js, which the server writes as window.MOCK.
+const config = Object.assign(
+  { uploadLatency: 2, bandwidth: 0, alert: false, allowModal: true, maxDays: 10 },
+  window.MOCK || {}
+);
+
+const pad = (n) => String(n).padStart(2, "0");
+const formatDate = (d) => `${d.getFullYear()}-${pad(d.getMonth() + 1)}-${pad(d.getDate())}`;
+
+const today = new Date();
+today.setHours(0, 0, 0, 0);
+const lastDay = new Date(today);
+lastDay.setDate(lastDay.getDate() + config.maxDays);
+
+const state = {
+  date: formatDate(today),
+  hour: 12,
+  minute: 0,
+  month: new Date(today.getFullYear(), today.getMonth(), 1),
+  uploaded: false,
+};
+
+const $ = (id) => document.getElementById(id);
+
+// Upload: the post button is enabled after the configured latency,
+// plus the file size divided by the bandwidth if one is set
+$("file-input").addEventListener("change", (event) => {
+  const file = event.target.files[0];
+  if (!file) return;
+
+  let delay = config.uploadLatency;
+  if (config.bandwidth > 0) delay += file.size / config.bandwidth;
+
+  $("status").textContent = "Uploading...";
+  setTimeout(() => {
+    state.uploaded = true;
+    state.size = file.size;
+    state.name = file.name;
+    $("status").textContent = "Uploaded";
+    $("post-button").disabled = false;
+  }, delay * 1000);
+});
+
+// Schedule switch
+$("tux-3").addEventListener("click", () => {
+  $("schedule-container").hidden = !$("tux-3").checked;
+  if ($("tux-3").checked && config.allowModal && !sessionStorage.getItem("allowed")) {
+    $("allow-modal").hidden = false;
+  }
+});
+
+$("allow-button").addEventListener("click", () => {
+  sessionStorage.setItem("allowed", "1");
+  $("allow-modal").hidden = true;
+});
+
+// Date picker
+function renderCalendar() {
+  const month = state.month;
+  $("month-title").textContent = month.toLocaleString("en", { month: "long", year: "numeric" });
+
+  const days = $("days");
+  days.innerHTML = "";
+  const daysInMonth = new Date(month.getFullYear(), month.getMonth() + 1, 0).getDate();
+  for (let day = 1; day <= daysInMonth; day++) {
+    const date = new Date(month.getFullYear(), month.getMonth(), day);
+    const valid = date >= today && date <= lastDay;
+
+    const span = document.createElement("span");
+    span.className = `jsx-4172176419 day ${valid ? "valid" : "invalid"}`;
+    span.textContent = String(day);
+    if (valid) {
+      span.addEventListener("click", (event) => {
+        event.stopPropagation();
+        setDate(formatDate(date));
+        $("calendar").hidden = true;
+      });
+    }
+    days.appendChild(span);
+  }
+}
+
+function setDate(value) {
+  state.date = value;
+  $("date-value").value = value;
+}
+
+$("date-picker").addEventListener("click", (event) => {
+  if ($("calendar").contains(event.target)) return;
+  $("calendar").hidden = !$("calendar").hidden;
+  renderCalendar();
+});
+
+$("previous-month").addEventListener("click", () => {
+  state.month = new Date(state.month.getFullYear(), state.month.getMonth() - 1, 1);
+  renderCalendar();
+});
+
+$("next-month").addEventListener("click", () => {
+  state.month = new Date(state.month.getFullYear(), state.month.getMonth() + 1, 1);
+  renderCalendar();
+});
+
+// Time picker
+function setTime(hour, minute) {
+  state.hour = hour;
+  state.minute = minute;
+  $("time-value").value = `${pad(hour)}:${pad(minute)}`;
+}
+
+for (let hour = 0; hour < 24; hour++) {
+  const span = document.createElement("span");
+  span.className = "tiktok-timepicker-option-text tiktok-timepicker-left";
+  span.textContent = pad(hour);
+  span.addEventListener("click", () => setTime(hour, state.minute));
+  $("hours").appendChild(span);
+}
+
+for (let minute = 0; minute < 60; minute += 5) {
+  const span = document.createElement("span");
+  span.className = "tiktok-timepicker-option-text tiktok-timepicker-right";
+  span.textContent = pad(minute);
+  span.addEventListener("click", () => {
+    setTime(state.hour, minute);
+    $("time-list").hidden = true;
+  });
+  $("minutes").appendChild(span);
+}
+
+$("time-picker").addEventListener("click", (event) => {
+  if ($("time-list").contains(event.target)) return;
+  $("time-list").hidden = !$("time-list").hidden;
+});
+
+// Post
+$("post-button").addEventListener("click", async () => {
+  if (!state.uploaded) return;
+
+  const post = {
+    caption: $("caption").textContent,
+    scheduled: $("tux-3").checked,
+    date: $("date-value").value,
+    time: $("time-value").value,
+    name: state.name,
+    size: state.size,
+  };
+  $("post-button").disabled = true;
+  await fetch("/api/post", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(post),
+  });
+  $("status").textContent = "Your video has been posted";
+});
+
+setDate(state.date);
+setTime(state.hour, state.minute);
+
+// TikTok sometimes shows an empty popup, Scheduler.wait_for_alert accepts it
+if (config.alert) setTimeout(() => alert(""), 500);
@@ -0,0 +1,648 @@
+from datetime import datetime, timedelta
+from typing import List, Tuple
+import subprocess
+import threading
+import argparse
+import platform
+import logging
+import shutil
+import json
+import time
+import sys
+import os
+
+from constants import *
+from util import create_directory, get_url_id
+import clipper
+import profiles
+import tracer
+
+# Configure the logger
+logging.basicConfig(
+    level=logging.INFO, format="[%(levelname)s][%(asctime)s]: %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Seconds between each fake caption
+TRANSCRIPT_INTERVAL = 3
+
+# Modules the administrative commands of main.py must not import at startup
+HEAVY_MODULES = [
+    "selenium",
+    "selenium_stealth",
+    "webdriver_manager",
+    "PIL",
+    "youtube_transcript_api",
+    "syllapy",
+    "yt_dlp",
+    "scrapetube",
+    "bs4",
+    "requests",
+]
+
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks with synthetic fixtures and a local TikTok stand-in."
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    clipper_parser = subparsers.add_parser(
+        "clipper", help="Times make_clips with the network stages stubbed out."
+    )
+    clipper_parser.add_argument(
+        "--durations",
+        nargs="*",
+        type=int,
+        default=[30, 120],
+        help="Durations of the synthetic sources in seconds.",
+    )
+    clipper_parser.add_argument(
+        "--resolutions",
+        nargs="*",
+        type=str,
+        default=["1280x720", "1920x1080"],
+        help="Resolutions of the synthetic sources (WxH).",
+    )
+    clipper_parser.add_argument(
+        "--encoder",
+        type=str,
+        default="libx264",
+        help="Encoder of the final clips (ex: libx264, h264_nvenc).",
+    )
+    clipper_parser.add_argument(
+        "--no_secondary_content", action="store_true", help="Skip secondary content."
+    )
+    clipper_parser.add_argument(
+        "--no_subtitles", action="store_true", help="Skip the fake transcript."
+    )
+    clipper_parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Path to the JSON report (default: benchmark/<commit>_<encoder>.json)",
+    )
+    clipper_parser.add_argument(
+        "--compare", type=str, help="Previous report to compare the results with."
+    )
+
+    scheduler_parser = subparsers.add_parser(
+        "scheduler",
+        help="Times Scheduler.post against a local stand-in of the TikTok upload page.",
+    )
+    scheduler_parser.add_argument(
+        "--posts", type=int, default=6, help="Number of videos to post."
+    )
+    scheduler_parser.add_argument(
+        "--concurrency",
+        nargs="*",
+        type=int,
+        default=[1, 2],
+        help="Number of browsers posting at the same time, each value is a run.",
+    )
+    scheduler_parser.add_argument(
+        "--upload_latency",
+        type=float,
+        default=2,
+        help="Seconds until an upload can be posted.",
+    )
+    scheduler_parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=0,
+        help="Simulated upload speed in bytes per second (0 to ignore the file size).",
+    )
+    scheduler_parser.add_argument(
+        "--video_size",
+        type=int,
+        default=5_000_000,
+        help="Size in bytes of the dummy video that is uploaded.",
+    )
+    scheduler_parser.add_argument(
+        "--output", type=str, default=None, help="Path to the JSON report."
+    )
+
+    imports_parser = subparsers.add_parser(
+        "imports",
+        help="Checks that importing main.py stays within the import-time budget.",
+    )
+    imports_parser.add_argument(
+        "--budget",
+        type=float,
+        default=IMPORT_TIME_BUDGET,
+        help="Maximum seconds to import main.py.",
+    )
+
+    args = parser.parse_args()
+    if args.benchmark == "imports":
+        # Exit with an error on regressions, so it can be used as a check
+        if not check_imports(args.budget):
+            raise SystemExit(1)
+
+    elif args.benchmark == "scheduler":
+        report = benchmark_scheduler(
+            args.posts,
+            args.concurrency,
+            args.upload_latency,
+            args.bandwidth,
+            args.video_size,
+        )
+
+        output = args.output or os.path.join(
+            BENCHMARK_PATH, f"{report['commit'][:8]}_scheduler.json"
+        )
+        save_report(report, output)
+        print_scheduler_report(report)
+
+    elif args.benchmark == "clipper":
+        resolutions = [parse_resolution(r) for r in args.resolutions]
+        report = benchmark_clipper(
+            args.durations,
+            resolutions,
+            args.encoder,
+            not args.no_secondary_content,
+            not args.no_subtitles,
+        )
+
+        output = args.output or os.path.join(
+            BENCHMARK_PATH, f"{report['commit'][:8]}_{args.encoder}.json"
+        )
+        save_report(report, output)
+        print_report(report)
+
+        if args.compare:
+            with open(args.compare, "r", encoding="utf-8") as file:
+                print_comparison(json.load(file), report)
+
+
+def parse_resolution(resolution: str) -> Tuple[int, int]:
+    width, height = resolution.lower().split("x")
+    return int(width), int(height)
+
+
+def benchmark_clipper(
+    durations: List[int],
+    resolutions: List[Tuple[int, int]],
+    encoder: str,
+    secondary_content: bool = True,
+    subtitles: bool = True,
+) -> dict:
+    """
+    Runs make_clips on synthetic sources of every duration and resolution.
+
+    The download and the transcript are replaced with local fixtures, so it runs without network.
+    Everything is run inside benchmark/run so the real output folder and journals are not touched.
+
+    Returns:
+        dict: the report, with the per-stage times of each case.
+    """
+    fixtures_path = os.path.abspath(os.path.join(BENCHMARK_PATH, "fixtures"))
+    run_path = os.path.abspath(os.path.join(BENCHMARK_PATH, "run"))
+    font_file = os.path.abspath(FONT_FILE)
+    create_directory(fixtures_path)
+
+    # Secondary content is looped, so one short clip is enough
+    content_path = os.path.join(fixtures_path, "content")
+    create_directory(content_path)
+    make_source(os.path.join(content_path, "content.mp4"), 20, CLIP_RESOLUTION)
+
+    # Stub out the network and point the clipper at the fixtures
+    sources = {}
+    clipper.download_youtube_video = lambda url, path="", *args, **kwargs: copy_source(
+        sources[get_url_id(url)], path, get_url_id(url)
+    )
+    clipper.YouTubeTranscriptApi = FakeTranscriptApi
+    clipper.SECONDARY_CONTENT_PATH = content_path
+    clipper.FONT_FILE = font_file
+    use_encoder(encoder)
+
+    cases = []
+    cwd = os.getcwd()
+    for width, height in resolutions:
+        for duration in durations:
+            id = f"bench{width}x{height}d{duration}"
+            sources[id] = os.path.join(fixtures_path, f"{id}.mp4")
+            make_source(sources[id], duration, (width, height))
+
+            # Start every case from an empty directory
+            shutil.rmtree(run_path, ignore_errors=True)
+            create_directory(run_path)
+            os.chdir(run_path)
+            try:
+                cases.append(
+                    run_case(id, duration, (width, height), secondary_content, subtitles)
+                )
+            finally:
+                os.chdir(cwd)
+
+    shutil.rmtree(run_path, ignore_errors=True)
+
+    return {
+        "commit": get_commit(),
+        "encoder": encoder,
+        "secondary_content": secondary_content,
+        "subtitles": subtitles,
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "ffmpeg": get_ffmpeg_version(),
+        },
+        "cases": cases,
+    }
+
+
+def use_encoder(encoder: str):
+    """
+    Makes the clipper encode the clips with an encoder (ex: "libx264" without a GPU).
+    """
+    # The final encode and the profile probes read the encoder from profiles
+    profiles.VIDEO_ENCODER = encoder
+
+
+def run_case(
+    id: str,
+    duration: int,
+    resolution: Tuple[int, int],
+    secondary_content: bool,
+    subtitles: bool,
+) -> dict:
+    """
+    Times make_clips for a single source.
+
+    Returns:
+        dict: total and per-stage times, realtime multiple and disk usage of the case.
+    """
+    logger.info(f"Benchmarking {id}...")
+    tracer.spans.clear()
+
+    # Measure the temporary files while the clips are made
+    monitor = DiskMonitor([TEMP_PATH, OUTPUT_PATH])
+    monitor.start()
+
+    start = time.perf_counter()
+    clips = clipper.make_clips(
+        f"https://www.youtube.com/watch?v={id}",
+        "bench",
+        secondary_content,
+        subtitles,
+    )
+    wall_time = time.perf_counter() - start
+
+    monitor.stop()
+
+    return {
+        "id": id,
+        "duration": duration,
+        "resolution": f"{resolution[0]}x{resolution[1]}",
+        "clips": len(clips),
+        "wall_time": wall_time,
+        "realtime": duration / wall_time,
+        "peak_disk_bytes": monitor.peak_bytes,
+        "output_bytes": sum(os.path.getsize(clip) for clip in clips),
+        "stages": summarize_spans(tracer.spans),
+    }
+
+
+def summarize_spans(spans: List[dict]) -> dict:
+    """
+    Adds up the spans of each stage.
+
+    Returns:
+        dict: {"ffmpeg.crop": {"count": 1, "wall_time": 3.2, "cpu_time": 11.9, "mean_fps": 120.4}, ...}
+    """
+    stages = {}
+    for span in spans:
+        stage = stages.setdefault(
+            span["name"],
+            {"count": 0, "wall_time": 0.0, "cpu_time": 0.0, "frames": 0},
+        )
+        stage["count"] += 1
+        stage["wall_time"] += span["wall_time"]
+        stage["cpu_time"] += span["cpu_time"]
+        stage["frames"] += span.get("frames", 0)
+
+    for stage in stages.values():
+        stage["fps"] = stage["frames"] / stage["wall_time"] if stage["wall_time"] else 0
+
+    return stages
+
+
+def benchmark_scheduler(
+    n_posts: int,
+    concurrencies: List[int],
+    upload_latency: float,
+    bandwidth: float,
+    video_size: int,
+) -> dict:
+    """
+    Posts dummy videos with one or more Schedulers against the local TikTok stand-in.
+
+    Returns:
+        dict: the report, with the posts per minute and the time spent in each wait for every concurrency.
+    """
+    # Imported here so the clipper benchmark doesn't need selenium
+    from Scheduler import Scheduler
+    from mock_tiktok import MockTikTokServer
+
+    server = MockTikTokServer(upload_latency=upload_latency, bandwidth=bandwidth)
+    server.start()
+
+    # The stand-in only looks at the size of the file
+    fixtures_path = os.path.abspath(os.path.join(BENCHMARK_PATH, "fixtures"))
+    create_directory(fixtures_path)
+    video_path = os.path.join(fixtures_path, f"upload_{video_size}.mp4")
+    with open(video_path, "wb") as file:
+        file.write(os.urandom(video_size))
+
+    runs = []
+    for concurrency in concurrencies:
+        logger.info(f"Posting {n_posts} videos with {concurrency} browsers...")
+        tracer.spans.clear()
+        server.posts.clear()
+
+        # Spread the posts over the browsers
+        dates = [
+            datetime.now().replace(minute=0, second=0, microsecond=0)
+            + timedelta(days=1, hours=i)
+            for i in range(n_posts)
+        ]
+        batches = [dates[i::concurrency] for i in range(concurrency)]
+
+        def post_batch(batch: List[datetime]):
+            account = FakeAccount()
+            scheduler = Scheduler(account, base_url=server.url)
+            try:
+                for date in batch:
+                    scheduler.post(video_path, "Benchmark | Part 1 #test", date)
+            finally:
+                scheduler.quit()
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=post_batch, args=(b,)) for b in batches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.perf_counter() - start
+
+        runs.append(
+            {
+                "concurrency": concurrency,
+                "posts": len(server.posts),
+                "wall_time": wall_time,
+                "posts_per_minute": len(server.posts) / wall_time * 60,
+                "stages": summarize_spans(tracer.spans),
+            }
+        )
+
+    server.stop()
+
+    return {
+        "commit": get_commit(),
+        "upload_latency": upload_latency,
+        "bandwidth": bandwidth,
+        "video_size": video_size,
+        "runs": runs,
+    }
+
+
+def check_imports(budget: float, runs: int = 5) -> bool:
+    """
+    Imports main.py in fresh interpreters and checks it is fast and doesn't load heavy modules.
+
+    Args:
+        budget (float): maximum seconds to import main.py (best of the runs).
+        runs (int): number of interpreters to measure.
+
+    Returns:
+        bool: if the import is within the budget and no heavy module was imported.
+    """
+    import_time, heavy = measure_imports(runs)
+
+    print(f"Importing main.py takes {import_time * 1000:.1f}ms (budget {budget * 1000:.0f}ms)")
+    if heavy:
+        print(f"Heavy modules imported at startup: {heavy}")
+
+    return import_time <= budget and not heavy
+
+
+def measure_imports(runs: int = 5) -> Tuple[float, List[str]]:
+    """
+    Imports main.py in fresh interpreters.
+
+    Returns:
+        Tuple[float, List[str]]: seconds the import took (best of the runs), and the heavy
+        modules it loaded (see HEAVY_MODULES).
+    """
+    times = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-c",
+                "import main, sys, json; print(json.dumps(sorted(sys.modules)))",
+            ],
+            # main.py is imported from the folder of this file
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+
+        # Lines look like "import time:  self [us] | cumulative | imported package"
+        for line in result.stderr.splitlines():
+            self_time, cumulative, package = line.removeprefix("import time:").split("|")
+            if package.strip() == "main":
+                times.append(int(cumulative) / 1e6)
+
+    modules = set(json.loads(result.stdout))
+    heavy = [module for module in HEAVY_MODULES if module in modules]
+    return min(times), heavy
+
+
+class FakeAccount:
+    """
+    Stand-in for Account with a session cookie the TikTok stand-in accepts.
+    """
+
+    email = "benchmark@example.com"
+    cookies = [{"name": "sessionid", "value": "mock-session"}]
+
+    def save(self):
+        pass
+
+
+class DiskMonitor(threading.Thread):
+    """
+    Samples the size of some directories in the background and keeps the peak.
+    """
+
+    def __init__(self, paths: List[str], interval: float = 0.2) -> None:
+        super().__init__(daemon=True)
+        self.paths = paths
+        self.interval = interval
+        self.peak_bytes = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak_bytes = max(self.peak_bytes, get_size(self.paths))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def get_size(paths: List[str]) -> int:
+    """
+    Returns:
+        int: bytes used by all the files inside the directories.
+    """
+    size = 0
+    for path in paths:
+        for root, _, files in os.walk(path):
+            for file in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, file))
+                except OSError:
+                    # The file was removed while walking
+                    pass
+    return size
+
+
+class FakeTranscriptApi:
+    """
+    Stand-in for YouTubeTranscriptApi that returns a caption every few seconds.
+    """
+
+    @classmethod
+    def get_transcript(cls, video_id: str) -> List[dict]:
+        duration = int(video_id.split("d")[-1])
+        return [
+            {
+                "text": "the quick brown fox jumps over the lazy dog",
+                "start": float(start),
+                "duration": float(TRANSCRIPT_INTERVAL),
+            }
+            for start in range(0, duration, TRANSCRIPT_INTERVAL)
+        ]
+
+
+def make_source(path: str, duration: int, resolution: Tuple[int, int]):
+    """
+    Generates a synthetic video with a test pattern and a sine tone, if it doesn't exist yet.
+    """
+    if os.path.exists(path):
+        return
+
+    width, height = resolution
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc=size={width}x{height}:rate=30:duration={duration}",
+        "-f",
+        "lavfi",
+        "-i",
+        f"sine=frequency=440:duration={duration}",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "ultrafast",
+        "-c:a",
+        "aac",
+        "-shortest",
+        path,
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def copy_source(source_path: str, path: str, id: str) -> str:
+    """
+    Stand-in for download_youtube_video that copies a fixture.
+    """
+    file_path = os.path.join(path, f"{id}.mp4")
+    shutil.copy(source_path, file_path)
+    return file_path
+
+
+def get_commit() -> str:
+    result = subprocess.run(
+        ["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE, text=True
+    )
+    return result.stdout.strip() or "unknown"
+
+
+def get_ffmpeg_version() -> str:
+    result = subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, text=True)
+    return result.stdout.split("\n")[0]
+
+
+def save_report(report: dict, path: str):
+    create_directory(os.path.dirname(path) or ".")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    logger.info(f"Report saved to {path}")
+
+
+def print_report(report: dict):
+    print(f"\nCommit {report['commit'][:8]} | encoder {report['encoder']}")
+    for case in report["cases"]:
+        print(
+            f"\n{case['id']}: {case['wall_time']:.1f}s ({case['realtime']:.2f}x realtime), "
+            f"{case['clips']} clips, peak disk {case['peak_disk_bytes'] / 1e6:.1f} MB"
+        )
+        for name, stage in sorted(
+            case["stages"].items(), key=lambda x: -x[1]["wall_time"]
+        ):
+            print(
+                f"  {name:<24} {stage['wall_time']:>8.2f}s  x{stage['count']:<3} "
+                f"cpu {stage['cpu_time']:>8.2f}s  {stage['fps']:>7.1f} fps"
+            )
+
+
+def print_scheduler_report(report: dict):
+    print(f"\nCommit {report['commit'][:8]} | upload latency {report['upload_latency']}s")
+    for run in report["runs"]:
+        print(
+            f"\n{run['concurrency']} browsers: {run['posts']} posts in {run['wall_time']:.1f}s "
+            f"({run['posts_per_minute']:.1f} posts/minute)"
+        )
+        for name, stage in sorted(run["stages"].items(), key=lambda x: x[0]):
+            print(
+                f"  {name:<28} {stage['wall_time'] / stage['count']:>8.2f}s avg  x{stage['count']}"
+            )
+
+
+def print_comparison(previous: dict, current: dict):
+    """
+    Prints how much faster (>1) or slower (<1) each case got compared to a previous report.
+    """
+    print(
+        f"\n{previous['commit'][:8]} ({previous['encoder']}) -> "
+        f"{current['commit'][:8]} ({current['encoder']})"
+    )
+    previous_cases = {case["id"]: case for case in previous["cases"]}
+    for case in current["cases"]:
+        before = previous_cases.get(case["id"])
+        if not before:
+            continue
+
+        print(
+            f"  {case['id']:<28} {before['wall_time']:>8.1f}s -> {case['wall_time']:>8.1f}s "
+            f"({before['wall_time'] / case['wall_time']:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+from typing import List, Tuple
+import logging
+import re
+import os
+
+from numpy.lib.stride_tricks import sliding_window_view
+import numpy as np
+
+from constants import *
+from runner import FFmpegError, run_ffmpeg
+from tracer import trace
+from util import create_directory, get_video_duration
+
+logger = logging.getLogger(__name__)
+
+# Extra cost, in dB, of cutting in the middle of a word of the transcript
+WORD_PENALTY = 20
+# Extra cost, in dB, of cutting BOUNDARY_TOLERANCE seconds away from the target length
+DISTANCE_PENALTY = 6
+# Quietest level considered, so digital silence doesn't outweigh everything else
+SILENCE_FLOOR = -60
+
+
+def plan_boundaries(
+    video_path: str,
+    work_path: str = TEMP_PATH,
+    transcript_path: str | None = None,
+    duration: int = CLIP_DURATION,
+) -> List[float]:
+    """
+    Chooses where to cut a video in to clips of about duration seconds, preferring the
+    silences and the ends of the words of the transcript to the exact multiples of duration.
+
+    Args:
+        video_path (str): path to the video.
+        work_path (str): folder for the temporary audio.
+        transcript_path (str): SRT transcript of the video, if there is one.
+        duration (int): target length of each clip (in seconds).
+
+    Returns:
+        List[float]: seconds at which to cut the video, in order (ex: [58.4, 121.06]).
+    """
+    total = get_video_duration(video_path)
+    if not SMART_BOUNDARIES:
+        return get_fixed_boundaries(total, duration)
+
+    with trace("boundary_plan", path=video_path):
+        samples = read_audio(video_path, work_path)
+        if samples is None:
+            return get_fixed_boundaries(total, duration)
+
+        words = read_words(transcript_path) if transcript_path else []
+        return choose_boundaries(get_loudness(samples), words, total, duration)
+
+
+def get_fixed_boundaries(total: float, duration: int = CLIP_DURATION) -> List[float]:
+    """
+    Returns:
+        List[float]: multiples of duration within the video.
+    """
+    return [float(time) for time in np.arange(duration, total, duration)]
+
+
+def read_audio(video_path: str, work_path: str = TEMP_PATH) -> np.ndarray | None:
+    """
+    Decodes only the audio of a video, in mono at BOUNDARY_SAMPLE_RATE.
+
+    Returns:
+        np.ndarray | None: the samples, None if the video has no audio.
+    """
+    create_directory(work_path)
+    audio_path = os.path.join(work_path, "boundaries.pcm")
+    args = ["-i", video_path, "-vn", "-ac", "1", "-ar", str(BOUNDARY_SAMPLE_RATE)]
+    try:
+        run_ffmpeg("boundary_audio", args + ["-f", "s16le", audio_path])
+    except FFmpegError as e:
+        logger.warning(f"Could not read the audio of {video_path}, cutting at fixed lengths: {e}")
+        return None
+
+    samples = np.fromfile(audio_path, dtype=np.int16)
+    os.remove(audio_path)
+    return samples if len(samples) else None
+
+
+def get_loudness(samples: np.ndarray) -> np.ndarray:
+    """
+    Measures the loudness of every BOUNDARY_FRAME seconds of audio.
+
+    Returns:
+        np.ndarray: RMS of each frame in dB, relative to the loud parts of the video.
+    """
+    frame = max(int(BOUNDARY_SAMPLE_RATE * BOUNDARY_FRAME), 1)
+    n_frames = len(samples) // frame
+    frames = samples[: n_frames * frame].astype(np.float32).reshape(n_frames, frame)
+
+    rms = np.sqrt(np.mean(frames**2, axis=1))
+    loudness = 20 * np.log10(rms + 1e-9)
+
+    # Relative to the loud parts, so quiet and loud videos are cut the same way
+    if n_frames:
+        loudness -= np.percentile(loudness, 95)
+    return np.maximum(loudness, SILENCE_FLOOR)
+
+
+def read_words(transcript_path: str) -> List[Tuple[float, float]]:
+    """
+    Returns:
+        List[Tuple[float, float]]: start and end (in seconds) of each word of an SRT transcript.
+    """
+    if not os.path.exists(transcript_path):
+        return []
+
+    with open(transcript_path, encoding="utf-8") as f:
+        content = f.read()
+
+    # ex: "00:01:02,345 --> 00:01:02,678"
+    timestamp = r"(\d+):(\d+):(\d+),(\d+)"
+    words = []
+    for match in re.finditer(f"{timestamp} --> {timestamp}", content):
+        h1, m1, s1, ms1, h2, m2, s2, ms2 = (int(value) for value in match.groups())
+        start = h1 * 3600 + m1 * 60 + s1 + ms1 / 1000
+        end = h2 * 3600 + m2 * 60 + s2 + ms2 / 1000
+        words.append((start, end))
+    return words
+
+
+def choose_boundaries(
+    loudness: np.ndarray,
+    words: List[Tuple[float, float]],
+    total: float,
+    duration: int = CLIP_DURATION,
+    tolerance: float = BOUNDARY_TOLERANCE,
+) -> List[float]:
+    """
+    Picks each cut within tolerance seconds of duration after the previous one, where it is
+    quiet for BOUNDARY_GAP seconds, not in the middle of a word and close to the target.
+
+    Args:
+        loudness (np.ndarray): see get_loudness.
+        words (List[Tuple[float, float]]): see read_words.
+        total (float): duration of the video (in seconds).
+
+    Returns:
+        List[float]: seconds at which to cut the video, in order.
+    """
+    n_frames = len(loudness)
+
+    # The loudest moment around each frame, so cuts land in the middle of a gap
+    half = int(BOUNDARY_GAP / BOUNDARY_FRAME / 2)
+    padded = np.pad(loudness, half, mode="edge")
+    cost = sliding_window_view(padded, 2 * half + 1).max(axis=1)
+
+    # Frames inside a word, from the cumulative count of words started and ended
+    if words:
+        bounds = (np.array(words) / BOUNDARY_FRAME).astype(int)
+        starts = np.clip(bounds[:, 0] + 1, 0, n_frames)
+        ends = np.clip(bounds[:, 1], 0, n_frames)
+        valid = ends > starts
+        delta = np.zeros(n_frames + 1)
+        np.add.at(delta, starts[valid], 1)
+        np.add.at(delta, ends[valid], -1)
+        cost = cost + (np.cumsum(delta)[:n_frames] > 0) * WORD_PENALTY
+
+    boundaries = []
+    start = 0.0
+    while total - start > duration + tolerance:
+        target = start + duration
+        low = int((target - tolerance) / BOUNDARY_FRAME)
+        high = min(int((target + tolerance) / BOUNDARY_FRAME) + 1, n_frames)
+
+        # The audio may be shorter than the video
+        if low >= high:
+            cut = target
+        else:
+            times = np.arange(low, high) * BOUNDARY_FRAME
+            distance = np.abs(times - target) / tolerance * DISTANCE_PENALTY
+            cut = float(times[np.argmin(cost[low:high] + distance)])
+
+        boundaries.append(round(cut, 2))
+        start = cut
+
+    return boundaries
+
+
+def get_part_section(
+    boundaries: List[float], total: float, parts: Tuple[int, int]
+) -> Tuple[float, float, List[float]]:
+    """
+    Finds the seconds of a video covered by a range of its parts.
+
+    Args:
+        boundaries (List[float]): cuts of the whole video (see plan_boundaries).
+        total (float): duration of the video (in seconds).
+        parts (Tuple[int, int]): first part and the part after the last one, from 0
+            (ex: (2, 4) for the third and fourth clips).
+
+    Returns:
+        Tuple[float, float, List[float]]: start and end of the parts (in seconds), and the
+        cuts between them, relative to the start.
+    """
+    edges = [0.0, *boundaries, total]
+    first = min(parts[0], len(edges) - 1)
+    last = min(max(parts[1], first), len(edges) - 1)
+
+    start, end = edges[first], edges[last]
+    return start, end, [round(cut - start, 2) for cut in edges[first + 1 : last]]
+
+
+def get_segment_args(boundaries: List[float], duration: int = CLIP_DURATION) -> List[str]:
+    """
+    Builds the FFmpeg output options that place a keyframe at each boundary and cut there.
+
+    Returns:
+        List[str]: options of the segment muxer, to place before "-f segment".
+    """
+    if not boundaries:
+        # A single clip, up to the tolerance longer than the target
+        return ["-segment_time", str(duration + BOUNDARY_TOLERANCE)]
+
+    times = ",".join(f"{time:.2f}" for time in boundaries)
+    return ["-force_key_frames", times, "-segment_times", times]
@@ -1,26 +1,53 @@
 from youtube_transcript_api import YouTubeTranscriptApi
 from youtube_transcript_api.formatters import SRTFormatter
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Iterator, List, Tuple
 from PIL import Image
-import subprocess
+import threading
+import time
 import os
 import math
 import logging
 import syllapy
 import shutil
 
+from boundaries import get_part_section, get_segment_args, plan_boundaries
+from concurrency import controller
+from cropper import (
+    get_crop_path,
+    get_saliency,
+    get_tracking_crop_filter,
+    plan_crop,
+    read_proxy,
+)
 from constants import *
+from Inventory import Inventory
+from Journal import Journal
+from loudness import get_loudnorm_filter, get_stream_loudnorm_filter
+from profiles import get_output_args, get_output_profile, record_upload_size
+from runner import FFmpegError, run_ffmpeg
+from tracer import trace
 from util import *
 
-# Configure the logger
-logging.basicConfig(
-    level=logging.INFO, format="[%(levelname)s][%(asctime)s]: %(message)s"
-)
+# The logger is configured by the entry point (main.py)
 logger = logging.getLogger(__name__)
 
+# What streamed clips do differently, planning them needs the whole video (see stream_clips)
+STREAM_LIMITATIONS = [
+    "center cropped instead of following the subject",
+    f"cut every {CLIP_DURATION}s instead of in the silences between words",
+]
+stream_warned = threading.Event()
+
 
 def make_clips(
-    url: str, file_name: str, secondary_content: bool = True, captions: bool = True
+    url: str,
+    file_name: str,
+    secondary_content: bool = True,
+    captions: bool = True,
+    stream: bool = False,
+    limit: int | None = None,
+    parts: Tuple[int, int] | None = None,
 ) -> List[str]:
     """
     Process a YouTube video:
@@ -33,98 +60,877 @@ def make_clips(
         - Cuts the captions in to one word parts
         - Further processes the transcript
     4. Cuts the video in to clips
-    5. Adds text to each clip (Part 1, Part 2, etc...)
+    5. Adds text to each clip (Part 1, Part 2, etc...), the clips past the limit are kept
+       as recipes and rendered right before uploading (see materialize_clip)
+
+    With a range of parts only their seconds are prepared and cut. If parts of the video are
+    left, the download is kept and the source is journaled as partial, so a later run
+    continues from the next part.
 
     Args:
         url (str): URL of the YouTube video.
         file_name (str): start of the filename joined with the ID and part number (ex: username_videoid123_1.mp4).
         secondary_content (bool): if the video contains secondary content below the main video.
         captions (bool): if the video contains captions.
+        stream (bool): render while the video is still downloading (see stream_clips),
+            only without a range of parts.
+        limit (int): number of clips to render now, all of them by default.
+        parts (Tuple[int, int]): first part and the part after the last one to make, from 0
+            (ex: (2, 4) for parts 3 and 4), all of them by default.
 
     Returns:
-        List[str]: list file paths to each clip
+        List[str]: list file paths to each clip, recipes are not rendered yet
     """
+    if stream and not parts:
+        clips = list(stream_clips(url, file_name, secondary_content, captions, limit))
+
+        # Not every format can be read from a pipe, in that case download it normally
+        if clips:
+            return clips
+        logger.info("Streaming failed, falling back to a full download...")
+
     id = get_url_id(url)
 
-    # Create a temporary directory to keep the iterations of the video
-    create_directory(TEMP_PATH)
+    # Progress is journaled per account, so an interrupted run can pick up where it stopped
+    journal = Journal(file_name)
+
+    # Keep the iterations of each video in their own temporary directory
+    # so they survive if the process is interrupted
+    work_path = os.path.join(TEMP_PATH, id)
+    CLIPS_PATH = os.path.join(work_path, "clips")
+
+    create_directory(CLIPS_PATH)
+    create_directory(OUTPUT_PATH)
+
+    # Reuse the segments of a previous run if they were all made for the same parts
+    requested_parts = list(parts) if parts else None
+    clips = journal.get_artifact(id, "clips")
+    source = journal.get_source(id)
+    if clips and source.get("parts") == requested_parts:
+        logger.info("Resuming from the segments of a previous run...")
+        n_parts = source.get("n_parts", len(clips))
+    else:
+        video_path, boundaries, n_parts = prepare_video(
+            url, id, work_path, journal, secondary_content, captions, parts
+        )
+
+        # Divide the video in to segments
+        clips = []
+        if not parts or parts[0] < n_parts:
+            clips = clip(video_path, CLIPS_PATH, id, boundaries=boundaries)
+        journal.record_source(
+            id, "segmented", clips=clips, parts=requested_parts, n_parts=n_parts
+        )
+
+    # Process all clips, the concurrency controller decides how many are rendered at once
+    first_part = parts[0] if parts else 0
+    settings = {"secondary_content": secondary_content, "subtitles": captions}
+    with ThreadPoolExecutor(max_workers=controller.max_jobs) as executor:
+        renders = submit_clips(
+            executor, url, file_name, clips, settings, journal, limit, first_part
+        )
+        processed_clips = collect_clips(
+            renders, url, file_name, settings, journal, first_part
+        )
+
+    # The download is kept for the parts that are left
+    next_part = first_part + len(clips)
+    if parts and next_part < n_parts:
+        journal.record_source(id, "partial", next_part=next_part)
+        remove_work_files(work_path, get_source_files(journal, id))
+        logger.info(f"{n_parts - next_part} parts of {url} are left for later")
+    else:
+        journal.record_source(id, "rendered")
+
+        # Remove the temporary files of the video
+        shutil.rmtree(work_path)
+
+    evict_source_cache()
+
+    return processed_clips
+
+
+def get_source_files(journal: Journal, id: str) -> List[str | None]:
+    """
+    Returns:
+        List[str | None]: paths to the download and transcript of a video, if they exist.
+    """
+    return [journal.get_artifact(id, "video_path"), journal.get_artifact(id, "transcript_path")]
+
+
+def remove_work_files(work_path: str, keep: List[str | None]):
+    """
+    Deletes the temporary files of a video except the ones in keep.
+    """
+    keep = {os.path.abspath(path) for path in keep if path}
+    for name in os.listdir(work_path):
+        path = os.path.join(work_path, name)
+        if os.path.abspath(path) in keep:
+            continue
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def make_variant_clips(url: str, variants: List[dict]) -> List[List[str]]:
+    """
+    Makes the clips of several accounts, or several styles, from the same YouTube video.
+    The video is downloaded and decoded once, and every variant is rendered by the same
+    FFmpeg process (see segment_variants), so the cost scales with the sources rather than
+    with the variants.
+
+    Args:
+        url (str): URL of the YouTube video.
+        variants (List[dict]): outputs to make, each with a different file_name
+            (ex: [{"file_name": "a@b.com", "secondary_content": True, "captions": False,
+            "resolution": (720, 1280), "limit": 3}, ...]). The resolution and limit are optional.
+
+    Returns:
+        List[List[str]]: file paths to the clips of each variant, recipes are not rendered yet.
+    """
+    id = get_url_id(url)
+    work_path = os.path.join(TEMP_PATH, id)
+    create_directory(work_path)
+    create_directory(OUTPUT_PATH)
+
+    video_path = download_youtube_video(url, work_path)
+
+    # The transcript is shared by every variant with captions
+    transcript_path = None
+    if any(variant["captions"] for variant in variants):
+        logger.info(f"Fetching and processing captions!")
+        transcript_path = fetch_transcript(id, work_path)
+
+    logger.info(f"Rendering {len(variants)} variants of {url}...")
+    segments = segment_variants(video_path, work_path, id, variants, transcript_path)
+
+    with ThreadPoolExecutor(max_workers=controller.max_jobs) as executor:
+        renders = []
+        for variant, variant_segments in zip(variants, segments):
+            settings = {
+                "secondary_content": variant["secondary_content"],
+                "subtitles": variant["captions"],
+            }
+            journal = Journal(variant["file_name"])
+            renders.append(
+                (
+                    variant["file_name"],
+                    settings,
+                    journal,
+                    submit_clips(
+                        executor,
+                        url,
+                        variant["file_name"],
+                        variant_segments,
+                        settings,
+                        journal,
+                        variant.get("limit"),
+                    ),
+                )
+            )
+
+        variant_clips = []
+        for file_name, settings, journal, variant_renders in renders:
+            variant_clips.append(
+                collect_clips(variant_renders, url, file_name, settings, journal)
+            )
+            journal.record_source(id, "rendered")
+
+    # Remove the temporary files of the video
+    shutil.rmtree(work_path)
+    evict_source_cache()
+
+    return variant_clips
+
+
+def submit_clips(
+    executor: ThreadPoolExecutor,
+    url: str,
+    file_name: str,
+    segments: List[str],
+    settings: dict,
+    journal: Journal,
+    limit: int | None = None,
+    first_part: int = 0,
+) -> list:
+    """
+    Adds the text to each segment in the executor, keeps the segments past the limit as
+    recipes and skips the clips that were finished before an interruption.
+
+    Args:
+        first_part (int): part of the video the first segment is (ex: 2 for "Part 3").
+
+    Returns:
+        list: path to each clip, or its render if it is being rendered, in order.
+    """
+    id = get_url_id(url)
+    inventory = Inventory()
+
+    # Chosen once per source, before its first clip is rendered
+    profile = None
+
+    renders = []
+    for i, segment_path in enumerate(segments):
+        part = first_part + i
+        target_path = os.path.join(OUTPUT_PATH, f"{file_name},{part},{id}.mp4")
+
+        # Skip the clips that were finished before an interruption
+        if journal.get_clip(target_path).get("state") and os.path.exists(target_path):
+            renders.append(target_path)
+            continue
+
+        # Past the render budget only the segment is kept
+        if limit is not None and i >= limit:
+            save_recipe(inventory, url, file_name, part, segment_path, target_path, settings)
+            renders.append(target_path)
+            continue
+
+        if profile is None:
+            profile = get_output_profile(segments)
+
+        # Add some text to specify which part the clip is
+        logger.info(f"Adding text to clip {i+1}/{len(segments)}")
+        renders.append(
+            executor.submit(
+                add_text, segment_path, target_path, f"Part {part+1}", profile=profile
+            )
+        )
+
+    return renders
+
+
+def collect_clips(
+    renders: list,
+    url: str,
+    file_name: str,
+    settings: dict,
+    journal: Journal,
+    first_part: int = 0,
+) -> List[str]:
+    """
+    Waits for the clips submitted by submit_clips and records them in order as they finish.
+
+    Args:
+        first_part (int): part of the video the first render is.
+
+    Returns:
+        List[str]: file paths to each clip.
+    """
+    id = get_url_id(url)
+    inventory = Inventory()
+
+    clips = []
+    for i, render in enumerate(renders):
+        if isinstance(render, str):
+            clips.append(render)
+            continue
+
+        part = first_part + i
+        clip_path = render.result()
+        inventory.add(file_name, id, part, clip_path, settings)
+        journal.record_clip(clip_path, "rendered", id=id, part=part)
+        clips.append(clip_path)
+
+    return clips
+
+
+def save_recipe(
+    inventory: Inventory,
+    url: str,
+    file_name: str,
+    part: int,
+    segment_path: str,
+    target_path: str,
+    settings: dict,
+):
+    """
+    Moves the segment of a clip to the source cache and registers how to render it later.
+    """
+    id = get_url_id(url)
+    cache_path = os.path.join(SOURCE_CACHE_PATH, f"{file_name},{id}")
+    create_directory(cache_path)
+
+    segment = os.path.join(cache_path, f"{part:03d}.mp4")
+    shutil.move(segment_path, segment)
+
+    recipe = {"url": url, "segment": segment}
+    inventory.add(file_name, id, part, target_path, settings, recipe)
+
+
+def materialize_clip(clip: dict) -> str:
+    """
+    Renders a clip kept as a recipe. If its segment was evicted from the cache, the source
+    is downloaded and segmented again.
+
+    Args:
+        clip (dict): entry of the inventory (see Inventory.add).
+
+    Returns:
+        str: path to the rendered clip.
+    """
+    recipe = clip["recipe"]
+    if not os.path.exists(recipe["segment"]):
+        resegment_source(clip)
+
+    logger.info(f"Adding text to clip {clip['part']+1} of {clip['id']}")
+    with trace("materialize", id=clip["id"], part=clip["part"]):
+        profile = get_output_profile([recipe["segment"]])
+        clip_path = add_text(
+            recipe["segment"], clip["path"], f"Part {clip['part']+1}", profile=profile
+        )
+
+    # The rendered clip replaces the recipe
+    Inventory().add(clip["email"], clip["id"], clip["part"], clip_path, clip["settings"])
+    Journal(clip["email"]).record_clip(
+        clip_path, "rendered", id=clip["id"], part=clip["part"]
+    )
+
+    os.remove(recipe["segment"])
+    cache_path = os.path.dirname(recipe["segment"])
+    if not os.listdir(cache_path):
+        os.rmdir(cache_path)
+
+    return clip_path
+
+
+def resegment_source(recipe_clip: dict):
+    """
+    Prepares and segments the source of a recipe again, and puts back the segments of every
+    recipe of that source in the cache.
+    """
+    logger.info(f"The segments of {recipe_clip['id']} were evicted, preparing it again...")
+    id = recipe_clip["id"]
+    work_path = os.path.join(TEMP_PATH, id)
+    clips_path = os.path.join(work_path, "clips")
+    create_directory(clips_path)
+
+    # Only the parts of the recipes are prepared again
+    recipes = [
+        pending
+        for pending in Inventory().get_account_clips(recipe_clip["email"])
+        if pending["id"] == id and pending["recipe"]
+    ]
+    first_part = min(pending["part"] for pending in recipes)
+    last_part = max(pending["part"] for pending in recipes)
+
+    settings = recipe_clip["settings"]
+    journal = Journal(recipe_clip["email"])
+    state = journal.get_source(id).get("state")
+    video_path, boundaries, _ = prepare_video(
+        recipe_clip["recipe"]["url"],
+        id,
+        work_path,
+        journal,
+        settings.get("secondary_content", True),
+        settings.get("subtitles", True),
+        (first_part, last_part + 1),
+    )
+
+    # The same boundaries are found again, so the parts match their recipes
+    segments = clip(video_path, clips_path, id, boundaries=boundaries)
+
+    for pending in recipes:
+        index = pending["part"] - first_part
+        if index >= len(segments):
+            continue
+
+        recipe = pending["recipe"]
+        create_directory(os.path.dirname(recipe["segment"]))
+        shutil.move(segments[index], recipe["segment"])
 
+    # Downloading again is not progress, the source goes back to where it was
+    if state and journal.get_source(id)["state"] != state:
+        journal.record_source(id, state)
+
+    # A partial source keeps its download for the parts that are left
+    if state == "partial":
+        remove_work_files(work_path, get_source_files(journal, id))
+    else:
+        shutil.rmtree(work_path)
+
+
+def evict_source_cache(max_bytes: int = MAX_SOURCE_CACHE_BYTES):
+    """
+    Deletes the segments of the least recently cached sources until the cache fits in max_bytes.
+    Their recipes stay valid, the sources are segmented again if they are needed.
+    """
+    if not os.path.exists(SOURCE_CACHE_PATH):
+        return
+
+    sources = []
+    for name in os.listdir(SOURCE_CACHE_PATH):
+        path = os.path.join(SOURCE_CACHE_PATH, name)
+        files = [os.path.join(path, file) for file in os.listdir(path)]
+        size = sum(os.path.getsize(file) for file in files)
+        sources.append((os.path.getmtime(path), size, path))
+
+    total = sum(size for _, size, _ in sources)
+    for _, size, path in sorted(sources):
+        if total <= max_bytes:
+            break
+
+        logger.info(f"Evicting {path} from the source cache")
+        shutil.rmtree(path)
+        total -= size
+
+
+def prepare_video(
+    url: str,
+    id: str,
+    work_path: str,
+    journal: Journal,
+    secondary_content: bool = True,
+    captions: bool = True,
+    parts: Tuple[int, int] | None = None,
+) -> Tuple[str, List[float], int]:
+    """
+    Downloads, crops, stacks and subtitles a video before it is cut in to clips. With a range
+    of parts, the download is seeked in to and only their seconds are prepared.
+    The download and transcript of a previous run are reused if they survived.
+
+    Args:
+        parts (Tuple[int, int]): first part and the part after the last one to prepare, from 0.
+
+    Returns:
+        Tuple[str, List[float], int]: path to the prepared video, the seconds to cut it at
+        (see boundaries.plan_boundaries), and the number of parts of the whole video.
+    """
     # Download video from YouTube
-    video_path = download_youtube_video(url, TEMP_PATH)
+    video_path = journal.get_artifact(id, "video_path")
+    if video_path:
+        logger.info("Reusing the previous download...")
+    else:
+        video_path = download_youtube_video(url, work_path)
+        journal.record_source(id, "downloaded", video_path=video_path)
+
+    transcript_path = None
+    if captions:
+        # Fetch and process captions
+        logger.info(f"Fetching and processing captions!")
+        transcript_path = journal.get_artifact(id, "transcript_path")
+        if not transcript_path:
+            transcript_path = fetch_transcript(id, work_path)
+            journal.record_source(id, "transcript_ready", transcript_path=transcript_path)
+
+    # The whole video is planned, so its parts are the same whichever of them are prepared
+    boundaries = plan_boundaries(video_path, work_path, transcript_path)
+    n_parts = len(boundaries) + 1
+
+    section = None
+    if parts:
+        start, end, boundaries = get_part_section(
+            boundaries, get_video_duration(video_path), parts
+        )
+        section = (start, end)
+        if end <= start:
+            return video_path, [], n_parts
+
+    # The audio is normalized by the first render, with the cached loudness of the source
+    audio_filter = get_loudnorm_filter(video_path, f"youtube:{id}")
 
     if secondary_content:
         # Add secondary content and crop the video
-        video_path = add_secondary_content(video_path)
+        video_path = add_secondary_content(video_path, work_path, audio_filter, section)
     else:
         # Cropping is handled in the secondary content process for optimization purposes
         # so if there is no secondary content, the clip must be cropped seperatly
         logging.info("Cropping video...")
-        video_path = crop(video_path, os.path.join(TEMP_PATH, f"{id}_CROPPED.mp4"))
+        video_path = crop(
+            video_path,
+            os.path.join(work_path, f"{id}_CROPPED.mp4"),
+            audio_filter=audio_filter,
+            section=section,
+        )
+
+    # Check if transcript was found
+    if transcript_path:
+        # Add subtitles to the combined video, the section starts at 0
+        logging.info("Adding subtitles")
+        video_path = add_subtitles(
+            video_path,
+            os.path.join(work_path, "subtitled.mp4"),
+            transcript_path,
+            offset=section[0] if section else 0,
+        )
+
+    return video_path, boundaries, n_parts
+
+
+def stream_clips(
+    url: str,
+    file_name: str,
+    secondary_content: bool = True,
+    captions: bool = True,
+    limit: int | None = None,
+) -> Iterator[str]:
+    """
+    Same as make_clips, but the video is piped from yt-dlp straight in to a single FFmpeg
+    process that crops, stacks, subtitles and segments it. Each clip is yielded as soon as
+    its segment is finished, so downloading and encoding overlap. If the stream stops early
+    the source is journaled as partial, so a later run makes the rest from a normal download.
 
-    if captions:
-        # Fetch and process captions
-        logger.info(f"Fetching and processing captions!")
-        transcript_path = fetch_transcript(id)
-
-        # Check if transcript was found
-        if transcript_path:
-            # Add subtitles to the combined video
-            logging.info("Adding subtitles")
-            video_path = add_subtitles(
-                video_path, os.path.join(TEMP_PATH, "subtitled.mp4"), transcript_path
-            )
+    Secondary content is looped with -stream_loop instead of being extended beforehand,
+    as the duration of the video is not known until the download is done. For the same
+    reason the clips are planned differently from make_clips (see STREAM_LIMITATIONS).
 
-    # Create a folder to dump all the clips
-    CLIPS_PATH = os.path.join(TEMP_PATH, id)
+    Args:
+        url (str): URL of the YouTube video.
+        file_name (str): start of the filename joined with the ID and part number.
+        secondary_content (bool): if the video contains secondary content below the main video.
+        captions (bool): if the video contains captions.
+        limit (int): number of clips to render now, the rest are kept as recipes.
 
+    Yields:
+        str: file path to each clip. Nothing is yielded if the stream could not be read.
+    """
+    id = get_url_id(url)
+    journal = Journal(file_name)
+
+    if not stream_warned.is_set():
+        stream_warned.set()
+        logger.warning(f"Streamed clips are {', '.join(STREAM_LIMITATIONS)}")
+
+    # Create a folder to dump all the clips
+    work_path = os.path.join(TEMP_PATH, id)
+    CLIPS_PATH = os.path.join(work_path, "clips")
     create_directory(CLIPS_PATH)
     create_directory(OUTPUT_PATH)
 
-    # Divide the video in to segments
-    clips = clip(video_path, CLIPS_PATH, id)
+    # The transcript and the dimensions do not depend on the download, so they are fetched first
+    info = get_video_info(url, STREAM_FORMAT)
+    transcript_path = None
+    if captions:
+        logger.info(f"Fetching and processing captions!")
+        transcript_path = fetch_transcript(id, work_path)
 
-    # Process all clips
-    processed_clips = []
-    for i, clip_path in enumerate(clips):
-        logger.info(f"Adding text to clip {i+1}/{len(clips)}")
+    args = ["-i", "pipe:0"]
+    if secondary_content:
+        secondary_video = get_random_file(SECONDARY_CONTENT_PATH)
+        bottom_width, bottom_height = get_video_dimensions(secondary_video)
+        args += ["-stream_loop", "-1", "-i", secondary_video]
+
+        crop_width, crop_height = CLIP_RESOLUTION
+        video_filter = (
+            f"[0:v]scale={bottom_width}:{bottom_height}[scaled_top];"
+            f"[scaled_top][1:v]vstack=shortest=1,"
+            f"crop={crop_width}:{crop_height}:(iw-{crop_width})/2:0"
+        )
+    else:
+        video_filter = f"[0:v]{get_crop_filter(info['width'], info['height'])}"
+
+    if transcript_path:
+        video_filter += f",{get_subtitles_filter(transcript_path)}"
+
+    # Segments are listed in the csv once they are completely written
+    segment_list = os.path.join(CLIPS_PATH, "segments.csv")
+    args += [
+        "-filter_complex",
+        f"{video_filter}[v]",
+        "-map",
+        "[v]",
+        "-map",
+        "0:a?",
+        # The source can't be measured before it is downloaded
+        "-af",
+        get_stream_loudnorm_filter(f"youtube:{id}"),
+        "-reset_timestamps",
+        "1",
+        "-sc_threshold",
+        "0",
+        "-force_key_frames",
+        f"expr:gte(t, n_forced * {CLIP_DURATION})",
+        "-segment_time",
+        str(CLIP_DURATION),
+        "-segment_list",
+        segment_list,
+        "-segment_list_type",
+        "csv",
+        "-f",
+        "segment",
+        os.path.join(CLIPS_PATH, f"{id}_%03d.mp4"),
+    ]
 
-        # Add some text to specify which part the clip is
-        target_path = os.path.join(OUTPUT_PATH, f"{file_name},{i},{id}.mp4")
-        clip_path = add_text(clip_path, target_path, f"Part {i+1}")
+    logger.info("Streaming and rendering the video...")
+    download = open_video_stream(url, STREAM_FORMAT)
 
-        processed_clips.append(clip_path)
+    # The stream runs as long as the download, so it doesn't take a slot of the controller
+    cancel = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+    render = executor.submit(
+        run_ffmpeg, "stream", args, stdin=download.stdout, limited=False, cancel=cancel
+    )
+    executor.shutdown(wait=False)
 
-    # Remove all the temporary files
-    shutil.rmtree(TEMP_PATH)
+    inventory = Inventory()
+    settings = {"secondary_content": secondary_content, "subtitles": captions}
+    profile = None
+    i = 0
+    completed = False
+    try:
+        with trace("stream", id=id):
+            while True:
+                finished = render.done()
+
+                # Add the text to every segment that has been completed since the last check
+                segments = read_segment_list(segment_list)
+                for segment in segments[i:]:
+                    target_path = os.path.join(OUTPUT_PATH, f"{file_name},{i},{id}.mp4")
+                    segment_path = os.path.join(CLIPS_PATH, segment)
+
+                    # Past the render budget only the segment is kept
+                    if limit is not None and i >= limit:
+                        save_recipe(
+                            inventory, url, file_name, i, segment_path, target_path, settings
+                        )
+                        i += 1
+                        yield target_path
+                        continue
+
+                    # Only the first segment is known when the profile is chosen
+                    if profile is None:
+                        profile = get_output_profile([segment_path])
+
+                    logger.info(f"Adding text to clip {i+1}")
+                    clip_path = add_text(
+                        segment_path, target_path, f"Part {i+1}", profile=profile
+                    )
+
+                    inventory.add(file_name, id, i, clip_path, settings)
+                    journal.record_clip(clip_path, "rendered", id=id, part=i)
+
+                    # Counted before it is handed over, the consumer may stop at any clip
+                    i += 1
+                    yield clip_path
+
+                if finished:
+                    break
+                time.sleep(STREAM_POLL_INTERVAL)
+
+        try:
+            render.result()
+            completed = True
+        except FFmpegError as e:
+            # The segments listed were completely written, only the rest of the video is lost
+            logger.warning(f"Streaming stopped after {i} clips: {e}")
+    finally:
+        # Nothing keeps running if a clip failed or the clips stopped being consumed
+        cancel.set()
+
+        # Allow yt-dlp to receive a SIGPIPE if FFmpeg exited early
+        download.stdout.close()
+        if download.poll() is None:
+            download.terminate()
+        download.wait()
+        wait([render])
+
+        if i and completed:
+            journal.record_source(id, "rendered")
+        elif i:
+            # The parts that are left are made from a normal download by a later run
+            journal.record_source(id, "partial", next_part=i)
+            logger.info(f"The parts of {url} after part {i} are left for later")
+
+        # Remove the temporary files of the video
+        shutil.rmtree(work_path, ignore_errors=True)
+        evict_source_cache()
+
+
+def segment_variants(
+    video_path: str,
+    work_path: str,
+    id: str,
+    variants: List[dict],
+    transcript_path: str | None = None,
+) -> List[List[str]]:
+    """
+    Cuts a video in to the segments of several variants with a single FFmpeg process.
 
-    return processed_clips
+    The video is decoded once and split between the variants: the ones with the same
+    resolution and secondary content share a single crop or stack, which is split again
+    between the variants with and without subtitles. Each variant is encoded and segmented
+    by its own output.
+
+    Args:
+        video_path (str): path to the downloaded video.
+        work_path (str): temporary folder of the video.
+        id (str): ID of the video.
+        variants (List[dict]): see make_variant_clips.
+        transcript_path (str): subtitles of the variants with captions, None if there are none.
+
+    Returns:
+        List[List[str]]: paths to the segments of each variant, in order.
+    """
+    width, height = get_video_dimensions(video_path)
+    args = ["-i", video_path]
+
+    # The subject is found once, every crop follows it
+    saliency = get_saliency(read_proxy(video_path, work_path)) if SMART_CROP else None
+
+    # The variants with secondary content share the same random video
+    filler_path = None
+    if any(variant["secondary_content"] for variant in variants):
+        filler_path = get_random_file(SECONDARY_CONTENT_PATH)
+
+    # Variants that start from the same crop or stack (ex: with and without subtitles)
+    bases = {}
+    for i, variant in enumerate(variants):
+        filler = filler_path if variant["secondary_content"] else None
+        key = (tuple(variant.get("resolution", CLIP_RESOLUTION)), filler)
+        bases.setdefault(key, []).append(i)
+
+    # The secondary content is looped as long as the video lasts
+    filler_bases = [key for key in bases if key[1]]
+    graph = []
+    if filler_bases:
+        args += ["-stream_loop", "-1", "-i", filler_path]
+        fillers = "".join(f"[filler{b}]" for b in range(len(filler_bases)))
+        graph.append(f"[1:v]split={len(filler_bases)}{fillers}")
+        filler_width, filler_height = get_video_dimensions(filler_path)
+
+    sources = "".join(f"[source{b}]" for b in range(len(bases)))
+    graph.append(f"[0:v]split={len(bases)}{sources}")
+
+    outputs = []
+    for b, ((resolution, filler), indexes) in enumerate(bases.items()):
+        crop_width, crop_height = resolution
+        commands_path = os.path.join(work_path, f"crop{b}.cmd")
+        if filler:
+            f = filler_bases.index((resolution, filler))
+            window = crop_width / filler_width
+            crop_path = get_crop_path(saliency, window) if SMART_CROP else None
+            if crop_path is not None:
+                crop_filter = get_tracking_crop_filter(
+                    crop_path,
+                    commands_path,
+                    filler_width,
+                    crop_width,
+                    crop_height,
+                    name=f"smart{b}",
+                )
+            else:
+                crop_filter = f"crop={crop_width}:{crop_height}:(iw-{crop_width})/2:0"
+
+            base_filter = (
+                f"[source{b}]scale={filler_width}:{filler_height}[top{b}];"
+                f"[top{b}][filler{f}]vstack=shortest=1,{crop_filter}"
+            )
+        else:
+            window = get_crop_window(width, height, resolution)
+            crop_path = get_crop_path(saliency, window) if SMART_CROP else None
+            crop_filter = get_crop_filter(
+                width, height, resolution, crop_path, commands_path, f"smart{b}"
+            )
+            base_filter = f"[source{b}]{crop_filter}"
+
+        labels = "".join(f"[base{i}]" for i in indexes)
+        graph.append(f"{base_filter},split={len(indexes)}{labels}")
+
+        for i in indexes:
+            if variants[i]["captions"] and transcript_path:
+                graph.append(f"[base{i}]{get_subtitles_filter(transcript_path)}[v{i}]")
+            else:
+                graph.append(f"[base{i}]null[v{i}]")
+
+    args += ["-filter_complex", ";".join(graph)]
+
+    # Every variant is segmented by its own output, at the same boundaries and loudness
+    boundaries = plan_boundaries(video_path, work_path, transcript_path)
+    audio_filter = get_loudnorm_filter(video_path, f"youtube:{id}")
+    audio_args = ["-af", audio_filter] if audio_filter else []
+    segment_lists = []
+    output_indexes = []
+    for i, variant in enumerate(variants):
+        clips_path = os.path.join(work_path, "clips", str(i))
+        create_directory(clips_path)
+
+        segment_list = os.path.join(clips_path, "segments.csv")
+        segment_lists.append(segment_list)
+        outputs += [
+            "-map",
+            f"[v{i}]",
+            "-map",
+            "0:a?",
+            *audio_args,
+            "-reset_timestamps",
+            "1",
+            "-sc_threshold",
+            "0",
+            *get_segment_args(boundaries),
+            "-segment_list",
+            segment_list,
+            "-segment_list_type",
+            "csv",
+            "-f",
+            "segment",
+            os.path.join(clips_path, f"{id}_%03d.mp4"),
+        ]
+        output_indexes.append(len(args) + len(outputs) - 1)
+
+    run_ffmpeg("variants", args + outputs, outputs=output_indexes)
+
+    return [
+        [
+            os.path.join(os.path.dirname(segment_list), segment)
+            for segment in read_segment_list(segment_list)
+        ]
+        for segment_list in segment_lists
+    ]
 
 
-def add_secondary_content(video_path: str) -> str:
+def read_segment_list(segment_list: str) -> List[str]:
+    """
+    Returns:
+        List[str]: file names of the segments FFmpeg has finished writing, in order.
+    """
+    if not os.path.exists(segment_list):
+        return []
+
+    with open(segment_list, encoding="utf-8") as f:
+        # Each line looks like "abc_000.mp4,0.000000,60.000000"
+        return [line.split(",")[0] for line in f.read().splitlines() if line]
+
+
+def add_secondary_content(
+    video_path: str,
+    work_path: str = TEMP_PATH,
+    audio_filter: str | None = None,
+    section: Tuple[float, float] | None = None,
+) -> str:
     """
     Adds secondary content (ex: GTA Ramps, Minecraft Parkour, etc...) below the content.
+
+    Args:
+        audio_filter (str): filter applied to the audio of the content (ex: loudnorm).
+        section (Tuple[float, float]): start and end (in seconds) of the content to keep, all of it by default.
     """
     # Loop a random video from the secondary content library and cut it
     logging.info("Processing secondary content...")
     secondary_video = get_random_file(SECONDARY_CONTENT_PATH)
 
-    secondary_video = extend(
-        secondary_video,
-        os.path.join(TEMP_PATH, "content.mp4"),
-        get_video_duration(video_path),
-    )
+    duration = section[1] - section[0] if section else get_video_duration(video_path)
+    secondary_video = extend(secondary_video, os.path.join(work_path, "content.mp4"), duration)
 
     # Stack secondary content with primary video
     logging.info("Stacking secondary content...")
     video_path = stack(
-        os.path.join(TEMP_PATH, "stacked.mp4"), video_path, secondary_video
+        os.path.join(work_path, "stacked.mp4"),
+        video_path,
+        secondary_video,
+        audio_filter=audio_filter,
+        section=section,
     )
 
     return video_path
 
 
 def crop(
-    video_path: str, output_path: str, crop: Tuple[int, int] = CLIP_RESOLUTION
+    video_path: str,
+    output_path: str,
+    crop: Tuple[int, int] = CLIP_RESOLUTION,
+    audio_filter: str | None = None,
+    section: Tuple[float, float] | None = None,
 ) -> str:
     """
     Crop a video to a specific resolution.
@@ -133,6 +939,8 @@ def crop(
         video_path (str): Path to the video being cropped.
         output_path (str): Path to the output file
         crop (Tuple[int, int]): Target resolution
+        audio_filter (str): filter applied to the audio (ex: loudnorm).
+        section (Tuple[float, float]): start and end (in seconds) of the video to keep, all of it by default.
 
     Returns:
         str: Path to the cropped video
@@ -140,24 +948,65 @@ def crop(
     # Get input video resolution
     width, height = get_video_dimensions(video_path)
 
+    # Follow the subject instead of cropping the center
+    work_path = os.path.dirname(output_path)
+    window = get_crop_window(width, height, crop)
+    crop_path = plan_crop(video_path, window, work_path, section)
+    crop_filter = get_crop_filter(
+        width, height, crop, crop_path, os.path.join(work_path, "crop.cmd")
+    )
+
+    # Execute ffmpeg command
+    args = [*get_section_args(section), "-i", video_path, "-vf", crop_filter]
+    if audio_filter:
+        args += ["-af", audio_filter]
+    run_ffmpeg("crop", args + [output_path])
+
+    return output_path
+
+
+def get_crop_filter(
+    width: int,
+    height: int,
+    crop: Tuple[int, int] = CLIP_RESOLUTION,
+    crop_path=None,
+    commands_path: str | None = None,
+    name: str = "smart",
+) -> str:
+    """
+    Builds the filter that crops a video of a given resolution to the aspect ratio of crop.
+    The crop is centered, or follows crop_path horizontally if one is given (see cropper.plan_crop).
+
+    Args:
+        crop_path (np.ndarray): center of the crop over time, as a fraction of the width.
+        commands_path (str): file the positions of the crop are written to, required with crop_path.
+        name (str): name of the crop, unique within the filtergraph.
+
+    Returns:
+        str: FFmpeg filter (ex: "crop=405:720, scale=720:1280")
+    """
     # Calculate crop dimensions based on aspect ratio
     input_aspect_ratio = width / height
     target_aspect_ratio = crop[0] / crop[1]
     if input_aspect_ratio > target_aspect_ratio:
         new_width = int(height * target_aspect_ratio)
-        crop_filter = f"crop={new_width}:{height}, scale={crop[0]}:{crop[1]}"
+        if crop_path is not None:
+            tracking_crop = get_tracking_crop_filter(
+                crop_path, commands_path, width, new_width, height, name=name
+            )
+            return f"{tracking_crop}, scale={crop[0]}:{crop[1]}"
+        return f"crop={new_width}:{height}, scale={crop[0]}:{crop[1]}"
     else:
         new_height = int(width / target_aspect_ratio)
-        crop_filter = f"crop={width}:{new_height}, scale={crop[0]}:{crop[1]}"
+        return f"crop={width}:{new_height}, scale={crop[0]}:{crop[1]}"
 
-    # Execute ffmpeg command
-    cmd = (
-        f"ffmpeg -hide_banner -loglevel error -stats -i {video_path} "
-        f'-vf "{crop_filter}" {output_path}'
-    )
-    subprocess.run(cmd, shell=True)
 
-    return output_path
+def get_crop_window(width: int, height: int, crop: Tuple[int, int]) -> float:
+    """
+    Returns:
+        float: fraction of the width kept when cropping to the aspect ratio of crop.
+    """
+    return min(height * crop[0] / crop[1] / width, 1)
 
 
 def stack(
@@ -165,15 +1014,19 @@ def stack(
     top_path: str,
     bottom_path: str,
     crop: Tuple[int, int] = CLIP_RESOLUTION,
+    audio_filter: str | None = None,
+    section: Tuple[float, float] | None = None,
 ) -> str:
     """
-    Combine two videos vertically and save the result to a file.
+    Combine two videos vertically and save the result to a file, with the audio of the top one.
 
     Args:
         output_path (str): Path to save the combined video.
         top_path (str): Path to the top video.
         bottom_path (str): Path to the bottom video.
         crop (Tuple[int, int]): Cropping dimensions for the combined video.
+        audio_filter (str): filter applied to the audio (ex: loudnorm).
+        section (Tuple[float, float]): start and end (in seconds) of the top video to keep, all of it by default.
 
     Returns:
         str: Path of the combined video.
@@ -181,13 +1034,27 @@ def stack(
     # Get resolution to match it to the top one (gives error if not)
     bottom_width, bottom_height = get_video_dimensions(bottom_path)
 
+    # The top video is scaled to the width of the bottom one, the crop follows its subject
+    work_path = os.path.dirname(output_path)
+    crop_path = plan_crop(top_path, crop[0] / bottom_width, work_path, section)
+    if crop_path is not None:
+        crop_filter = get_tracking_crop_filter(
+            crop_path, os.path.join(work_path, "stack.cmd"), bottom_width, crop[0], crop[1]
+        )
+    else:
+        crop_filter = f"crop={crop[0]}:{crop[1]}:(iw-{crop[0]})/2:0"
+
     # Stack both videos and adjust resolution if needed
-    cmd = (
-        f"ffmpeg -hide_banner -loglevel error -stats -i {top_path} -i {bottom_path} -filter_complex "
-        f'"[0:v]scale={bottom_width}:{bottom_height}[scaled_top];[scaled_top][1:v]vstack,crop={crop[0]}:{crop[1]}:(iw-{crop[0]})/2:0" '
-        f"{output_path}"
+    video_filter = (
+        f"[0:v]scale={bottom_width}:{bottom_height}[scaled_top];"
+        f"[scaled_top][1:v]vstack,{crop_filter}[v]"
     )
-    subprocess.run(cmd, shell=True)
+    args = [*get_section_args(section), "-i", top_path, "-i", bottom_path]
+    args += ["-filter_complex", video_filter]
+    args += ["-map", "[v]", "-map", "0:a?"]
+    if audio_filter:
+        args += ["-af", audio_filter]
+    run_ffmpeg("stack", args + [output_path])
     return output_path
 
 
@@ -210,16 +1077,18 @@ def extend(video_path: str, output_path: str, duration: float) -> str:
     n_loops = math.ceil(duration / video_duration)
 
     # Construct ffmpeg command to loop the video and cut it to the exact duration
-    cmd = (
-        f"ffmpeg -hide_banner -loglevel error -stats -i {video_path} "
-        f"-vf loop={n_loops}:1 -ss 0 -to {duration} -c:a copy {output_path}"
-    )
-    subprocess.run(cmd)
+    args = ["-i", video_path, "-vf", f"loop={n_loops}:1", "-ss", "0", "-to", str(duration)]
+
+    # Only the audio of the source is kept when stacking (see stack)
+    args += ["-an"]
+    run_ffmpeg("extend", args + [output_path])
 
     return output_path
 
 
-def add_subtitles(video_path: str, output_path: str, transcript_path: str) -> str:
+def add_subtitles(
+    video_path: str, output_path: str, transcript_path: str, offset: float = 0
+) -> str:
     """
     Add subtitles to a video.
 
@@ -227,35 +1096,53 @@ def add_subtitles(video_path: str, output_path: str, transcript_path: str) -> st
         video_path (str): Path to the input video.
         output_path (str): Path to save the video with subtitles.
         transcript_path (str): Path to the transcript file.
+        offset (float): second of the transcript the video starts at (ex: a section of the source).
 
     Returns:
         str: Path of the video with added subtitles.
     """
-    cmd = (
-        f"ffmpeg -hide_banner -loglevel error -stats -i {video_path} "
-        f"-vf subtitles={transcript_path.replace('\\', '/')}:force_style="
+    subtitles_filter = get_subtitles_filter(transcript_path, offset)
+    run_ffmpeg("add_subtitles", ["-i", video_path, "-vf", subtitles_filter, output_path])
+
+    return output_path
+
+
+def get_subtitles_filter(transcript_path: str, offset: float = 0) -> str:
+    """
+    Args:
+        offset (float): second of the transcript the video starts at.
+
+    Returns:
+        str: FFmpeg filter that burns the transcript in to the video.
+    """
+    transcript_path = transcript_path.replace("\\", "/")
+    subtitles_filter = (
+        f"subtitles={transcript_path}:force_style="
         f"'Alignment=10,FontName={FONT_FILE},Fontsize=18,BackColour=H000000,"
         f"BorderStyle=4,Shadow=0'"
-        f" {output_path}"
     )
-    subprocess.run(cmd, shell=True)
+    if not offset:
+        return subtitles_filter
 
-    return output_path
+    # The frames are shifted to the time of the transcript while it is drawn
+    return f"setpts=PTS+{offset:.2f}/TB,{subtitles_filter},setpts=PTS-STARTPTS"
 
 
-def fetch_transcript(video_id: str) -> str | None:
+def fetch_transcript(video_id: str, output_path: str = TEMP_PATH) -> str | None:
     """
     Splits the YouTube transcript in to one word segments and removes overlaps.
 
     Args:
         video_id (str): ID of the YouTube video.
+        output_path (str): directory to save the transcript to.
 
     Returns:
         str: Path to the SRT transcript file.
     """
     try:
         # Fetches the transcript from YouTube
-        transcript = YouTubeTranscriptApi.get_transcript(video_id)
+        with trace("transcript", id=video_id):
+            transcript = YouTubeTranscriptApi.get_transcript(video_id)
 
         # When there are two or more people talking FFmpeg stacks the words
         # This looks very weird, so these overlaps shall be fixed
@@ -268,7 +1155,7 @@ def fetch_transcript(video_id: str) -> str | None:
         formatter = SRTFormatter()
         srt = formatter.format_transcript(transcript)
 
-        filepath = os.path.join(TEMP_PATH, "transcript.srt")
+        filepath = os.path.join(output_path, "transcript.srt")
         with open(filepath, "w", encoding="utf-8") as f:
             f.write(srt)
         return filepath
@@ -344,16 +1231,24 @@ def fix_overlaps(transcript: List[dict]) -> List[dict]:
 
 
 def clip(
-    video_path: str, output_path: str, file_name: str, duration: int = CLIP_DURATION
+    video_path: str,
+    output_path: str,
+    file_name: str,
+    duration: int = CLIP_DURATION,
+    transcript_path: str | None = None,
+    boundaries: List[float] | None = None,
 ) -> List[str]:
     """
-    Split a video into clips of equal duration.
+    Split a video into clips of about the same duration, cut in silences between words
+    (see boundaries.plan_boundaries).
 
     Args:
         video_path (str): Path to the input video.
         output_path (str): Directory to save the generated clips.
         file_name (str): Base name for the generated clips. A number will be added to the end of each file (ex: filename_2.mp4)
-        duration (int): Duration of each clip (in seconds).
+        duration (int): Target duration of each clip (in seconds).
+        transcript_path (str): SRT transcript, to avoid cutting words.
+        boundaries (List[float]): seconds to cut at if they were already planned.
 
     Returns:
         List[str]: List of paths to the generated clips.
@@ -370,20 +1265,35 @@ def clip(
         output_file_name = extension
 
     output_template = os.path.join(output_path, output_file_name)
+    segment_list = os.path.join(output_path, "segments.csv")
+
+    # Keyframes are forced at the boundaries, so the segments are cut exactly there
+    if boundaries is None:
+        boundaries = plan_boundaries(video_path, output_path, transcript_path, duration)
+    args = [
+        "-i",
+        video_path,
+        "-reset_timestamps",
+        "1",
+        "-sc_threshold",
+        "0",
+        "-g",
+        str(duration),
+        *get_segment_args(boundaries, duration),
+        "-segment_list",
+        segment_list,
+        "-segment_list_type",
+        "csv",
+        "-f",
+        "segment",
+        output_template,
+    ]
+    run_ffmpeg("clip", args)
 
-    # There are faster ways of divding videos in to segments of specified duration
-    # but they for some reason aren't exact, and vary up to 4 seconds from the set length
-    cmd = (
-        f"ffmpeg.exe -hide_banner -loglevel error -stats -i {video_path} "
-        f"-reset_timestamps 1 -sc_threshold 0 -g {duration} "
-        f'-force_key_frames "expr:gte(t, n_forced * {duration})" '
-        f"-segment_time {duration} -f segment {output_template}"
-    )
-    subprocess.run(cmd)
-
-    # Get paths of the generated clips
+    # Get paths of the generated clips from the segment list, in order
     clip_paths = [
-        os.path.join(output_path, filename) for filename in os.listdir(output_path)
+        os.path.join(output_path, filename)
+        for filename in read_segment_list(segment_list)
     ]
     return clip_paths
 
@@ -397,9 +1307,11 @@ def add_text(
     fontsize=50,
     padding=20,
     radius=10,
+    profile: dict | None = None,
 ):
     """
-    Add text overlay to a video with rounded corners.
+    Add text overlay to a video with rounded corners. This is the final encode, so it uses
+    the upload profile (see profiles.get_output_profile).
 
     Parameters:
         video_path (str): Path to the input video file.
@@ -410,8 +1322,11 @@ def add_text(
         fontsize (int): size of the font.
         padding (int): space between the content and the border.
         radius (int): Radius of the rounded corners.
+        profile (dict): quality and bitrate ceiling of the source, the defaults if None.
     """
-    text_image_path = os.path.join(TEMP_PATH, "text.png")
+    # Named after the clip, as clips can be rendered while others are being materialized
+    create_directory(TEMP_PATH)
+    text_image_path = os.path.join(TEMP_PATH, f"{os.path.basename(output_path)}.png")
 
     # Create picture with dynamic text
     text_filter = (
@@ -420,11 +1335,8 @@ def add_text(
         f"fontsize={fontsize}:fontcolor={fontcolor}:x=(w-text_w)/2:y=(h-text_h)/2:"
         f"fontfile='{FONT_FILE}'"
     )
-    cmd = (
-        f'ffmpeg -hide_banner -loglevel error -stats -lavfi "{text_filter}" '
-        f'-frames 1 -f image2 -c:v png -pix_fmt rgb24 "{text_image_path}"'
-    )
-    subprocess.run(cmd, shell=True)
+    args = ["-lavfi", text_filter, "-frames", "1", "-f", "image2", "-c:v", "png"]
+    run_ffmpeg("text_image", args + ["-pix_fmt", "rgb24", text_image_path])
 
     # Trim the transparent outer parts of the text image
     img = Image.open(text_image_path)
@@ -438,11 +1350,10 @@ def add_text(
         f"if(lte(hypot({radius}-(W/2-abs(W/2-X)),{radius}-(H/2-abs(H/2-Y))),{radius}),255,0),255)'[t];"
         "[0][t]overlay=(W-w)/2:(H-h)*2/3"
     )
-    cmd = (
-        f"ffmpeg -hide_banner -loglevel error -stats -i {video_path} -i {text_image_path} "
-        f"-lavfi {rounded_corners_filtergraph} -c:v h264_nvenc -cq 20 -c:a copy {output_path} -y"
-    )
-    subprocess.run(cmd)
+    args = ["-i", video_path, "-i", text_image_path, "-lavfi", rounded_corners_filtergraph]
+    args += get_output_args(profile)
+    run_ffmpeg("add_text", args + ["-c:a", "copy", output_path])
+    record_upload_size(profile, output_path)
 
     # Clean up temporary files
     os.remove(text_image_path)
@@ -0,0 +1,226 @@
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+import threading
+import logging
+import time
+import os
+
+from constants import *
+
+logger = logging.getLogger(__name__)
+
+
+def read_pressure(resource: str) -> float | None:
+    """
+    Reads the pressure stall information of the kernel (Linux 4.20+).
+
+    Args:
+        resource (str): "cpu", "io" or "memory".
+
+    Returns:
+        float | None: microseconds some task has been stalled on the resource since boot,
+        None if PSI is not available.
+    """
+    try:
+        with open(f"/proc/pressure/{resource}", "r") as file:
+            # ex: "some avg10=1.49 avg60=2.72 avg300=2.03 total=38851019"
+            fields = file.readline().split()
+    except OSError:
+        return None
+
+    for field in fields:
+        if field.startswith("total="):
+            return float(field.removeprefix("total="))
+    return None
+
+
+def read_cpu_times() -> dict | None:
+    """
+    Returns:
+        dict | None: ticks the CPUs spent busy, idle and waiting for the disk since boot,
+        None outside Linux.
+    """
+    try:
+        with open("/proc/stat", "r") as file:
+            # ex: "cpu  11283 0 1471 117417 207 0 3 1202 0 0"
+            values = [int(value) for value in file.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+
+    idle, iowait = values[3], values[4]
+    return {"busy": sum(values) - idle - iowait, "idle": idle, "iowait": iowait}
+
+
+class ConcurrencyController:
+    """
+    Decides how many FFmpeg processes run at the same time, and how many threads each uses.
+
+    Every FFMPEG_CONTROL_INTERVAL seconds the CPU and I/O pressure since the last check is read
+    from /proc/pressure (PSI), or estimated from the load average and the disk wait of
+    /proc/stat on kernels without it. Jobs are added one at a time while there is headroom and
+    work is waiting, and halved when the box is thrashing. If adding a job made the total
+    frames per second drop, the job count is capped there until the pressure changes.
+    Threads are split evenly between the jobs, so N processes never oversubscribe the CPUs.
+    """
+
+    def __init__(
+        self,
+        min_jobs: int = 1,
+        max_jobs: int | None = FFMPEG_MAX_JOBS,
+        interval: float = FFMPEG_CONTROL_INTERVAL,
+    ) -> None:
+        """
+        Args:
+            min_jobs (int): fewest FFmpeg processes allowed at the same time.
+            max_jobs (int): most FFmpeg processes allowed at the same time, one per CPU by default.
+            interval (float): seconds between adjustments.
+        """
+        self.cpus = os.cpu_count() or 1
+        self.min_jobs = min_jobs
+        self.max_jobs = max_jobs or self.cpus
+        self.interval = interval
+
+        self.jobs = max(min(self.cpus // 2, self.max_jobs), min_jobs)
+        self.ceiling = self.max_jobs
+
+        # Jobs running and jobs waiting for a slot
+        self.running = 0
+        self.waiting = 0
+        self.condition = threading.Condition()
+
+        # Frames rendered since the last adjustment, and the throughput of the last one
+        self.frames = 0
+        self.last_fps = None
+        self.last_change = 0
+
+        self.last_check = time.monotonic()
+        self.last_readings = self.read_counters()
+
+    @property
+    def threads(self) -> int:
+        """
+        Threads each FFmpeg process may use.
+        """
+        return max(self.cpus // self.jobs, 1)
+
+    @contextmanager
+    def slot(self) -> Iterator[int]:
+        """
+        Waits until another FFmpeg process can run (ex: with controller.slot() as threads: ...).
+
+        Yields:
+            int: threads the process may use (-threads).
+        """
+        with self.condition:
+            self.waiting += 1
+            while self.running >= self.jobs:
+                self.condition.wait(self.interval)
+                self.adjust()
+            self.waiting -= 1
+            self.running += 1
+            threads = self.threads
+
+        try:
+            yield threads
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.adjust()
+                self.condition.notify_all()
+
+    def add_frames(self, frames: int):
+        """
+        Counts the frames a finished FFmpeg process rendered, to measure the throughput.
+        """
+        with self.condition:
+            self.frames += frames
+
+    def adjust(self):
+        """
+        Changes the number of jobs according to the pressure since the last adjustment.
+        Must be called with the condition held.
+        """
+        now = time.monotonic()
+        elapsed = now - self.last_check
+        if elapsed < self.interval:
+            return
+
+        readings = self.read_counters()
+        cpu, io = self.get_pressure(self.last_readings, readings, elapsed)
+        fps = self.frames / elapsed
+
+        previous = self.jobs
+        reason = None
+        if cpu is None:
+            # Nothing to measure (ex: Windows), keep the initial number of jobs
+            pass
+        elif cpu > FFMPEG_CPU_PRESSURE_HIGH or io > FFMPEG_IO_PRESSURE_HIGH:
+            self.jobs = max(self.jobs // 2, self.min_jobs)
+            self.ceiling = self.max_jobs
+            reason = "the box is thrashing"
+        elif (
+            self.last_change > 0
+            and self.last_fps
+            and fps < self.last_fps * FFMPEG_FPS_TOLERANCE
+        ):
+            # The last job added made everything slower
+            self.jobs = max(self.jobs - 1, self.min_jobs)
+            self.ceiling = self.jobs
+            reason = f"throughput dropped from {self.last_fps:.0f} to {fps:.0f} fps"
+        elif (
+            cpu < FFMPEG_CPU_PRESSURE_LOW
+            and io < FFMPEG_IO_PRESSURE_LOW
+            and self.waiting
+            and self.jobs < self.ceiling
+        ):
+            self.jobs += 1
+            reason = "there is headroom and work waiting"
+
+        if self.jobs != previous:
+            logger.info(
+                f"FFmpeg jobs {previous} -> {self.jobs} ({self.threads} threads each): {reason} "
+                f"(cpu pressure {cpu:.0f}%, io pressure {io:.0f}%, {fps:.0f} fps)"
+            )
+            self.condition.notify_all()
+
+        self.last_change = self.jobs - previous
+        self.last_fps = fps if self.frames else self.last_fps
+        self.frames = 0
+        self.last_check = now
+        self.last_readings = readings
+
+    def read_counters(self) -> dict:
+        return {
+            "cpu": read_pressure("cpu"),
+            "io": read_pressure("io"),
+            "times": read_cpu_times(),
+        }
+
+    def get_pressure(
+        self, before: dict, after: dict, elapsed: float
+    ) -> Tuple[float | None, float | None]:
+        """
+        Returns:
+            Tuple[float | None, float | None]: percentage of the time tasks were stalled on the
+            CPU and on I/O between two readings, None if it can't be measured.
+        """
+        if before["cpu"] is not None and after["cpu"] is not None:
+            cpu = (after["cpu"] - before["cpu"]) / (elapsed * 1e6) * 100
+            io = (after["io"] - before["io"]) / (elapsed * 1e6) * 100
+            return cpu, io
+
+        if before["times"] is None or after["times"] is None:
+            return None, None
+
+        # Without PSI, runnable tasks beyond the CPUs and the share of disk wait are used instead
+        load = os.getloadavg()[0] if hasattr(os, "getloadavg") else 0
+        cpu = max(load / self.cpus - 1, 0) * 100
+
+        deltas = {key: after["times"][key] - before["times"][key] for key in after["times"]}
+        total = sum(deltas.values()) or 1
+        io = deltas["iowait"] / total * 100
+        return cpu, io
+
+
+# Shared by every render of the process
+controller = ConcurrencyController()
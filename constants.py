@@ -3,14 +3,144 @@ ACCOUNTS_PATH = "accounts"
 # TikTok only allows to schedule videos 10 days in advance
 MAX_DAYS = 10
 
+# Seconds a scraped channel is reused for
+CHANNEL_CACHE_TTL = 3600
+
+# Source selection: cost of each slot a video leaves empty, relative to each slot of extra
+# clips it renders, and cost of a year old video (see Account.score_video)
+SELECTION_SHORTFALL_WEIGHT = 0.3
+SELECTION_AGE_WEIGHT = 0.2
+
+# DAEMON VARS
+# Minutes before a schedule slot opens up that its clip starts rendering
+RENDER_LOOKAHEAD = 60
+# Accounts processed at the same time
+DAEMON_WORKERS = 2
+# Maximum seconds to sleep between checks of the schedules
+DAEMON_MAX_SLEEP = 600
+# Seconds before an account that failed is tried again
+DAEMON_RETRY_DELAY = 900
+# Local port of the status endpoint
+DAEMON_STATUS_PORT = 8765
+# Seconds of activity used to compute how busy each stage is
+DAEMON_UTILIZATION_WINDOW = 3600
+
 # CLIPPER VARS
 CLIP_DURATION = 60
 CLIP_RESOLUTION = (720, 1280)
 FONT_FILE = "assets/tiktoksans.ttf"
+# Encoder of the final clips (ex: "libx264" on machines without an NVIDIA GPU)
+VIDEO_ENCODER = "h264_nvenc"
 
 SECONDARY_CONTENT_PATH = "assets/content"
 TEMP_PATH = "temp"
 OUTPUT_PATH = "output"
+# Manifest of the clips in the output folder
+INVENTORY_PATH = "output/inventory.json"
+# Progress of each account's videos, to resume interrupted runs
+JOURNAL_PATH = "journal"
+# Per-stage timings of each run
+TRACES_PATH = "traces"
+# Synthetic fixtures and reports of the benchmarks
+BENCHMARK_PATH = "benchmark"
+# Maximum seconds to import main.py, administrative commands are run hundreds of times
+IMPORT_TIME_BUDGET = 0.1
+
+# Render budget: clips past these limits are kept as recipes and rendered right before uploading
+# Rendered clips waiting to be posted per account
+MAX_PENDING_CLIPS = 10
+# Bytes of rendered clips waiting per account, and in total
+MAX_PENDING_BYTES = 2 * 1024**3
+MAX_TOTAL_PENDING_BYTES = 20 * 1024**3
+# Size assumed for a clip until some have been rendered
+CLIP_SIZE_ESTIMATE = 30 * 1024**2
+# Segments the recipes are rendered from, the oldest sources are evicted past the limit
+SOURCE_CACHE_PATH = "cache/sources"
+MAX_SOURCE_CACHE_BYTES = 20 * 1024**3
+# FFmpeg concurrency: most processes at the same time (one per CPU if None), and seconds between adjustments
+FFMPEG_MAX_JOBS = None
+FFMPEG_CONTROL_INTERVAL = 5
+# Percentage of the time tasks are stalled on the CPU or I/O (PSI) above which jobs are halved,
+# and below which a job is added
+FFMPEG_CPU_PRESSURE_HIGH = 60
+FFMPEG_CPU_PRESSURE_LOW = 20
+FFMPEG_IO_PRESSURE_HIGH = 40
+FFMPEG_IO_PRESSURE_LOW = 10
+# Share of the previous frames per second under which an added job is taken back
+FFMPEG_FPS_TOLERANCE = 0.9
+# Seconds before an FFmpeg or ffprobe process is stopped
+FFMPEG_TIMEOUT = 2 * 3600
+FFPROBE_TIMEOUT = 30
+# Lines of FFmpeg errors kept to explain failures
+FFMPEG_ERROR_LINES = 20
+# Seconds between checks for timeouts and cancellations, and to wait for FFmpeg to exit when stopped
+FFMPEG_WATCH_INTERVAL = 0.2
+FFMPEG_KILL_TIMEOUT = 5
+# Render farm: shared directory with the job queue and the rendered clips
+FARM_PATH = "farm"
+# Seconds a worker keeps a job without renewing it, and attempts before giving up on a job
+RENDER_LEASE = 120
+RENDER_MAX_ATTEMPTS = 3
+# Seconds between checks of the queue, and to wait for the database lock
+RENDER_POLL_INTERVAL = 2
+RENDER_DB_TIMEOUT = 30
+# Smart crop: follow the subject instead of center cropping, analysed on a tiny proxy of the video
+SMART_CROP = True
+CROP_PROXY_WIDTH = 160
+CROP_PROXY_FPS = 2
+# Weight of the motion against the edges when looking for the subject
+CROP_MOTION_WEIGHT = 2.0
+# Seconds the crop position is averaged over, so it pans instead of jumping
+CROP_SMOOTHING = 3.0
+# Crop positions sent to FFmpeg per second, interpolated between the proxy frames
+CROP_COMMAND_RATE = 10
+# Clip boundaries: cut in silences and between words, up to BOUNDARY_TOLERANCE seconds from CLIP_DURATION
+SMART_BOUNDARIES = True
+BOUNDARY_TOLERANCE = 5
+# Sample rate the audio is analysed at, and seconds of each loudness measurement
+BOUNDARY_SAMPLE_RATE = 8000
+BOUNDARY_FRAME = 0.02
+# Seconds of quiet looked for around a cut
+BOUNDARY_GAP = 0.3
+# Loudness normalization: target integrated loudness (LUFS), true peak (dBTP) and loudness range (LU)
+LOUDNESS_TARGET = -14
+LOUDNESS_TRUE_PEAK = -1.5
+LOUDNESS_RANGE = 11
+# Measurements of the sources and the secondary content, so each file is analysed once
+LOUDNESS_CACHE_PATH = "cache/loudness.json"
+# Upload profile: bitrate (kbit/s) the quality of each source is chosen for, and the most a clip may use
+UPLOAD_TARGET_BITRATE = 3500
+UPLOAD_MAX_BITRATE = 6000
+# Largest clip, the bitrate ceiling is lowered so the longest clip fits
+UPLOAD_MAX_CLIP_BYTES = 40 * 1024**2
+# Quality (CRF or CQ) the clips were encoded with before, and the range a source may get
+# (never better than before, so no clip gets bigger)
+UPLOAD_REFERENCE_QUALITY = 20
+UPLOAD_QUALITY_RANGE = (20, 28)
+# Segments sampled, and seconds encoded from each, to measure how hard a source is to compress
+PROFILE_PROBE_SAMPLES = 3
+PROFILE_PROBE_SECONDS = 2
+# Work planner: clips made for an account before the accounts due sooner get their turn,
+# and the seconds estimated to make and schedule a clip, used to predict missed slots
+PLANNER_MAX_CLIPS = 3
+PLANNER_CLIP_SECONDS = 120
+# Days of posting history kept in each account file, older posts are moved to HISTORY_ARCHIVE_PATH
+HISTORY_RETENTION_DAYS = 180
+HISTORY_ARCHIVE_PATH = "history"
+# Dry runs (--plan): days of traces the throughput of each stage is measured from
+PLAN_HISTORY_DAYS = 14
+# What is assumed for the stages that were never traced: seconds of video encoded per second,
+# bytes per second of source video, bytes downloaded per second, seconds of the final encode
+# of a clip and seconds to schedule a clip
+PLAN_DEFAULT_SPEED = 2.0
+PLAN_DEFAULT_SOURCE_BYTES = 250_000
+PLAN_DEFAULT_DOWNLOAD_RATE = 5 * 1024**2
+PLAN_DEFAULT_CLIP_SECONDS = 30
+PLAN_DEFAULT_UPLOAD_SECONDS = 60
+# Streaming ingest: formats that can be read from a pipe (fragmented/progressive with moov first)
+STREAM_FORMAT = "best[protocol^=m3u8]/best[ext=mp4]/best"
+# Seconds between checks for newly finished segments while streaming
+STREAM_POLL_INTERVAL = 1
 
 # SCHEDULER VARS
 # PATHS
@@ -18,8 +148,29 @@ COOKIES_PATH = "cookies"
 
 # URLs
 TIKTOK_URL = "https://www.tiktok.com"
-TIKTOK_UPLOAD_URL = TIKTOK_URL + "/creator#/upload?scene=creator_center&lang=en"
-TIKTOK_LOGIN_URL = TIKTOK_URL + "/login/phone-or-email/email/?lang=en"
+TIKTOK_UPLOAD_PATH = "/creator#/upload?scene=creator_center&lang=en"
+TIKTOK_LOGIN_PATH = "/login/phone-or-email/email/?lang=en"
+TIKTOK_UPLOAD_URL = TIKTOK_URL + TIKTOK_UPLOAD_PATH
+TIKTOK_LOGIN_URL = TIKTOK_URL + TIKTOK_LOGIN_PATH
+
+# Sessions
+# Lightweight authenticated endpoint used to check if the cookies still work
+SESSION_CHECK_URL = TIKTOK_URL + "/passport/web/account/info/"
+SESSION_CHECK_TIMEOUT = 10
+SESSION_CHECK_WORKERS = 8
+# Cookies that keep the account logged in
+SESSION_COOKIES = ["sessionid", "sessionid_ss", "sid_tt"]
+# Days before expiring that a session is considered about to run out
+SESSION_EXPIRY_MARGIN = 2
+
+# Seconds to keep looking for an element before failing, and between each attempt
+LOCATOR_TIMEOUT = 10
+LOCATOR_POLL_INTERVAL = 0.1
+# TikTok only allows scheduling at minutes multiple of this
+SCHEDULE_MINUTE_STEP = 5
+
+# Static pages that mimic the TikTok login and upload pages (see mock_tiktok.py)
+MOCK_TIKTOK_PATH = "assets/mock_tiktok"
 
 LANGUAGES = [
     "af",
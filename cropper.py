@@ -0,0 +1,183 @@
+from typing import List, Tuple
+import logging
+import os
+
+import numpy as np
+
+from constants import *
+from runner import run_ffmpeg
+from tracer import trace
+from util import create_directory, get_section_args, get_video_dimensions
+
+logger = logging.getLogger(__name__)
+
+
+def read_proxy(
+    video_path: str,
+    work_path: str = TEMP_PATH,
+    section: Tuple[float, float] | None = None,
+) -> np.ndarray:
+    """
+    Decodes a tiny, low frame rate, grayscale copy of a video (CROP_PROXY_WIDTH wide at
+    CROP_PROXY_FPS), which costs a small fraction of rendering it.
+
+    Args:
+        section (Tuple[float, float]): start and end (in seconds) of the part to decode, all of it by default.
+
+    Returns:
+        np.ndarray: frames of the proxy, of shape (frames, height, width).
+    """
+    width, height = get_video_dimensions(video_path)
+    proxy_width = CROP_PROXY_WIDTH
+    proxy_height = max(round(proxy_width * height / width), 1)
+
+    create_directory(work_path)
+    proxy_path = os.path.join(work_path, "proxy.gray")
+    video_filter = f"fps={CROP_PROXY_FPS},scale={proxy_width}:{proxy_height},format=gray"
+    args = [*get_section_args(section), "-i", video_path, "-an", "-vf", video_filter]
+    run_ffmpeg("crop_proxy", args + ["-f", "rawvideo", proxy_path])
+
+    frames = np.fromfile(proxy_path, dtype=np.uint8)
+    os.remove(proxy_path)
+    return frames.reshape(-1, proxy_height, proxy_width)
+
+
+def get_saliency(frames: np.ndarray) -> np.ndarray:
+    """
+    Estimates where the subject is in each frame of a proxy, from what moves and the edges.
+
+    Returns:
+        np.ndarray: how interesting each column of each frame is, of shape (frames, width),
+        every frame sums to 1.
+    """
+    frames = frames.astype(np.float32)
+
+    # Horizontal and vertical edges, summed over each column
+    edges = np.zeros(frames.shape, dtype=np.float32)
+    edges[:, :, 1:] += np.abs(np.diff(frames, axis=2))
+    edges[:, 1:, :] += np.abs(np.diff(frames, axis=1))
+    edges = edges.sum(axis=1)
+
+    # Difference with the previous frame, the first one has nothing to compare to
+    motion = np.zeros(edges.shape, dtype=np.float32)
+    if len(frames) > 1:
+        motion[1:] = np.abs(np.diff(frames, axis=0)).sum(axis=1)
+        motion[0] = motion[1]
+
+    def normalize(energy: np.ndarray) -> np.ndarray:
+        totals = energy.sum(axis=1, keepdims=True)
+        return np.divide(energy, totals, out=np.zeros_like(energy), where=totals > 0)
+
+    saliency = normalize(edges) + CROP_MOTION_WEIGHT * normalize(motion)
+
+    # Frames without anything to follow (ex: a black screen) stay centered
+    flat = saliency.sum(axis=1) == 0
+    saliency[flat] = 1
+    return normalize(saliency)
+
+
+def get_crop_path(saliency: np.ndarray, window: float) -> np.ndarray | None:
+    """
+    Finds the horizontal position of the crop in each frame of the proxy that keeps the most
+    of the subject, smoothed over CROP_SMOOTHING seconds so the crop pans instead of jumping.
+
+    Args:
+        saliency (np.ndarray): see get_saliency.
+        window (float): fraction of the width kept by the crop (ex: 0.32 for 16:9 to 9:16).
+
+    Returns:
+        np.ndarray | None: center of the crop in each frame, as a fraction of the width.
+        None if the crop keeps the whole width.
+    """
+    n_frames, width = saliency.shape
+    crop_width = round(window * width)
+    if n_frames == 0 or crop_width >= width:
+        return None
+
+    # Saliency inside the crop for every position, with a cumulative sum over the columns
+    cumulative = np.zeros((n_frames, width + 1), dtype=np.float32)
+    cumulative[:, 1:] = np.cumsum(saliency, axis=1)
+    inside = cumulative[:, crop_width:] - cumulative[:, :-crop_width]
+
+    # Ties (ex: flat frames) are broken in favor of the center
+    positions = np.arange(inside.shape[1])
+    center_bias = -np.abs(positions - (width - crop_width) / 2) * 1e-6
+    centers = (np.argmax(inside + center_bias, axis=1) + crop_width / 2) / width
+
+    # Moving average, padded with the first and last positions
+    radius = int(CROP_SMOOTHING * CROP_PROXY_FPS / 2)
+    if radius:
+        padded = np.pad(centers, radius, mode="edge")
+        kernel = np.ones(2 * radius + 1) / (2 * radius + 1)
+        centers = np.convolve(padded, kernel, mode="valid")
+
+    return np.clip(centers, window / 2, 1 - window / 2)
+
+
+def plan_crop(
+    video_path: str,
+    window: float,
+    work_path: str = TEMP_PATH,
+    section: Tuple[float, float] | None = None,
+) -> np.ndarray | None:
+    """
+    Analyses a video, or a section of it (see read_proxy), and returns the path its crop
+    should follow (see get_crop_path).
+    """
+    if not SMART_CROP or window >= 1:
+        return None
+
+    with trace("crop_plan", path=video_path):
+        saliency = get_saliency(read_proxy(video_path, work_path, section))
+        return get_crop_path(saliency, window)
+
+
+def get_tracking_crop_filter(
+    crop_path: np.ndarray,
+    commands_path: str,
+    input_width: int,
+    crop_width: int,
+    crop_height: int,
+    y: str = "0",
+    name: str = "smart",
+) -> str:
+    """
+    Builds a crop filter whose horizontal offset follows a crop path. The offsets are written
+    to a file read by sendcmd, interpolated CROP_COMMAND_RATE times per second.
+
+    Args:
+        crop_path (np.ndarray): see get_crop_path.
+        commands_path (str): file to write the sendcmd commands to.
+        input_width (int): width of the video entering the crop.
+        crop_width (int): width of the crop.
+        crop_height (int): height of the crop.
+        y (str): vertical offset of the crop (ex: "(ih-720)/2").
+        name (str): name of the crop, unique within the filtergraph.
+
+    Returns:
+        str: FFmpeg filters (ex: "sendcmd=f=temp/abc/crop.cmd,crop@smart=405:720:120:0")
+    """
+    # Proxy frames are CROP_PROXY_FPS apart, starting at 0
+    frame_times = np.arange(len(crop_path)) / CROP_PROXY_FPS
+    times = np.arange(0, frame_times[-1] + 1 / CROP_COMMAND_RATE, 1 / CROP_COMMAND_RATE)
+    centers = np.interp(times, frame_times, crop_path)
+
+    max_x = input_width - crop_width
+    offsets = np.clip(np.round(centers * input_width - crop_width / 2), 0, max_x).astype(int)
+
+    # Only the changes are sent
+    lines: List[str] = []
+    previous = None
+    for time, x in zip(times, offsets):
+        if x != previous:
+            lines.append(f"{time:.2f} crop@{name} x {x};")
+            previous = x
+
+    with open(commands_path, "w", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+
+    commands_path = commands_path.replace("\\", "/")
+    return (
+        f"sendcmd=f={commands_path},"
+        f"crop@{name}={crop_width}:{crop_height}:{offsets[0]}:{y}"
+    )
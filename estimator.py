@@ -0,0 +1,168 @@
+from datetime import datetime, timedelta
+from typing import List
+import logging
+import json
+import os
+
+from constants import *
+
+logger = logging.getLogger(__name__)
+
+# FFmpeg stages that read the whole source, and the ones that only read the parts being made
+SOURCE_STAGES = ["ffmpeg.loudness", "ffmpeg.boundary_audio"]
+SECTION_STAGES = ["ffmpeg.crop_proxy", "ffmpeg.clip"]
+# Final encode of each clip
+CLIP_STAGES = ["ffmpeg.text_image", "ffmpeg.add_text"]
+
+
+def load_spans(days: int = PLAN_HISTORY_DAYS) -> List[dict]:
+    """
+    Reads the spans of the runs (and daemon days) traced in the last days.
+
+    Returns:
+        List[dict]: the spans, see tracer.trace.
+    """
+    if not os.path.exists(TRACES_PATH):
+        return []
+
+    oldest = (datetime.now() - timedelta(days=days)).timestamp()
+    spans = []
+    for name in os.listdir(TRACES_PATH):
+        path = os.path.join(TRACES_PATH, name)
+        if not name.endswith(".jsonl") or os.path.getmtime(path) < oldest:
+            continue
+
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                # The last line may be incomplete if the process was killed while writing it
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return spans
+
+
+def get_throughput(spans: List[dict]) -> dict:
+    """
+    Adds up the spans of each stage that succeeded.
+
+    Returns:
+        dict: totals of each stage (ex: {"ffmpeg.crop": {"count": 3, "wall_time": 41.2,
+        "media_seconds": 540.0, "bytes": 0, "seconds": 0}, ...}), the media seconds are the
+        seconds of video FFmpeg went through and the bytes and seconds those of the downloads.
+    """
+    stages = {}
+    for span in spans:
+        if span.get("error"):
+            continue
+
+        stage = stages.setdefault(
+            span["name"],
+            {"count": 0, "wall_time": 0.0, "media_seconds": 0.0, "bytes": 0, "seconds": 0.0},
+        )
+        stage["count"] += 1
+        stage["wall_time"] += span["wall_time"]
+
+        # FFmpeg reports the speed as seconds of video per second
+        stage["media_seconds"] += span.get("speed", 0) * span["wall_time"]
+        stage["bytes"] += span.get("bytes", 0)
+        stage["seconds"] += span.get("seconds", 0)
+
+    return stages
+
+
+def get_encode_rate(throughput: dict, name: str) -> float:
+    """
+    Returns:
+        float: seconds a stage takes per second of video, PLAN_DEFAULT_SPEED if it never ran.
+    """
+    stage = throughput.get(name)
+    if not stage or not stage["media_seconds"]:
+        return 1 / PLAN_DEFAULT_SPEED
+    return stage["wall_time"] / stage["media_seconds"]
+
+
+def get_mean_time(throughput: dict, name: str, default: float) -> float:
+    """
+    Returns:
+        float: average seconds a stage takes, default if it never ran.
+    """
+    stage = throughput.get(name)
+    if not stage or not stage["count"]:
+        return default
+    return stage["wall_time"] / stage["count"]
+
+
+def estimate_source(
+    throughput: dict,
+    duration: float,
+    seconds: float,
+    downloaded: bool = False,
+    secondary_content: bool = True,
+    subtitles: bool = True,
+) -> dict:
+    """
+    Estimates the cost of preparing some seconds of a source (see clipper.prepare_video).
+
+    Args:
+        throughput (dict): see get_throughput.
+        duration (float): length of the whole source (in seconds).
+        seconds (float): seconds of the source that are prepared.
+        downloaded (bool): if the source was kept by a previous run.
+
+    Returns:
+        dict: bytes to download, and seconds spent downloading and encoding
+        (ex: {"download_bytes": 31457280, "download_seconds": 6.2, "encode_seconds": 95.0}).
+    """
+    download = throughput.get("download", {})
+    source_rate = (
+        download["bytes"] / download["seconds"]
+        if download.get("seconds")
+        else PLAN_DEFAULT_SOURCE_BYTES
+    )
+    download_rate = (
+        download["bytes"] / download["wall_time"]
+        if download.get("bytes") and download["wall_time"]
+        else PLAN_DEFAULT_DOWNLOAD_RATE
+    )
+
+    download_bytes = 0 if downloaded else duration * source_rate
+
+    section_stages = list(SECTION_STAGES)
+    if secondary_content:
+        section_stages += ["ffmpeg.extend", "ffmpeg.stack"]
+    else:
+        section_stages.append("ffmpeg.crop")
+    if subtitles:
+        section_stages.append("ffmpeg.add_subtitles")
+
+    # The loudness is measured once per source
+    source_stages = SOURCE_STAGES if not downloaded else ["ffmpeg.boundary_audio"]
+    encode_seconds = duration * sum(get_encode_rate(throughput, name) for name in source_stages)
+    encode_seconds += seconds * sum(get_encode_rate(throughput, name) for name in section_stages)
+
+    return {
+        "download_bytes": int(download_bytes),
+        "download_seconds": download_bytes / download_rate,
+        "encode_seconds": encode_seconds,
+    }
+
+
+def estimate_clips(throughput: dict, n_clips: int) -> float:
+    """
+    Returns:
+        float: seconds spent on the final encode of some clips.
+    """
+    clip_seconds = sum(
+        get_mean_time(throughput, name, PLAN_DEFAULT_CLIP_SECONDS / len(CLIP_STAGES))
+        for name in CLIP_STAGES
+    )
+    return n_clips * clip_seconds
+
+
+def estimate_uploads(throughput: dict, n_uploads: int) -> float:
+    """
+    Returns:
+        float: seconds spent scheduling some clips in the browser.
+    """
+    return n_uploads * get_mean_time(throughput, "scheduler.post", PLAN_DEFAULT_UPLOAD_SECONDS)
@@ -0,0 +1,241 @@
+from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.remote.webelement import WebElement
+from typing import Dict, List
+import time
+
+from constants import *
+
+# Ordered fallback CSS selectors of each element of the TikTok pages.
+# The first ones are the most specific, the last ones survive most redesigns.
+LOCATORS: Dict[str, List[str]] = {
+    # Upload page
+    "file_input": ['input[type="file"]'],
+    "caption": ['div[spellcheck="false"]', 'div[contenteditable="true"]'],
+    "schedule_switch": ["#tux-3", 'input[role="switch"]', '[role="switch"]'],
+    "allow_button": [
+        "body > div:nth-child(9) > div > div > div.tiktok-modal__modal-footer.is-horizontal > div.tiktok-modal__modal-button.is-highlight",
+        "div.tiktok-modal__modal-footer div.tiktok-modal__modal-button.is-highlight",
+    ],
+    "post_button": [
+        "#root > div > div > div > div.jsx-475921512.container-v2.form-panel > div.jsx-475921512.contents-v2.reverse > div.jsx-3457533826.form-v2.reverse > div.jsx-3457533826.button-row > div.jsx-3457533826.btn-post > button",
+        "div.btn-post > button",
+        'button[data-e2e="post_video_button"]',
+    ],
+    # Date picker
+    "date_picker": [
+        "#root > div > div > div > div.jsx-475921512.container-v2.form-panel > div.jsx-475921512.contents-v2.reverse > div.jsx-3457533826.form-v2.reverse > div.jsx-3471246984 > div > div.jsx-3471246984.scheduled-picker > div.jsx-3471246984.date-picker-input.picker-input",
+        "div.scheduled-picker > div.date-picker-input",
+        "div.date-picker-input",
+    ],
+    "next_month": [
+        "#root > div > div > div > div.jsx-475921512.container-v2.form-panel > div.jsx-475921512.contents-v2.reverse > div.jsx-3457533826.form-v2.reverse > div.jsx-3471246984 > div > div.jsx-3471246984.scheduled-picker > div.jsx-3471246984.date-picker-input.picker-input > div > div.jsx-4172176419.month-header-wrapper > span:nth-child(3)",
+        "div.date-picker-input div.month-header-wrapper > span:nth-child(3)",
+    ],
+    "valid_days": ["span.jsx-4172176419.day.valid", "span.day.valid"],
+    # Time picker
+    "time_picker": [
+        "#root > div > div > div > div.jsx-475921512.container-v2.form-panel > div.jsx-475921512.contents-v2.reverse > div.jsx-3457533826.form-v2.reverse > div.jsx-3471246984 > div > div.jsx-3471246984.scheduled-picker > div.jsx-3471246984.time-picker-input.picker-input",
+        "div.scheduled-picker > div.time-picker-input",
+        "div.time-picker-input",
+    ],
+    "hours": [
+        ".tiktok-timepicker-option-text.tiktok-timepicker-left",
+        ".tiktok-timepicker-left",
+    ],
+    "minutes": [
+        ".tiktok-timepicker-option-text.tiktok-timepicker-right",
+        ".tiktok-timepicker-right",
+    ],
+    # Login page
+    "login_email": [
+        "#loginContainer > div.tiktok-aa97el-DivLoginContainer.exd0a430 > form > div.tiktok-q83gm2-DivInputContainer.etcs7ny0 > input",
+        '#loginContainer form input[name="username"]',
+        '#loginContainer form input[type="text"]',
+    ],
+    "login_password": [
+        "#loginContainer > div.tiktok-aa97el-DivLoginContainer.exd0a430 > form > div.tiktok-15iauzg-DivContainer.e1bi0g3c0 > div > input",
+        '#loginContainer form input[type="password"]',
+    ],
+    "login_submit": [
+        "#loginContainer > div.tiktok-aa97el-DivLoginContainer.exd0a430 > form > button",
+        '#loginContainer form button[type="submit"]',
+        "#loginContainer form button",
+    ],
+}
+
+# Tries the selectors in order in a single round trip.
+# Returns [index of the selector that matched, element(s)] or null.
+FIND_SCRIPT = """
+const [selectors, all, clickable] = arguments;
+const usable = (element) => !clickable || (!element.disabled && element.offsetParent !== null);
+for (let i = 0; i < selectors.length; i++) {
+    if (all) {
+        const elements = [...document.querySelectorAll(selectors[i])];
+        if (elements.length) return [i, elements];
+    } else {
+        const element = document.querySelector(selectors[i]);
+        if (element && usable(element)) return [i, element];
+    }
+}
+return null;
+"""
+
+# Finds the day cell of the calendar with the given text in a single round trip.
+# Returns [index of the selector that matched, cell or null if the day is not in the month] or null.
+FIND_DAY_SCRIPT = """
+const [selectors, day] = arguments;
+for (let i = 0; i < selectors.length; i++) {
+    const cells = document.querySelectorAll(selectors[i]);
+    if (!cells.length) continue;
+    for (const cell of cells) {
+        if (cell.textContent.trim() === day) return [i, cell];
+    }
+    return [i, null];
+}
+return null;
+"""
+
+
+# Sets the value of the input inside each element the way a user would, so frameworks
+# such as React update their state, then reads back what the page shows after it re-renders.
+# Returns the value each input shows (null if the input wasn't found).
+SET_VALUES_SCRIPT = """
+const [targets, done] = arguments;
+const setter = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, "value").set;
+const inputs = targets.map(([selectors, value]) => {
+    for (const selector of selectors) {
+        const input = document.querySelector(`${selector} input`);
+        if (!input) continue;
+        setter.call(input, value);
+        input.dispatchEvent(new Event("input", { bubbles: true }));
+        input.dispatchEvent(new Event("change", { bubbles: true }));
+        return input;
+    }
+    return null;
+});
+requestAnimationFrame(() => setTimeout(() => done(inputs.map((input) => input && input.value)), 0));
+"""
+
+
+class LocatorError(Exception):
+    """
+    Raised when none of the selectors of an element match, with what was tried.
+    """
+
+
+class Locators:
+    """
+    Finds the elements of the TikTok pages by their logical name (see LOCATORS).
+
+    Every lookup is a single execute_script call that tries all the fallback selectors,
+    and the selector that worked is tried first for the rest of the session.
+    Lookups poll for a short time instead of stacking implicit waits, and fail with a
+    diagnosis of the page and the selectors that were tried.
+    """
+
+    def __init__(
+        self,
+        driver: WebDriver,
+        locators: Dict[str, List[str]] = LOCATORS,
+        timeout: float = LOCATOR_TIMEOUT,
+    ) -> None:
+        self.driver = driver
+        self.locators = locators
+        self.timeout = timeout
+
+        # Selector that worked last for each element
+        self.cache: Dict[str, str] = {}
+
+    def find(
+        self, name: str, timeout: float | None = None, clickable: bool = False
+    ) -> WebElement:
+        """
+        Args:
+            name (str): logical name of the element (ex: "post_button").
+            timeout (float): seconds to keep polling, LOCATOR_TIMEOUT by default.
+            clickable (bool): wait until the element is enabled and visible.
+
+        Returns:
+            WebElement: the first element matched by the selectors.
+        """
+        return self.poll(name, FIND_SCRIPT, [False, clickable], timeout)
+
+    def find_all(self, name: str, timeout: float | None = None) -> List[WebElement]:
+        """
+        Returns:
+            List[WebElement]: all the elements matched by the first selector that matches any.
+        """
+        return self.poll(name, FIND_SCRIPT, [True, False], timeout)
+
+    def find_day(self, day: int, timeout: float | None = None) -> WebElement | None:
+        """
+        Finds the valid day cell of the open calendar.
+
+        Returns:
+            WebElement | None: the cell, None if the day is not in the month being shown.
+        """
+        return self.poll("valid_days", FIND_DAY_SCRIPT, [str(day)], timeout)
+
+    def set_values(self, values: Dict[str, str]) -> Dict[str, str | None]:
+        """
+        Sets the inputs inside some elements in a single round trip.
+
+        Args:
+            values (Dict[str, str]): value for each element (ex: {"time_picker": "16:30"})
+
+        Returns:
+            Dict[str, str | None]: value each input shows after the page re-rendered, None if it wasn't found.
+        """
+        names = list(values)
+        targets = [[self.get_selectors(name), values[name]] for name in names]
+        displayed = self.driver.execute_async_script(SET_VALUES_SCRIPT, targets)
+        return dict(zip(names, displayed))
+
+    def poll(self, name: str, script: str, args: list, timeout: float | None):
+        """
+        Runs a lookup script with the selectors of an element until it matches or times out.
+        """
+        if timeout is None:
+            timeout = self.timeout
+
+        selectors = self.get_selectors(name)
+        deadline = time.monotonic() + timeout
+        while True:
+            result = self.driver.execute_script(script, selectors, *args)
+            if result:
+                index, found = result
+                self.cache[name] = selectors[index]
+                return found
+
+            if time.monotonic() >= deadline:
+                raise LocatorError(self.diagnose(name, selectors, timeout))
+            time.sleep(LOCATOR_POLL_INTERVAL)
+
+    def get_selectors(self, name: str) -> List[str]:
+        """
+        Returns:
+            List[str]: the selectors of an element, the one that worked last goes first.
+        """
+        selectors = list(self.locators[name])
+        cached = self.cache.get(name)
+        if cached:
+            selectors.remove(cached)
+            selectors.insert(0, cached)
+        return selectors
+
+    def diagnose(self, name: str, selectors: List[str], timeout: float) -> str:
+        """
+        Returns:
+            str: description of the failed lookup and the page it happened on.
+        """
+        counts = self.driver.execute_script(
+            "return arguments[0].map((s) => document.querySelectorAll(s).length);",
+            selectors,
+        )
+        tried = "\n".join(
+            f"  {count} matches: {selector}" for selector, count in zip(selectors, counts)
+        )
+        return (
+            f"Could not find '{name}' after {timeout}s on {self.driver.current_url} "
+            f"({self.driver.title!r}). The page may have changed, selectors tried:\n{tried}"
+        )
@@ -0,0 +1,154 @@
+from typing import List
+import threading
+import logging
+import json
+import os
+
+from constants import *
+from runner import FFmpegError, run_ffmpeg
+from util import create_directory
+
+logger = logging.getLogger(__name__)
+
+# Serializes the changes of the cache between threads (ex: variants rendered in parallel)
+lock = threading.Lock()
+
+
+def get_loudnorm_filter(path: str, key: str | None = None) -> str | None:
+    """
+    Builds the filter that normalizes the audio of a file to LOUDNESS_TARGET in a single,
+    linear pass, from measurements taken once and cached (see measure_loudness).
+
+    Args:
+        path (str): path to the audio or video file.
+        key (str): name the measurements are cached under (ex: the ID of a source, whose
+            file is downloaded again), the path, size and date of the file by default.
+
+    Returns:
+        str | None: FFmpeg audio filter, None if the file has no audio or is silent.
+    """
+    measurements = get_measurements(path, key)
+    if not measurements or measurements["input_i"] in ("-inf", "inf"):
+        return None
+
+    return get_linear_filter(measurements)
+
+
+def get_stream_loudnorm_filter(key: str) -> str:
+    """
+    Builds the filter that normalizes audio which can't be measured beforehand (ex: a video
+    still downloading): from the cached measurements if a previous run measured the file,
+    with the dynamic mode of loudnorm otherwise, which follows the loudness as it goes.
+
+    Args:
+        key (str): name the measurements are cached under (see get_loudnorm_filter).
+
+    Returns:
+        str: FFmpeg audio filter.
+    """
+    measurements = load_cache().get(key)
+    if measurements and measurements["input_i"] not in ("-inf", "inf"):
+        return get_linear_filter(measurements)
+
+    # loudnorm outputs 192 kHz
+    return (
+        f"loudnorm=I={LOUDNESS_TARGET}:TP={LOUDNESS_TRUE_PEAK}:LRA={LOUDNESS_RANGE}"
+        ",aresample=48000"
+    )
+
+
+def get_linear_filter(measurements: dict) -> str:
+    """
+    Returns:
+        str: loudnorm filter that applies a single gain computed from the measurements.
+    """
+    return (
+        f"loudnorm=I={LOUDNESS_TARGET}:TP={LOUDNESS_TRUE_PEAK}:LRA={LOUDNESS_RANGE}"
+        f":measured_I={measurements['input_i']}"
+        f":measured_TP={measurements['input_tp']}"
+        f":measured_LRA={measurements['input_lra']}"
+        f":measured_thresh={measurements['input_thresh']}"
+        f":offset={measurements['target_offset']}"
+        # loudnorm outputs 192 kHz
+        ":linear=true,aresample=48000"
+    )
+
+
+def get_measurements(path: str, key: str | None = None) -> dict | None:
+    """
+    Returns:
+        dict | None: cached loudness of a file, measured the first time (see measure_loudness).
+    """
+    if key is None:
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+    cache = load_cache()
+    if key in cache:
+        return cache[key]
+
+    measurements = measure_loudness(path)
+
+    # Files without audio are cached too, so they aren't measured again
+    with lock:
+        cache = load_cache()
+        cache[key] = measurements
+        save_cache(cache)
+
+    return measurements
+
+
+def measure_loudness(path: str) -> dict | None:
+    """
+    Measures the integrated loudness, true peak and loudness range of the audio of a file
+    with the first pass of loudnorm.
+
+    Returns:
+        dict | None: measurements (ex: {"input_i": "-23.54", "input_tp": "-7.20", "input_lra": "5.10",
+        "input_thresh": "-33.80", "target_offset": "0.32"}), None if the file has no audio.
+    """
+    log: List[str] = []
+    audio_filter = (
+        f"loudnorm=I={LOUDNESS_TARGET}:TP={LOUDNESS_TRUE_PEAK}:LRA={LOUDNESS_RANGE}"
+        ":print_format=json"
+    )
+    try:
+        run_ffmpeg("loudness", ["-i", path, "-vn", "-af", audio_filter, "-f", "null", "-"], log=log)
+    except FFmpegError as e:
+        # ex: secondary content without sound
+        if "does not contain any stream" not in e.stderr:
+            logger.warning(f"Could not measure the loudness of {path}: {e}")
+        return None
+
+    # The measurements are the last JSON object logged
+    output = "".join(log)
+    start = output.rfind("{")
+    end = output.rfind("}")
+    if start == -1 or end < start:
+        return None
+
+    measurements = json.loads(output[start : end + 1])
+    return {
+        name: measurements[name]
+        for name in ("input_i", "input_tp", "input_lra", "input_thresh", "target_offset")
+    }
+
+
+def load_cache() -> dict:
+    if not os.path.exists(LOUDNESS_CACHE_PATH):
+        return {}
+
+    with open(LOUDNESS_CACHE_PATH, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_cache(cache: dict):
+    """
+    Writes the cache atomically, so an interrupted run never leaves it half written.
+    """
+    create_directory(os.path.dirname(LOUDNESS_CACHE_PATH) or ".")
+
+    temp_path = LOUDNESS_CACHE_PATH + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(cache, file, indent=2)
+    os.replace(temp_path, LOUDNESS_CACHE_PATH)
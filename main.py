@@ -1,14 +1,23 @@
-from typing import List
-from bs4 import BeautifulSoup
+from typing import Callable, List
 from collections import defaultdict
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+import subprocess
+import threading
 import argparse
 import logging
+import math
+import sys
 import os
-import requests
 
+# Only light modules are imported here, so administrative commands start fast.
+# Selenium, the clipper (PIL, transcripts), bs4 and requests are imported by the
+# functions that need them.
 from Account import Account
-from Scheduler import Scheduler
-from clipper import make_clips
+from Inventory import Inventory
+from Journal import Journal
+from tracer import trace
+import tracer
 from constants import *
 from util import create_directory, download_youtube_video
 
@@ -18,6 +27,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Clips rendered during the run, and the seconds of those that weren't scheduled right away
+encodes = {"clips": 0, "posted": 0, "wasted_seconds": 0.0}
+encodes_lock = threading.Lock()
+
 
 def main():
     # Parse command line arguments
@@ -51,6 +64,63 @@ def main():
         type=str,
         help="URLs to secondary content on YouTube (ex: GTA Ramps, Minecraft Parkour, etc...)",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Start rendering while the YouTube video is still downloading (the clips are center cropped and cut at fixed lengths).",
+    )
+    parser.add_argument(
+        "--no_login",
+        action="store_true",
+        help="Never ask for passwords, accounts whose session expired are skipped (ex: for cron).",
+    )
+    parser.add_argument(
+        "--trace_chrome",
+        nargs="?",
+        const=os.path.join(TRACES_PATH, "trace.json"),
+        type=str,
+        help="Also export the timings of the run as a Chrome trace-event file.",
+    )
+    parser.add_argument(
+        "--farm",
+        nargs="?",
+        const=0,
+        type=int,
+        help="Publish the renders to the farm queue instead of rendering here, optionally starting this many local workers.",
+    )
+    parser.add_argument(
+        "--farm_worker",
+        action="store_true",
+        help="Render the jobs of the farm queue until interrupted.",
+    )
+    parser.add_argument(
+        "--farm_path",
+        type=str,
+        default=FARM_PATH,
+        help=f"Directory shared with the farm workers (default: {FARM_PATH}).",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and fill the schedules as they open up, instead of running once.",
+    )
+    parser.add_argument(
+        "--lookahead",
+        type=int,
+        default=RENDER_LOOKAHEAD,
+        help=f"Minutes before a schedule slot opens up that the daemon renders its clip (default: {RENDER_LOOKAHEAD}).",
+    )
+    parser.add_argument(
+        "--status_port",
+        type=int,
+        default=DAEMON_STATUS_PORT,
+        help=f"Local port where the daemon serves its status (default: {DAEMON_STATUS_PORT}).",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Only estimate what the run would download, encode and upload, without doing it.",
+    )
 
     args = parser.parse_args()
     if args.create_account:
@@ -65,14 +135,344 @@ def main():
             logger.info(f"Saving {url}...")
             save_secondary_content(url)
 
+    elif args.farm_worker:
+        from RenderQueue import RenderQueue
+        from RenderWorker import RenderWorker
+
+        RenderWorker(RenderQueue(args.farm_path)).run()
+
+    elif args.daemon:
+        from Daemon import Daemon
+
+        # New accounts are picked up while running if no emails are given
+        daemon = Daemon(
+            emails=args.emails or None,
+            get_emails=get_all_emails,
+            process_account=process_account_videos,
+            stream=args.stream,
+            lookahead=timedelta(minutes=args.lookahead),
+            status_port=args.status_port,
+        )
+        daemon.run()
+
     else:
         if args.all_accounts:
             emails = get_all_emails()
         else:
             emails = args.emails
 
-        for email in emails:
-            process_account_videos(email)
+        if args.plan:
+            plan_run(emails)
+        elif args.farm is None:
+            process_accounts(emails, args.stream, args.no_login, args.trace_chrome)
+        else:
+            process_accounts_on_farm(
+                emails, args.farm, args.farm_path, args.no_login, args.trace_chrome
+            )
+
+
+def process_accounts(
+    emails: List[str],
+    stream: bool = False,
+    no_login: bool = False,
+    trace_chrome: str | None = None,
+    farm=None,
+):
+    """
+    Makes and schedules videos for several accounts.
+
+    Args:
+        emails (List[str]): emails of existing accounts.
+        stream (bool): render new clips while their source is still downloading.
+        no_login (bool): skip the accounts that need to log in instead of asking for their password.
+        trace_chrome (str): path to also export the timings of the run as a Chrome trace-event file.
+        farm (RenderQueue): queue to publish the renders to, they are rendered here by default.
+    """
+    from planner import log_misses, plan_accounts
+    from SessionManager import SessionManager
+
+    # Check the sessions in the background while the first accounts are processed
+    sessions = SessionManager(emails)
+
+    # Browsers of the accounts that have several turns
+    schedulers = {}
+    try:
+        # Accounts about to use the same video render it together
+        if not farm:
+            render_shared_sources(emails)
+
+        # The accounts whose schedule runs dry first are served first, a few clips at a time
+        plan = plan_accounts(emails)
+        log_misses(plan)
+        n_turns = defaultdict(int)
+        for turn in plan["turns"]:
+            n_turns[turn["email"]] += 1
+
+        relogin_emails = []
+        for turn in plan["turns"]:
+            email = turn["email"]
+            if email in relogin_emails:
+                continue
+
+            # Accounts that must log in again are left for the end, so they don't block the rest
+            if sessions.needs_login(email):
+                logger.info(f"The session of {email} expired, it will be logged in at the end")
+                relogin_emails.append(email)
+                continue
+            sessions.save_renewed_cookies(email)
+
+            if n_turns[email] > 1 and email not in schedulers:
+                from Scheduler import Scheduler
+
+                schedulers[email] = Scheduler(Account(email))
+
+            with trace("account", email=email):
+                process_account_videos(
+                    email,
+                    stream,
+                    scheduler=schedulers.get(email),
+                    farm=farm,
+                    max_clips=turn["clips"],
+                )
+
+        if relogin_emails and no_login:
+            logger.warning(f"Skipped accounts that need to log in: {relogin_emails}")
+        else:
+            for email in relogin_emails:
+                with trace("account", email=email):
+                    process_account_videos(email, stream, login=True, farm=farm)
+    finally:
+        sessions.shutdown()
+        for scheduler in schedulers.values():
+            try:
+                scheduler.quit()
+            except Exception:
+                pass
+
+        # Report how much the upload profile saved, if anything was rendered
+        from profiles import get_savings_report
+
+        report = get_savings_report()
+        if report:
+            logger.info(report)
+
+        report = get_waste_report()
+        if report:
+            logger.info(report)
+
+        # Save where the time of the run went, even if it failed
+        run_name = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        tracer.export(os.path.join(TRACES_PATH, f"{run_name}.jsonl"), trace_chrome)
+
+
+def plan_run(emails: List[str]):
+    """
+    Prints what a run would download, encode and upload for each account, estimated from the
+    throughput of each stage in the recent traces, without doing any of it.
+    """
+    from estimator import get_throughput, load_spans
+    from planner import log_misses, plan_accounts
+
+    throughput = get_throughput(load_spans())
+
+    totals = defaultdict(float)
+    for email in emails:
+        estimate = estimate_account(Account(email), throughput)
+        print_estimate(email, estimate)
+        for key, value in estimate.items():
+            if isinstance(value, (int, float)):
+                totals[key] += value
+    print_estimate("Total", totals)
+
+    # Slots that would be missed at the estimated pace
+    if totals["new_clips"]:
+        clip_seconds = (totals["download_seconds"] + totals["encode_seconds"]) / totals["new_clips"]
+        clip_seconds += totals["upload_seconds"] / totals["uploads"]
+        log_misses(plan_accounts(emails, clip_seconds=clip_seconds))
+
+
+def estimate_account(account: Account, throughput: dict) -> dict:
+    """
+    Goes through the same choices as calculate_clips_data: the dates, the clips waiting in the
+    output folder that fill them, the unfinished videos and the new videos that make the rest.
+
+    Args:
+        throughput (dict): see estimator.get_throughput.
+
+    Returns:
+        dict: the choices and their cost (ex: {"dates": 12, "reused": 3, "new_clips": 9,
+        "unfilled": 0, "sources": ["dQw4w9WgXcQ"], "download_bytes": 31457280,
+        "download_seconds": 6.2, "encode_seconds": 812.0, "uploads": 12, "upload_seconds": 720.0}).
+    """
+    from estimator import estimate_clips, estimate_source, estimate_uploads
+
+    valid_dates = account.get_valid_dates()
+    unused_clips = account.get_processed_videos()
+    reused = min(len(unused_clips), len(valid_dates))
+
+    # Clips kept as recipes are rendered right before uploading
+    waiting = Inventory().get_account_clips(account.email)[:reused]
+    n_recipes = sum(1 for clip in waiting if clip.get("recipe"))
+
+    estimate = {
+        "dates": len(valid_dates),
+        "reused": reused,
+        "new_clips": 0,
+        "unfilled": len(valid_dates) - reused,
+        "sources": [],
+        "download_bytes": 0,
+        "download_seconds": 0.0,
+        "encode_seconds": estimate_clips(throughput, n_recipes),
+        "uploads": 0,
+        "upload_seconds": 0.0,
+    }
+
+    def add_source(id: str, duration: float, n_parts: int, downloaded: bool):
+        n_clips = min(n_parts, estimate["unfilled"])
+        cost = estimate_source(
+            throughput,
+            duration,
+            min(n_clips * account.clip_length, duration),
+            downloaded,
+            account.secondary_content,
+            account.subtitles,
+        )
+        estimate["sources"].append(id)
+        estimate["new_clips"] += n_clips
+        estimate["unfilled"] -= n_clips
+        estimate["download_bytes"] += cost["download_bytes"]
+        estimate["download_seconds"] += cost["download_seconds"]
+        estimate["encode_seconds"] += cost["encode_seconds"] + estimate_clips(throughput, n_clips)
+
+    # Videos a previous run did not finish are resumed from their next part
+    journal = Journal(account.email)
+    for id in journal.get_unfinished_sources():
+        if not estimate["unfilled"]:
+            break
+
+        source = journal.get_source(id)
+        n_parts = source.get("n_parts", max(account.video_length // account.clip_length, 1))
+        n_left = n_parts - source.get("next_part", 0)
+        downloaded = journal.get_artifact(id, "video_path") is not None
+        add_source(id, n_parts * account.clip_length, n_left, downloaded)
+
+    # New videos, chosen as the run would (see Account.get_videos)
+    while estimate["unfilled"]:
+        n_chosen = len(estimate["sources"])
+        candidates = [
+            candidate
+            for candidate in account.get_candidates(n_chosen + 1, n_slots=estimate["unfilled"])
+            if candidate["id"] not in estimate["sources"]
+        ]
+        if not candidates:
+            break
+
+        candidate = candidates[0]
+        n_parts = max(round(candidate["duration"] / account.clip_length), 1)
+        add_source(candidate["id"], candidate["duration"], n_parts, False)
+
+    # Every clip that fills a date is uploaded
+    estimate["uploads"] = estimate["reused"] + estimate["new_clips"]
+    estimate["upload_seconds"] = estimate_uploads(throughput, estimate["uploads"])
+    return estimate
+
+
+def print_estimate(name: str, estimate: dict):
+    """
+    Prints the estimate of an account, or the totals of the run (see estimate_account).
+    """
+    megabytes = estimate["download_bytes"] / 1024**2
+    print(
+        f"\n{name}: {estimate['dates']:.0f} dates, {estimate['reused']:.0f} clips reused, "
+        f"{estimate['new_clips']:.0f} new clips, {estimate['unfilled']:.0f} left unfilled"
+    )
+    print(f"  download {megabytes:>9.1f} MB {estimate['download_seconds']:>9.0f}s")
+    print(f"  encode   {estimate['encode_seconds']:>22.0f}s")
+    print(f"  upload   {estimate['uploads']:>6.0f} clips {estimate['upload_seconds']:>12.0f}s")
+
+
+def render_shared_sources(emails: List[str]):
+    """
+    Renders the videos that several accounts would use next in a single pass, so each video
+    is downloaded and decoded once for all of their styles (see clipper.make_variant_clips).
+    The clips are then picked up as unused clips when each account is processed.
+    """
+    # Group the accounts that need new clips by the video they would use next
+    sources = defaultdict(list)
+    for email in emails:
+        account = Account(email)
+        n_slots = len(account.get_valid_dates()) - len(account.get_processed_videos())
+        if n_slots <= 0:
+            continue
+
+        # Interrupted videos are resumed by their account
+        if Journal(email).get_unfinished_sources():
+            continue
+
+        videos = account.get_videos(1, n_slots=n_slots)
+        if videos:
+            sources[videos[0]].append(account)
+
+    shared = {id: accounts for id, accounts in sources.items() if len(accounts) > 1}
+    if not shared:
+        return
+
+    from clipper import make_variant_clips
+
+    inventory = Inventory()
+    for id, accounts in shared.items():
+        url = f"https://www.youtube.com/watch?v={id}"
+        variants = []
+        for account in accounts:
+            Journal(account.email).record_source(id, "discovered")
+            variants.append(
+                {
+                    "file_name": account.email,
+                    "secondary_content": account.secondary_content,
+                    "captions": account.subtitles,
+                    "limit": inventory.get_render_budget(account.email),
+                }
+            )
+
+        logger.info(f"Creating clips from {url} for {len(accounts)} accounts...")
+        try:
+            with trace("shared_source", id=id, accounts=len(accounts)):
+                make_variant_clips(url, variants)
+        except Exception:
+            # The video is still discovered, so each account renders it on its own instead
+            logger.exception(f"Failed to render {url} for several accounts")
+
+
+def process_accounts_on_farm(
+    emails: List[str],
+    local_workers: int,
+    farm_path: str = FARM_PATH,
+    no_login: bool = False,
+    trace_chrome: str | None = None,
+):
+    """
+    Same as process_accounts, but the clips are rendered by the farm workers.
+
+    Args:
+        local_workers (int): worker processes to start on this host, others can join from other hosts.
+        farm_path (str): directory shared with the workers.
+    """
+    from RenderQueue import RenderQueue
+
+    farm = RenderQueue(farm_path)
+    workers = [
+        subprocess.Popen(
+            [sys.executable, __file__, "--farm_worker", "--farm_path", farm_path]
+        )
+        for _ in range(local_workers)
+    ]
+    try:
+        process_accounts(emails, no_login=no_login, trace_chrome=trace_chrome, farm=farm)
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+        farm.close()
 
 
 def save_secondary_content(url: str):
@@ -214,18 +614,41 @@ def get_yes_no_input(message: str) -> bool:
     return response.lower() == "y"
 
 
-def process_account_videos(email: str):
+def process_account_videos(
+    email: str,
+    stream: bool = False,
+    login: bool = False,
+    scheduler=None,
+    lookahead: timedelta = timedelta(0),
+    render_lock=None,
+    farm=None,
+    max_clips: int | None = None,
+    get_scheduler: Callable | None = None,
+):
     """
     The main function that handles, making and scheduling videos for an account.
 
     Args:
         email (str): email of an existing account in the "accounts" folder.
+        stream (bool): render new clips while their source is still downloading.
+        login (bool): log in again before scheduling, as the session expired.
+        scheduler (Scheduler): browser to post with, a new one is launched by default.
+        lookahead (timedelta): also render the clips of the slots that open up within this time.
+        render_lock (Lock): held while rendering, so concurrent callers render one at a time.
+        farm (RenderQueue): queue to publish the renders to, they are rendered here by default.
+        max_clips (int): most new clips to make, the other dates are left for a later turn
+            (see planner.plan_accounts). As many as there are dates by default.
+        get_scheduler (Callable): returns the browser to post with, only called if there is
+            something to schedule (ex: the warm browsers of the daemon).
     """
     logger.info(f"Initializing {email}...")
     account = Account(email)
 
+    # Finish the clips that were posted right before the previous run stopped
+    recover_posted_clips(account)
+
     # Get valid clip dates
-    valid_dates = get_valid_dates(account)
+    valid_dates = account.get_valid_dates(lookahead)
 
     # Check if there are no valid dates
     if not valid_dates:
@@ -237,33 +660,33 @@ def process_account_videos(email: str):
     # Get unused clips
     unused_clips = account.get_processed_videos()
 
-    # Calculate clips data
-    clips_data = calculate_clips_data(account, valid_dates, unused_clips)
-
-    # Schedule videos if any
-    schedule_videos(account, clips_data)
+    # The clips already made are scheduled, and only max_clips dates past them are filled
+    if max_clips is not None:
+        valid_dates = valid_dates[: len(unused_clips) + max_clips]
 
+    # Calculate clips data
+    with render_lock or nullcontext():
+        clips_data = calculate_clips_data(
+            account, valid_dates, unused_clips, stream, farm
+        )
 
-def get_valid_dates(account: Account) -> List[str]:
-    """
-    TikTok allows users to schedule videos up to 10 days in advance
+    # Clips rendered ahead of time wait in the output folder until their slot opens up
+    max_date = datetime.now() + timedelta(days=MAX_DAYS)
+    clips_data = [clip for clip in clips_data if clip["date"] <= max_date]
 
-    Returns:
-        List[str]: list of available dates to post a video
-    """
-    valid_dates = []
-    date = None
-    while True:
-        date = account.get_next_date(date)
-        if date:
-            valid_dates.append(date)
-        else:
-            break
-    return valid_dates
+    # Schedule videos if any, the browser is only launched then
+    if clips_data:
+        if scheduler is None and get_scheduler:
+            scheduler = get_scheduler()
+        schedule_videos(account, clips_data, login, scheduler)
 
 
 def calculate_clips_data(
-    account: Account, valid_dates: List[str], unused_clips: List[str]
+    account: Account,
+    valid_dates: List[str],
+    unused_clips: List[str],
+    stream: bool = False,
+    farm=None,
 ) -> List[dict]:
     """
     Pairs existing or newly created clips with valid dates.
@@ -300,41 +723,209 @@ def calculate_clips_data(
         else:
             break
 
+    # Videos a previous run did not finish are resumed before finding new ones
+    journal = Journal(account.email)
+    unfinished_ids = journal.get_unfinished_sources()
+
     # Generate new clips if needed
+    if valid_dates and not farm:
+        from clipper import make_clips
+
     while valid_dates:
+        if farm:
+            # Several videos are rendered at once on the farm
+            clips = render_on_farm(farm, account, journal, unfinished_ids, len(valid_dates))
+            if not clips:
+                break
+            n_posted = min(len(clips), len(valid_dates))
+            for clip in clips[:n_posted]:
+                clips_data.append({"path": clip, "date": valid_dates.pop(0)})
+            record_encodes(clips, n_posted)
+            continue
+
         # Create clips from a video
-        id = account.get_videos(1)[0]
+        if unfinished_ids:
+            id = unfinished_ids.pop(0)
+        else:
+            ids = account.get_videos(1, n_slots=len(valid_dates))
+            if not ids:
+                logger.warning(f"No unused videos left in the channels of {account.email}")
+                break
+            id = ids[0]
+            journal.record_source(id, "discovered")
         url = f"https://www.youtube.com/watch?v={id}"
 
+        # Only render as many clips as the budget allows, the rest are kept as recipes
+        limit = Inventory().get_render_budget(account.email)
+
+        # Only the parts that fill the dates are made, a partial video continues where it stopped.
+        # Streaming renders the whole video while it downloads, so it only applies to new videos
+        first_part = journal.get_source(id).get("next_part", 0)
+        parts = None if stream and not first_part else (first_part, first_part + len(valid_dates))
+
         logger.info(f"Creating clips from {url}...")
         clips = make_clips(
             url,
             account.email,
             account.secondary_content,
             account.subtitles,
+            stream,
+            limit,
+            parts,
         )
 
         # Pair up clips with as many valid dates left
-        for clip in clips:
-            if valid_dates:
-                clip_data = {"path": clip, "date": valid_dates.pop(0)}
-                clips_data.append(clip_data)
-            else:
-                break
+        n_posted = min(len(clips), len(valid_dates))
+        for clip in clips[:n_posted]:
+            clip_data = {"path": clip, "date": valid_dates.pop(0)}
+            clips_data.append(clip_data)
+        record_encodes(clips, n_posted)
 
     return clips_data
 
 
-def schedule_videos(account: Account, clips_data: List[dict]):
+def record_encodes(clips: List[str], n_posted: int):
+    """
+    Adds clips rendered for an account to the waste of the run, the clips after the first
+    n_posted were rendered but not scheduled. Recipes are not rendered yet, so they are
+    not counted.
+    """
+    from util import get_video_duration
+
+    inventory = Inventory()
+    rendered = []
+    for i, clip in enumerate(clips):
+        inventory_clip = inventory.get_clip(clip)
+        if os.path.exists(clip) and not (inventory_clip and inventory_clip.get("recipe")):
+            rendered.append((i, clip))
+
+    wasted_seconds = sum(get_video_duration(clip) for i, clip in rendered if i >= n_posted)
+    with encodes_lock:
+        encodes["clips"] += len(rendered)
+        encodes["posted"] += n_posted
+        encodes["wasted_seconds"] += wasted_seconds
+
+
+def get_waste_report() -> str | None:
+    """
+    Returns:
+        str | None: how many seconds were rendered for nothing (ex: "Rendered 14 clips, 12 were
+        scheduled: 1.9 wasted encode seconds per posted clip"), None if nothing was rendered.
+    """
+    with encodes_lock:
+        clips, posted, wasted_seconds = encodes["clips"], encodes["posted"], encodes["wasted_seconds"]
+
+    if not clips:
+        return None
+
+    ratio = wasted_seconds / posted if posted else wasted_seconds
+    return (
+        f"Rendered {clips} clips, {posted} were scheduled: "
+        f"{ratio:.1f} wasted encode seconds per posted clip"
+    )
+
+
+def render_on_farm(
+    farm, account: Account, journal: Journal, unfinished_ids: List[str], n_clips: int
+) -> List[str]:
+    """
+    Publishes enough videos to the farm to make some clips, and waits for them to be rendered.
+
+    Args:
+        farm (RenderQueue): queue of the farm.
+        unfinished_ids (List[str]): videos a previous run did not finish, they are published first.
+        n_clips (int): number of clips needed.
+
+    Returns:
+        List[str]: paths to the clips, in the order of the videos.
+    """
+    # Videos are at most video_length long, so at least this many are needed
+    max_parts = max(account.video_length // CLIP_DURATION, 1)
+    n_videos = math.ceil(n_clips / max_parts)
+
+    ids = unfinished_ids[:n_videos]
+    del unfinished_ids[:n_videos]
+    if len(ids) < n_videos:
+        # Each new video should fill its share of the clips left
+        n_slots = math.ceil((n_clips - len(ids) * max_parts) / (n_videos - len(ids)))
+        new_ids = account.get_videos(n_videos - len(ids), n_slots=max(n_slots, 1))
+        for id in new_ids:
+            journal.record_source(id, "discovered")
+        ids += new_ids
+
+    if not ids:
+        logger.warning(f"No unused videos left in the channels of {account.email}")
+        return []
+
+    # The render budget is shared between the videos
+    budget = Inventory().get_render_budget(account.email)
+    options = {
+        "secondary_content": account.secondary_content,
+        "captions": account.subtitles,
+        "limit": math.ceil(budget / len(ids)),
+    }
+
+    logger.info(f"Publishing {len(ids)} videos to the farm...")
+    job_ids = []
+    n_left = n_clips
+    for id in ids:
+        if n_left <= 0:
+            break
+
+        # Only the parts that fill the dates are made, a partial video continues where it
+        # stopped, and each video makes its share of them
+        source = journal.get_source(id)
+        first_part = source.get("next_part", 0)
+        n_parts = min(source.get("n_parts", first_part + max_parts) - first_part, n_left)
+        if n_parts <= 0:
+            continue
+        n_left -= n_parts
+
+        job_options = {**options, "parts": [first_part, first_part + n_parts]}
+        job_ids.append(
+            farm.publish(account.email, f"https://www.youtube.com/watch?v={id}", job_options)
+        )
+    with trace("farm.wait", jobs=len(job_ids)):
+        jobs = farm.wait(job_ids)
+
+    clips = []
+    for job in jobs:
+        if job["result"] is None:
+            logger.error(f"Could not render {job['url']}: {job['error']}")
+            continue
+        clips.extend(farm.import_artifacts(job))
+
+    if not clips:
+        raise RuntimeError("Every render job failed, see the errors above")
+
+    return clips
+
+
+def schedule_videos(
+    account: Account, clips_data: List[dict], login: bool = False, scheduler=None
+):
     """
     Handles the scheduling of videos, adding captions and saving the data to the account.
     """
-    scheduler = Scheduler(account)
+    if scheduler is None:
+        from Scheduler import Scheduler
+
+        scheduler = Scheduler(account, login=login)
+
+    inventory = Inventory()
+    journal = Journal(account.email)
     logger.info("Logging in to the TikTok...")
     for clip in clips_data:
         video_path = clip["path"]
         date = clip["date"]
 
+        # Clips kept as recipes are rendered right before uploading
+        inventory_clip = inventory.get_clip(video_path)
+        if inventory_clip and inventory_clip.get("recipe"):
+            from clipper import materialize_clip
+
+            materialize_clip(inventory_clip)
+
         logger.info(f"Scheduling the video for {date}...")
 
         # Create the caption for the video
@@ -343,13 +934,59 @@ def schedule_videos(account: Account, clips_data: List[dict]):
         part_number = int(video_name.split(",")[1]) + 1
         caption = generate_caption(id, f"Part {part_number}")
 
-        # Schedule the post and add it to the history
+        # Schedule the post and journal it straight away so it is never posted twice
         scheduler.post(video_path, caption, date)
+        journal.record_clip(video_path, "posted", id=id, date=date.isoformat())
+
+        finish_posted_clip(account, inventory, journal, video_path, id, date)
+
+    # Keep the cookies the browser renewed while posting, so the session stays fresh
+    account.cookies = scheduler.get_cookies()
+    account.save()
+
+
+def finish_posted_clip(
+    account: Account,
+    inventory: Inventory,
+    journal: Journal,
+    video_path: str,
+    id: str,
+    date: datetime,
+):
+    """
+    Adds a posted clip to the history and removes it from the output folder.
+    """
+    # The clip may already be in the history if the previous run stopped right after saving it
+    if not account.history.has_post(id, date):
         account.add_video_to_history(id, date)
 
-        # Remove video once posted
-        logger.info("Removing the video")
-        os.remove(video_path)
+    # Remove video once posted
+    logger.info("Removing the video")
+    os.remove(video_path)
+    inventory.remove(video_path)
+
+    # The source is done once none of its clips are left, nor parts to make
+    clips = inventory.get_account_clips(account.email)
+    partial = journal.get_source(id).get("state") == "partial"
+    if not partial and not any(clip["id"] == id for clip in clips):
+        journal.record_source(id, "posted")
+
+
+def recover_posted_clips(account: Account):
+    """
+    Finds the clips that were posted but not added to the history nor removed, because the
+    previous run stopped (ex: Chrome crashed), and finishes them without posting them again.
+    """
+    journal = Journal(account.email)
+    posted_clips = journal.get_posted_clips()
+    if not posted_clips:
+        return
+
+    logger.info(f"Recovering {len(posted_clips)} posted clips...")
+    inventory = Inventory()
+    for clip in posted_clips:
+        date = datetime.fromisoformat(clip["date"])
+        finish_posted_clip(account, inventory, journal, clip["key"], clip["id"], date)
 
 
 def generate_caption(id: str, part_text: str | None) -> str:
@@ -363,7 +1000,11 @@ def generate_caption(id: str, part_text: str | None) -> str:
     Returns:
         str: the caption
     """
-    r = requests.get(f"https://www.youtube.com/watch?v={id}")
+    from bs4 import BeautifulSoup
+    import requests
+
+    with trace("caption", id=id):
+        r = requests.get(f"https://www.youtube.com/watch?v={id}")
     soup = BeautifulSoup(r.text, features="html.parser")
 
     link = soup.find_all(name="title")[0]
@@ -0,0 +1,122 @@
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from typing import List
+import threading
+import json
+import os
+
+from constants import *
+
+# Pages served for each path of TikTok used by the Scheduler
+ROUTES = {
+    "/": "index.html",
+    "/creator": "creator.html",
+    "/creator.js": "creator.js",
+    urlparse(TIKTOK_LOGIN_PATH).path: "login.html",
+}
+
+
+class MockTikTokHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the static stand-in pages and records the posts submitted from the upload page.
+    """
+
+    server: "MockTikTokServer"
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+
+        if path == "/config.js":
+            # Settings of the upload page (see creator.js)
+            config = json.dumps(self.server.config)
+            self.send_content(f"window.MOCK = {config};".encode(), "text/javascript")
+        elif path in ROUTES:
+            with open(os.path.join(MOCK_TIKTOK_PATH, ROUTES[path]), "rb") as file:
+                content = file.read()
+            content_type = "text/javascript" if path.endswith(".js") else "text/html"
+            self.send_content(content, content_type)
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/api/post":
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        post = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.posts_lock:
+            self.server.posts.append(post)
+
+        self.send_content(b'{"status": "ok"}', "application/json")
+
+    def send_content(self, content: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # Keep the console clean while benchmarking
+        pass
+
+
+class MockTikTokServer(ThreadingHTTPServer):
+    """
+    Local HTTP server that mimics the TikTok login, upload, date-picker and time-picker DOM,
+    so the Scheduler can be driven without a network nor a real account.
+
+    Example:
+        server = MockTikTokServer(upload_latency=2)
+        server.start()
+        scheduler = Scheduler(account, base_url=server.url)
+    """
+
+    def __init__(
+        self,
+        port: int = 0,
+        upload_latency: float = 2,
+        bandwidth: float = 0,
+        alert: bool = False,
+        allow_modal: bool = True,
+    ) -> None:
+        """
+        Args:
+            port (int): port to listen on, a free one is picked by default.
+            upload_latency (float): seconds from choosing a file until it can be posted.
+            bandwidth (float): simulated upload speed in bytes per second, 0 to ignore the file size.
+            alert (bool): show the empty popup TikTok sometimes shows when loading the page.
+            allow_modal (bool): ask to allow scheduling the first time the switch is toggled.
+        """
+        super().__init__(("127.0.0.1", port), MockTikTokHandler)
+        self.config = {
+            "uploadLatency": upload_latency,
+            "bandwidth": bandwidth,
+            "alert": alert,
+            "allowModal": allow_modal,
+            "maxDays": MAX_DAYS,
+        }
+        self.posts: List[dict] = []
+        self.posts_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        """
+        Serves in a background thread.
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    server = MockTikTokServer(port=8000)
+    print(f"Serving the TikTok stand-in on {server.url}")
+    server.serve_forever()
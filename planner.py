@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+from typing import List, Tuple
+import heapq
+import logging
+
+from Account import Account
+from constants import *
+
+logger = logging.getLogger(__name__)
+
+
+def plan_accounts(
+    emails: List[str],
+    lookahead: timedelta = timedelta(0),
+    max_clips: int = PLANNER_MAX_CLIPS,
+    clip_seconds: float = PLANNER_CLIP_SECONDS,
+) -> dict:
+    """
+    Orders the work of several accounts earliest deadline first: the account whose schedule
+    runs dry first makes up to max_clips clips, then it waits for its next turn behind the
+    accounts whose next unfilled slot is earlier, so none of them takes all the render
+    capacity while another one is about to miss a post. The accounts that only have clips
+    waiting to be scheduled go first, as they don't render anything.
+
+    Args:
+        emails (List[str]): emails of existing accounts.
+        lookahead (timedelta): also plan the slots that can be scheduled within this time.
+        max_clips (int): clips made for an account per turn.
+        clip_seconds (float): estimated seconds to make and schedule a clip.
+
+    Returns:
+        dict: the turns, in order, and the slots predicted to be missed at that pace (ex:
+        {"turns": [{"email": "a@b.com", "clips": 3, "deadline": datetime(...)}, ...],
+        "misses": [{"email": "a@b.com", "slot": datetime(...)}, ...]}).
+    """
+    # Slots without a clip of each account, in a heap of their next one
+    slots = {}
+    queue: List[Tuple[datetime, str]] = []
+    turns = []
+    for email in emails:
+        account = Account(email)
+        open_slots = account.get_valid_dates(lookahead)
+        if not open_slots:
+            continue
+
+        # The clips waiting in the output folder (or as recipes) fill the first slots
+        slots[email] = open_slots[len(account.get_processed_videos()) :]
+        if slots[email]:
+            heapq.heappush(queue, (slots[email][0], email))
+        else:
+            # Only the waiting clips are scheduled, which takes no render capacity
+            turns.append({"email": email, "clips": 0, "deadline": open_slots[0]})
+
+    misses = []
+    finish = datetime.now()
+    while queue:
+        deadline, email = heapq.heappop(queue)
+        turn_slots = slots[email][:max_clips]
+        del slots[email][:max_clips]
+        # Consecutive turns of the same account are made at once
+        if turns and turns[-1]["email"] == email and turns[-1]["clips"]:
+            turns[-1]["clips"] += len(turn_slots)
+        else:
+            turns.append({"email": email, "clips": len(turn_slots), "deadline": deadline})
+
+        # Each clip is ready clip_seconds after the previous one, whichever account it is for
+        for slot in turn_slots:
+            finish += timedelta(seconds=clip_seconds)
+            if finish > slot:
+                misses.append({"email": email, "slot": slot})
+
+        if slots[email]:
+            heapq.heappush(queue, (slots[email][0], email))
+
+    return {"turns": turns, "misses": misses}
+
+
+def log_misses(plan: dict):
+    """
+    Warns about the slots of a plan that are predicted to be missed (see plan_accounts).
+    """
+    misses = plan["misses"]
+    if not misses:
+        logger.info(f"Planned {len(plan['turns'])} turns, no slot should be missed")
+        return
+
+    accounts = sorted({miss["email"] for miss in misses})
+    logger.warning(
+        f"{len(misses)} slots will likely be missed at the current render capacity "
+        f"(first at {misses[0]['slot']} for {misses[0]['email']}), accounts: {accounts}"
+    )
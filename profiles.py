@@ -0,0 +1,173 @@
+from typing import List
+import threading
+import logging
+import math
+import os
+
+from constants import *
+from runner import run_ffmpeg
+from tracer import trace
+from util import create_directory, get_video_duration
+
+logger = logging.getLogger(__name__)
+
+# Size of the clips encoded with a probed profile, and what they would have weighed before
+savings = {"clips": 0, "bytes": 0, "reference_bytes": 0}
+savings_lock = threading.Lock()
+
+
+def get_default_profile(encoder: str | None = None) -> dict:
+    """
+    Args:
+        encoder (str): FFmpeg video encoder of the clips, VIDEO_ENCODER by default.
+
+    Returns:
+        dict: profile of the final encode when the source wasn't probed (ex: {"encoder":
+        "h264_nvenc", "quality": 20, "maxrate": 5000, "reference_bitrate": None}).
+    """
+    # The longest clip must fit in UPLOAD_MAX_CLIP_BYTES
+    longest = CLIP_DURATION + BOUNDARY_TOLERANCE
+    maxrate = min(UPLOAD_MAX_BITRATE, int(UPLOAD_MAX_CLIP_BYTES * 8 / 1000 / longest))
+    return {
+        "encoder": encoder or VIDEO_ENCODER,
+        "quality": UPLOAD_REFERENCE_QUALITY,
+        "maxrate": maxrate,
+        "reference_bitrate": None,
+    }
+
+
+def get_output_profile(segments: List[str], encoder: str | None = None) -> dict:
+    """
+    Chooses the quality of the final encode of a source, from how hard a few seconds of some
+    of its segments are to compress. Complex sources get a lower quality so their clips stay
+    around UPLOAD_TARGET_BITRATE, simple ones keep UPLOAD_REFERENCE_QUALITY.
+
+    Args:
+        segments (List[str]): paths to the segments of the source.
+        encoder (str): FFmpeg video encoder of the clips, VIDEO_ENCODER by default.
+
+    Returns:
+        dict: the profile (ex: {"quality": 23, "maxrate": 5000, "reference_bitrate": 5200.0}),
+        the reference bitrate is the kbit/s the clips had with UPLOAD_REFERENCE_QUALITY.
+    """
+    profile = get_default_profile(encoder)
+    if not segments:
+        return profile
+
+    # Evenly spaced segments, ex: the first, middle and last
+    step = max(len(segments) / PROFILE_PROBE_SAMPLES, 1)
+    samples = [segments[int(i * step)] for i in range(min(PROFILE_PROBE_SAMPLES, len(segments)))]
+
+    with trace("profile_probe", samples=len(samples)):
+        bitrates = [probe_bitrate(segment, profile["encoder"]) for segment in samples]
+
+    reference_bitrate = sum(bitrates) / len(bitrates)
+    if not reference_bitrate:
+        return profile
+
+    # Each 6 steps of CRF/CQ halve the bitrate
+    quality = UPLOAD_REFERENCE_QUALITY + 6 * math.log2(reference_bitrate / UPLOAD_TARGET_BITRATE)
+    low, high = UPLOAD_QUALITY_RANGE
+    profile["quality"] = round(min(max(quality, low), high))
+    profile["reference_bitrate"] = reference_bitrate
+
+    logger.info(
+        f"Encoding at quality {profile['quality']} (the source needs "
+        f"{reference_bitrate:.0f} kbit/s at {UPLOAD_REFERENCE_QUALITY})"
+    )
+    return profile
+
+
+def probe_bitrate(segment_path: str, encoder: str | None = None) -> float:
+    """
+    Encodes PROFILE_PROBE_SECONDS from the middle of a segment at UPLOAD_REFERENCE_QUALITY,
+    with its audio as the clips are.
+
+    Returns:
+        float: bitrate of the sample in kbit/s.
+    """
+    duration = get_video_duration(segment_path)
+    seconds = min(PROFILE_PROBE_SECONDS, duration)
+    start = max(duration / 2 - seconds / 2, 0)
+
+    create_directory(TEMP_PATH)
+    sample_path = os.path.join(TEMP_PATH, f"probe_{os.path.basename(segment_path)}")
+    args = ["-ss", str(start), "-t", str(seconds), "-i", segment_path, "-c:a", "copy"]
+    encoder = encoder or VIDEO_ENCODER
+    args += ["-c:v", encoder, get_quality_option(encoder), str(UPLOAD_REFERENCE_QUALITY)]
+    run_ffmpeg("profile_probe", args + [sample_path])
+
+    size = os.path.getsize(sample_path)
+    os.remove(sample_path)
+    return size * 8 / 1000 / seconds if seconds else 0
+
+
+def get_output_args(profile: dict | None = None) -> List[str]:
+    """
+    Builds the video options of the final encode: quality, a bitrate ceiling so no clip is
+    oversized, and the index at the start of the file so uploads are processed sooner.
+
+    Returns:
+        List[str]: FFmpeg output options.
+    """
+    profile = profile or get_default_profile()
+    maxrate = profile["maxrate"]
+    return [
+        "-c:v",
+        profile["encoder"],
+        get_quality_option(profile["encoder"]),
+        str(profile["quality"]),
+        "-maxrate",
+        f"{maxrate}k",
+        "-bufsize",
+        f"{2 * maxrate}k",
+        "-movflags",
+        "+faststart",
+    ]
+
+
+def get_quality_option(encoder: str | None = None) -> str:
+    """
+    Returns:
+        str: constant quality option of an encoder (VIDEO_ENCODER by default), "-cq" for NVENC
+        and "-crf" for x264/x265.
+    """
+    return "-cq" if "nvenc" in (encoder or VIDEO_ENCODER) else "-crf"
+
+
+def record_upload_size(profile: dict | None, clip_path: str):
+    """
+    Adds the size of a clip to the savings, compared to its size at UPLOAD_REFERENCE_QUALITY.
+    """
+    if not profile or not profile["reference_bitrate"]:
+        return
+
+    size = os.path.getsize(clip_path)
+    reference_size = profile["reference_bitrate"] * 1000 / 8 * get_video_duration(clip_path)
+    with savings_lock:
+        savings["clips"] += 1
+        savings["bytes"] += size
+        savings["reference_bytes"] += int(reference_size)
+
+
+def get_savings_report() -> str | None:
+    """
+    Returns:
+        str | None: how many bytes less were uploaded (ex: "Saved 120.5 MB of uploads (-31%)
+        over 12 clips"), None if no clip was encoded with a probed profile.
+    """
+    with savings_lock:
+        clips, size, reference_size = (
+            savings["clips"],
+            savings["bytes"],
+            savings["reference_bytes"],
+        )
+
+    if not clips or not reference_size:
+        return None
+
+    saved = reference_size - size
+    return (
+        f"Saved {saved / 1024**2:.1f} MB of uploads ({-saved / reference_size:+.0%}) "
+        f"over {clips} clips"
+    )
@@ -0,0 +1,352 @@
+from contextlib import contextmanager
+from collections import deque
+from typing import Callable, Iterator, List, Tuple
+import subprocess
+import threading
+import signal
+import time
+import os
+
+from concurrency import controller
+from constants import *
+from tracer import trace
+
+
+# The resource usage of each process is read when it is reaped, only on Unix
+REAP_WITH_USAGE = hasattr(os, "wait4") and hasattr(os, "waitid")
+
+
+class FFmpegError(Exception):
+    """
+    Raised when FFmpeg or ffprobe exits with an error, times out or is cancelled.
+    """
+
+    def __init__(self, stage: str, message: str, stderr: str = "") -> None:
+        self.stage = stage
+        self.stderr = stderr
+        super().__init__(f"{stage}: {message}" + (f"\n{stderr}" if stderr else ""))
+
+
+def run_ffmpeg(
+    stage: str,
+    args: List[str],
+    on_progress: Callable[[dict], None] | None = None,
+    timeout: float | None = FFMPEG_TIMEOUT,
+    cancel: threading.Event | None = None,
+    stdin=None,
+    limited: bool = True,
+    log: List[str] | None = None,
+    outputs: List[int] | None = None,
+) -> dict:
+    """
+    Runs FFmpeg without a shell, inside a trace span that stores the frames, fps and speed it
+    reports. The arguments are passed as they are, so paths with spaces or commas are safe.
+
+    Args:
+        stage (str): name of the step (ex: "crop"), the span is named "ffmpeg.crop".
+        args (List[str]): arguments after "ffmpeg", the last one must be the output.
+        on_progress (Callable): called with each progress report as FFmpeg runs
+            (ex: {"frame": 120, "fps": 59.8, "speed": 2.01, "out_time": 4.0, "progress": "continue"})
+        timeout (float): seconds after which FFmpeg is stopped, None to wait forever.
+        cancel (threading.Event): FFmpeg is stopped as soon as it is set.
+        stdin: file FFmpeg reads pipe:0 from (ex: the stdout of yt-dlp).
+        limited (bool): wait for the concurrency controller to allow another FFmpeg process.
+            Long running processes that others depend on (ex: streaming) should not take a slot.
+        log (List[str]): filled with the lines FFmpeg logs at the info level (ex: the
+            measurements of loudnorm), only errors are logged otherwise.
+        outputs (List[int]): indexes in args of each output, when there are several (ex: the
+            outputs of segment_variants). The threads of the slot are shared between them.
+
+    Returns:
+        dict: the span of the run.
+
+    Raises:
+        FFmpegError: if FFmpeg failed, timed out or was cancelled.
+    """
+    slot = controller.slot() if limited else unlimited_slot()
+    with slot as threads:
+        # Threads of the encoders, the option must come right before each output
+        outputs = outputs or [len(args) - 1]
+        output_threads = str(max(threads // len(outputs), 1))
+        args = list(args)
+        for index in sorted(outputs, reverse=True):
+            args[index:index] = ["-threads", output_threads]
+
+        argv = [
+            "ffmpeg",
+            "-y",
+            "-hide_banner",
+            "-loglevel",
+            "error" if log is None else "info",
+            "-nostats",
+            "-progress",
+            "pipe:1",
+            *args,
+        ]
+        if stdin is None:
+            # Never wait for keys on the terminal
+            argv.insert(1, "-nostdin")
+
+        with trace(f"ffmpeg.{stage}", threads=threads) as span:
+            reports, usage = run_process(
+                stage, argv, on_progress, timeout, cancel, stdin, log
+            )
+            add_progress(span, reports)
+
+            # Only this FFmpeg process is measured, not the others running at the same time
+            span.update(usage)
+
+        controller.add_frames(span.get("frames", 0))
+
+    return span
+
+
+def run_ffprobe(args: List[str], timeout: float | None = FFPROBE_TIMEOUT) -> str:
+    """
+    Runs ffprobe without a shell.
+
+    Args:
+        args (List[str]): arguments after "ffprobe".
+
+    Returns:
+        str: what ffprobe wrote to stdout.
+
+    Raises:
+        FFmpegError: if ffprobe failed or timed out.
+    """
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        raise FFmpegError("probe", f"timed out after {timeout}s")
+
+    if result.returncode != 0:
+        raise FFmpegError(
+            "probe", f"exited with code {result.returncode}", result.stderr.strip()
+        )
+    return result.stdout
+
+
+def run_process(
+    stage: str,
+    argv: List[str],
+    on_progress: Callable[[dict], None] | None,
+    timeout: float | None,
+    cancel: threading.Event | None,
+    stdin,
+    log: List[str] | None = None,
+) -> Tuple[List[dict], dict]:
+    """
+    Runs FFmpeg, reading its progress reports from stdout as they are written.
+
+    Returns:
+        Tuple[List[dict], dict]: the progress reports (see parse_report), and the resource
+        usage of FFmpeg (see wait_process).
+    """
+    process = subprocess.Popen(
+        argv,
+        stdin=stdin,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+    # Keep the end of stderr to explain failures, reading it so FFmpeg never blocks on it
+    errors = deque(maxlen=FFMPEG_ERROR_LINES)
+    outputs = (errors, log) if log is not None else (errors,)
+    reader = threading.Thread(
+        target=read_lines, args=(process.stderr, outputs), daemon=True
+    )
+    reader.start()
+
+    # Stop FFmpeg if it takes too long or the caller cancels it, it is only signalled while
+    # holding the lock and before it is reaped, so a reused PID is never signalled
+    stopped = {}
+    exited = threading.Event()
+    lock = threading.Lock()
+    watcher = threading.Thread(
+        target=watch_process,
+        args=(process, timeout, cancel, stopped, exited, lock),
+        daemon=True,
+    )
+    watcher.start()
+
+    reports = []
+    report = {}
+    for line in process.stdout:
+        if "=" not in line:
+            continue
+
+        key, value = line.split("=", 1)
+        report[key.strip()] = value.strip()
+
+        # Each report ends with progress=continue or progress=end
+        if key == "progress":
+            reports.append(parse_report(report))
+            if on_progress:
+                on_progress(reports[-1])
+            report = {}
+
+    usage = wait_process(process, exited, lock)
+    reader.join()
+
+    stderr = "".join(errors).strip()
+    if "reason" in stopped:
+        raise FFmpegError(stage, stopped["reason"], stderr)
+    if process.returncode != 0:
+        raise FFmpegError(stage, f"exited with code {process.returncode}", stderr)
+
+    return reports, usage
+
+
+def wait_process(
+    process: subprocess.Popen, exited: threading.Event, lock: threading.Lock
+) -> dict:
+    """
+    Waits for a process to exit and reads the resources it used, which are only known
+    when it is reaped. exited is set once it is reaped, while holding the lock.
+
+    Returns:
+        dict: CPU seconds, peak resident memory (in KB) and bytes read and written by the
+        process (ex: {"cpu_time": 11.9, "child_peak_rss_kb": 412000, "read_bytes": 0,
+        "write_bytes": 4096}), empty where os.wait4 isn't available.
+    """
+    if not REAP_WITH_USAGE:
+        process.wait()
+        exited.set()
+        return {}
+
+    # Wait without reaping, the PID stays taken until it is reaped under the lock
+    os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+    with lock:
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        exited.set()
+
+    # Block I/O is counted in 512 byte blocks
+    return {
+        "cpu_time": usage.ru_utime + usage.ru_stime,
+        "child_peak_rss_kb": usage.ru_maxrss,
+        "read_bytes": usage.ru_inblock * 512,
+        "write_bytes": usage.ru_oublock * 512,
+    }
+
+
+def read_lines(file, outputs: tuple):
+    """
+    Appends every line of a file to each of the outputs until it is closed.
+    """
+    for line in file:
+        for output in outputs:
+            output.append(line)
+
+
+def watch_process(
+    process: subprocess.Popen,
+    timeout: float | None,
+    cancel: threading.Event | None,
+    stopped: dict,
+    exited: threading.Event,
+    lock: threading.Lock,
+):
+    """
+    Terminates a process once it times out or is cancelled, and kills it if it doesn't exit.
+    The process is reaped by run_process, which sets exited (see wait_process).
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while not exited.wait(FFMPEG_WATCH_INTERVAL):
+        if cancel is not None and cancel.is_set():
+            stopped["reason"] = "cancelled"
+        elif deadline is not None and time.monotonic() > deadline:
+            stopped["reason"] = f"timed out after {timeout}s"
+        else:
+            continue
+
+        signal_process(process, exited, lock)
+        if not exited.wait(FFMPEG_KILL_TIMEOUT):
+            signal_process(process, exited, lock, kill=True)
+        return
+
+
+def signal_process(
+    process: subprocess.Popen,
+    exited: threading.Event,
+    lock: threading.Lock,
+    kill: bool = False,
+):
+    """
+    Terminates, or kills, a process that wasn't reaped yet. Popen.terminate would reap it
+    and lose its resource usage, so the signal is sent to its PID where os.wait4 is used.
+    """
+    with lock:
+        if exited.is_set():
+            return
+
+        if REAP_WITH_USAGE:
+            os.kill(process.pid, signal.SIGKILL if kill else signal.SIGTERM)
+        elif kill:
+            process.kill()
+        else:
+            process.terminate()
+
+
+def parse_report(report: dict) -> dict:
+    """
+    Converts the values of a progress report to numbers.
+
+    Returns:
+        dict: the report (ex: {"frame": 120, "fps": 59.8, "speed": 2.01, "out_time": 4.0, "progress": "continue"})
+    """
+    parsed = dict(report)
+    for key, convert in (("frame", int), ("fps", float)):
+        try:
+            parsed[key] = convert(report[key])
+        except (KeyError, ValueError):
+            parsed[key] = 0
+
+    try:
+        parsed["speed"] = float(report.get("speed", "").removesuffix("x"))
+    except ValueError:
+        parsed["speed"] = 0.0
+
+    # Microseconds of output written so far
+    try:
+        parsed["out_time"] = int(report["out_time_us"]) / 1e6
+    except (KeyError, ValueError):
+        parsed["out_time"] = 0.0
+
+    return parsed
+
+
+def add_progress(span: dict, reports: List[dict]):
+    """
+    Stores the frames, fps and speed of an FFmpeg run in its span.
+
+    Args:
+        span (dict): span of the FFmpeg invocation.
+        reports (List[dict]): progress reports of the run (see parse_report).
+    """
+    if not reports:
+        return
+
+    # The fps is N/A, read as 0, until the first frame is encoded
+    fps = [report["fps"] for report in reports if report["fps"] > 0]
+    last = reports[-1]
+
+    span["frames"] = last["frame"]
+    span["fps"] = max(fps) if fps else 0.0
+    span["mean_fps"] = sum(fps) / len(fps) if fps else 0.0
+    span["speed"] = last["speed"]
+
+
+@contextmanager
+def unlimited_slot() -> Iterator[int]:
+    """
+    Stands in for a slot of the concurrency controller when the process is not limited.
+    """
+    yield controller.threads
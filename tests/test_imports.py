@@ -0,0 +1,8 @@
+from benchmark import measure_imports
+from constants import IMPORT_TIME_BUDGET
+
+
+def test_main_import():
+    import_time, heavy = measure_imports()
+    assert heavy == []
+    assert import_time <= IMPORT_TIME_BUDGET
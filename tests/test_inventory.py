@@ -0,0 +1,30 @@
+import os
+
+from constants import OUTPUT_PATH
+from Inventory import Inventory, reset_pruning
+
+
+def test_load_drops_deleted_clips(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(OUTPUT_PATH)
+
+    kept = os.path.join(OUTPUT_PATH, "a@b.com,0,XQIu5tZ0vbQ.mp4")
+    deleted = os.path.join(OUTPUT_PATH, "a@b.com,1,XQIu5tZ0vbQ.mp4")
+    recipe = os.path.join(OUTPUT_PATH, "a@b.com,2,XQIu5tZ0vbQ.mp4")
+    for path in (kept, deleted):
+        with open(path, "wb") as file:
+            file.write(b"clip")
+
+    inventory = Inventory()
+    inventory.add("a@b.com", "XQIu5tZ0vbQ", 0, kept)
+    inventory.add("a@b.com", "XQIu5tZ0vbQ", 1, deleted)
+    inventory.add(
+        "a@b.com", "XQIu5tZ0vbQ", 2, recipe, recipe={"url": "...", "segment": "..."}
+    )
+
+    # Deleted by hand, the manifest still lists it until the next run
+    os.remove(deleted)
+    reset_pruning()
+
+    clips = Inventory().get_account_clips("a@b.com")
+    assert [clip["part"] for clip in clips] == [0, 2]
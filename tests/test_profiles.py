@@ -0,0 +1,16 @@
+import benchmark
+import profiles
+from constants import VIDEO_ENCODER
+
+
+def test_benchmark_encoder_override(monkeypatch):
+    monkeypatch.setattr(profiles, "VIDEO_ENCODER", VIDEO_ENCODER)
+    benchmark.use_encoder("libx264")
+
+    args = profiles.get_output_args(profiles.get_default_profile())
+    assert args[:3] == ["-c:v", "libx264", "-crf"]
+
+
+def test_encoder_argument():
+    args = profiles.get_output_args(profiles.get_default_profile("h264_nvenc"))
+    assert args[:3] == ["-c:v", "h264_nvenc", "-cq"]
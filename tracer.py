@@ -0,0 +1,157 @@
+from contextlib import contextmanager
+from typing import Iterator, List
+import threading
+import json
+import time
+import os
+
+try:
+    # Only available on Unix, the child process stats are skipped elsewhere
+    import resource
+except ImportError:
+    resource = None
+
+# Finished spans of the current run
+spans: List[dict] = []
+spans_lock = threading.Lock()
+
+# Open spans of each thread, to link children with their parent
+local = threading.local()
+
+
+def read_io() -> dict:
+    """
+    Returns:
+        dict: bytes read and written by this process and its waited-for children.
+    """
+    io = {"read_bytes": 0, "write_bytes": 0}
+    try:
+        with open("/proc/self/io", "r") as file:
+            for line in file:
+                key, value = line.split(":")
+                if key in io:
+                    io[key] = int(value)
+    except OSError:
+        pass
+
+    # Block I/O of finished children (ex: FFmpeg), in 512 byte blocks
+    if resource:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        io["read_bytes"] += usage.ru_inblock * 512
+        io["write_bytes"] += usage.ru_oublock * 512
+
+    return io
+
+
+def read_cpu() -> float:
+    """
+    Returns:
+        float: CPU seconds used by this process and its finished children.
+    """
+    cpu = time.process_time()
+    if resource:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu += usage.ru_utime + usage.ru_stime
+    return cpu
+
+
+@contextmanager
+def trace(name: str, **attrs) -> Iterator[dict]:
+    """
+    Measures a stage of the pipeline (ex: with trace("download", id=id): ...).
+
+    Records wall time, CPU time (including child processes such as FFmpeg), and bytes read
+    and written. Extra attributes can be added to the yielded span while it is open, the
+    measurements set there are kept (ex: the usage of a single FFmpeg process, see
+    runner.run_process).
+
+    Args:
+        name (str): name of the stage (ex: "ffmpeg.crop", "scheduler.post")
+        attrs: extra attributes stored with the span (ex: id="XQIu5tZ0vbQ")
+    """
+    stack = getattr(local, "stack", None)
+    if stack is None:
+        stack = local.stack = []
+
+    span = {
+        "name": name,
+        "parent": stack[-1]["name"] if stack else None,
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+        "start": time.time(),
+        **attrs,
+    }
+    stack.append(span)
+
+    start_wall = time.perf_counter()
+    start_cpu = read_cpu()
+    start_io = read_io()
+    try:
+        yield span
+    except BaseException as e:
+        span["error"] = repr(e)
+        raise
+    finally:
+        end_io = read_io()
+        span["wall_time"] = time.perf_counter() - start_wall
+        span.setdefault("cpu_time", read_cpu() - start_cpu)
+        span.setdefault("read_bytes", end_io["read_bytes"] - start_io["read_bytes"])
+        span.setdefault("write_bytes", end_io["write_bytes"] - start_io["write_bytes"])
+
+        stack.pop()
+        with spans_lock:
+            spans.append(span)
+
+
+def pop_spans() -> List[dict]:
+    """
+    Takes the finished spans, so long running processes don't keep them all in memory.
+
+    Returns:
+        List[dict]: the spans finished since the last call.
+    """
+    with spans_lock:
+        finished = list(spans)
+        spans.clear()
+    return finished
+
+
+def export(
+    path: str, chrome_path: str | None = None, finished: List[dict] | None = None
+):
+    """
+    Writes the spans of the run as JSON lines, and optionally as a Chrome trace-event file
+    that can be opened in chrome://tracing or Perfetto.
+
+    Args:
+        path (str): JSON lines file, spans are appended to it.
+        chrome_path (str): trace-event file, it is overwritten.
+        finished (List[dict]): spans to write, all the finished spans by default.
+    """
+    if finished is None:
+        with spans_lock:
+            finished = list(spans)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as file:
+        for span in finished:
+            file.write(json.dumps(span, default=str) + "\n")
+
+    if chrome_path:
+        events = []
+        for span in finished:
+            events.append(
+                {
+                    "name": span["name"],
+                    "ph": "X",
+                    "ts": span["start"] * 1e6,
+                    "dur": span["wall_time"] * 1e6,
+                    "pid": span["pid"],
+                    "tid": span["tid"],
+                    "args": span,
+                }
+            )
+
+        os.makedirs(os.path.dirname(chrome_path) or ".", exist_ok=True)
+        with open(chrome_path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": events}, file, default=str)
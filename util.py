@@ -1,10 +1,13 @@
-from typing import Tuple
+from typing import List, Tuple
 import subprocess
-import yt_dlp
+import sys
 import os
 import re
 import random
 
+from runner import run_ffprobe
+from tracer import trace
+
 
 def create_directory(directory):
     """
@@ -87,13 +90,63 @@ def download_youtube_video(
             }
         )
 
+    # yt-dlp takes a while to import, so it is only loaded when needed
+    import yt_dlp
+
     # Download the video using yt-dlp
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+    with trace("download", url=url) as span, yt_dlp.YoutubeDL(ydl_opts) as ydl:
         ydl.download([url])
 
+    # The size of each second of video is used to estimate later runs (see estimator)
+    span["bytes"] = os.path.getsize(file_path)
+    span["seconds"] = get_video_duration(file_path)
+
     return file_path
 
 
+def get_video_info(url: str, format: str = "best") -> dict:
+    """
+    Fetches the metadata of a video without downloading it.
+
+    Args:
+        url (str): The URL of the video.
+        format (str): yt-dlp format selector, the width and height in the result belong to this format.
+
+    Returns:
+        dict: yt-dlp info dict (ex: {"duration": 312, "width": 1280, "height": 720, ...})
+    """
+    import yt_dlp
+
+    with yt_dlp.YoutubeDL({"format": format, "quiet": True}) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+def open_video_stream(url: str, format: str = "best") -> subprocess.Popen:
+    """
+    Starts downloading a video to a pipe instead of a file, so it can be read while it is still being fetched.
+
+    Args:
+        url (str): The URL of the video.
+        format (str): yt-dlp format selector. Progressive or fragmented formats are needed for the pipe to be readable.
+
+    Returns:
+        subprocess.Popen: yt-dlp process, the video is written to its stdout.
+    """
+    cmd = [
+        sys.executable,
+        "-m",
+        "yt_dlp",
+        "--quiet",
+        "--no-part",
+        "-f",
+        format,
+        "-o",
+        "-",
+        url,
+    ]
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE)
+
+
 def get_video_duration(video_path: str) -> float:
     """
     Get the duration of a video file.
@@ -101,15 +154,12 @@ def get_video_duration(video_path: str) -> float:
     Returns:
         float: Duration of the video in seconds.
     """
-    cmd = f"ffprobe -v error -show_entries format=duration -of default=noprint_wrappers=1:nokey=1 {video_path}"
-    result = subprocess.run(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.DEVNULL,
-    )
+    args = ["-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1"]
+    with trace("probe", path=video_path):
+        output = run_ffprobe(args + [video_path])
 
     # Convert duration to float
-    return float(result.stdout)
+    return float(output)
 
 
 def get_video_dimensions(video_path: str) -> Tuple[int, int]:
@@ -122,16 +172,29 @@ def get_video_dimensions(video_path: str) -> Tuple[int, int]:
     Returns:
         Tuple[int, int]: Width and height of the video.
     """
-    cmd = f"ffprobe -v error -select_streams v:0 -show_entries stream=width,height -of csv=s=x:p=0 {video_path}"
-    result = subprocess.run(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    print(result)
+    args = ["-select_streams", "v:0", "-show_entries", "stream=width,height", "-of", "csv=s=x:p=0"]
+    with trace("probe", path=video_path):
+        output = run_ffprobe(args + [video_path])
+
     # Parse dimensions from the result
-    dimensions = result.stdout.strip().split("x")
+    dimensions = output.strip().split("x")
     width, height = int(dimensions[0]), int(dimensions[1])
 
     return width, height
+
+
+def get_section_args(section: Tuple[float, float] | None) -> List[str]:
+    """
+    Builds the input options that seek in to a section of a video.
+
+    Args:
+        section (Tuple[float, float]): start and end of the section (in seconds), None for the whole video.
+
+    Returns:
+        List[str]: FFmpeg options to place before the "-i" of the video.
+    """
+    if not section:
+        return []
+
+    start, end = section
+    return ["-ss", f"{start:.2f}", "-t", f"{end - start:.2f}"]